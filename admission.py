@@ -0,0 +1,116 @@
+import threading
+import time
+from array import array
+
+from outbox import TokenBucket
+
+# Лимит дорогих запросов (с обращениями к HH.ru) одного чата: маркеров в секунду и запас на всплеск
+CHAT_RATE = 0.5
+CHAT_BURST = 5
+
+# Общий лимит дорогих запросов всех чатов, чтобы не выбрать квоту HH.ru
+GLOBAL_RATE = 20
+GLOBAL_BURST = 40
+
+# Когда общая корзина пустеет, лимит чата снижается пропорционально, но не ниже этой доли
+MIN_CHAT_SHARE = 0.1
+
+# Размер таблицы корзин чатов: чат попадает в ячейку по хешу ID,
+# редкие совпадения ячеек лишь делят лимит между двумя чатами
+ADMISSION_SLOTS = 16384
+
+# Как часто отвечать на отклоненные сообщения одного чата, секунд
+REJECT_NOTICE_INTERVAL = 10
+
+
+class AdmissionControl:
+    """
+    Допуск дорогих запросов: маркерная корзина на каждый чат (в массивах фиксированного
+    размера) и общая корзина на всех. Лимит чата адаптивный - пополнение замедляется,
+    когда общая корзина пустеет. Повторный запрос того же вида от чата, пока первый
+    еще выполняется, не допускается
+    """
+
+    def __init__(self, rate=CHAT_RATE, burst=CHAT_BURST, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 slots=ADMISSION_SLOTS):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self.admitted = 0
+        self.limited = 0
+        self.coalesced = 0
+        self._tokens = array('f', [burst]) * slots
+        self._updated = array('d', [0.0]) * slots
+        self._noticed = array('d', [0.0]) * slots
+        self._global = TokenBucket(global_rate, global_burst)
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def admit(self, chat_id, key):
+        """
+        Пытается допустить запрос key от чата. Возвращает 0, если запрос допущен
+        (после выполнения нужно вызвать release), иначе - через сколько секунд
+        его можно повторить; None - такой же запрос чата еще выполняется
+        """
+        now = time.monotonic()
+        slot = hash(chat_id) % self.slots
+        with self._lock:
+            if key in self._in_flight:
+                self.coalesced += 1
+                return None
+
+            global_wait = self._global.wait_time(now)
+            tokens, rate = self._chat_tokens(slot, now)
+            self._updated[slot] = now
+            self._tokens[slot] = tokens
+            if tokens < 1 or global_wait:
+                self.limited += 1
+                return max((1 - tokens) / rate, global_wait)
+
+            self._tokens[slot] = tokens - 1
+            self._global.consume()
+            self._in_flight.add(key)
+            self.admitted += 1
+            return 0
+
+    def _chat_tokens(self, slot, now):
+        """Маркеры в корзине чата на момент now и текущая скорость ее пополнения"""
+        rate = self.rate * max(MIN_CHAT_SHARE, self._global.tokens / self._global.capacity)
+        return min(self.burst, self._tokens[slot] + (now - self._updated[slot]) * rate), rate
+
+    def check(self, chat_id, key):
+        """
+        То же, что вернул бы admit, но без расхода маркеров и без учета в статистике:
+        проверка перед работой, которая выполняется до самого запроса (предзагрузка)
+        """
+        now = time.monotonic()
+        slot = hash(chat_id) % self.slots
+        with self._lock:
+            if key in self._in_flight:
+                return None
+            global_wait = self._global.wait_time(now)
+            tokens, rate = self._chat_tokens(slot, now)
+            if tokens < 1 or global_wait:
+                return max((1 - tokens) / rate, global_wait)
+            return 0
+
+    def release(self, key):
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def should_notify(self, chat_id):
+        """Отвечать ли чату на отклоненный запрос: не чаще раза в REJECT_NOTICE_INTERVAL"""
+        now = time.monotonic()
+        slot = hash(chat_id) % self.slots
+        with self._lock:
+            if now - self._noticed[slot] < REJECT_NOTICE_INTERVAL:
+                return False
+            self._noticed[slot] = now
+            return True
+
+    def stats(self):
+        return {
+            'admitted': self.admitted,
+            'limited': self.limited,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,166 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+# Файл с локальной копией справочника регионов HH.ru
+AREAS_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'areas_cache.json.gz')
+
+# Через сколько секунд справочник считается устаревшим и обновляется в фоне
+AREAS_TTL = 7 * 24 * 60 * 60
+
+
+def flatten_areas(areas_tree):
+    """
+    Превращает дерево регионов из /areas в плоский список строк [id, parent_id, name]
+    (порядок обхода в глубину, как у прежнего рекурсивного поиска)
+    """
+    rows = []
+    stack = [(area, None) for area in reversed(areas_tree)]
+    while stack:
+        area, parent_id = stack.pop()
+        rows.append([area['id'], parent_id, area['name']])
+        children = area.get('areas') or []
+        for child in reversed(children):
+            stack.append((child, area['id']))
+    return rows
+
+
+class AreaDirectory:
+    """
+    Справочник регионов HH.ru: загружается один раз, хранится на диске
+    в сжатом виде и обновляется в фоне по истечении TTL
+    """
+
+    def __init__(self, fetch_tree, path=AREAS_CACHE_FILE, ttl=AREAS_TTL):
+        self.fetch_tree = fetch_tree
+        self.path = path
+        self.ttl = ttl
+        self.saved_at = 0
+        self.names = {}
+        self.parents = {}
+        self.children = {}
+        self.index = {}
+        self._lock = threading.Lock()
+        # Первая загрузка выполняется одним потоком, остальные ждут ее результата
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        # Источник справочника до чтения файла: load() -> {'saved_at', 'rows'} или None (снимок состояния)
+        self.preload = None
+
+    def _build(self, rows, saved_at):
+        """Строит индексы по списку строк справочника"""
+        names = {}
+        parents = {}
+        children = {}
+        index = {}
+        for area_id, parent_id, name in rows:
+            names[area_id] = name
+            parents[area_id] = parent_id
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(area_id)
+            # Первое совпадение выигрывает, как при обходе дерева
+            index.setdefault(name.lower(), area_id)
+        self.names, self.parents, self.children, self.index = names, parents, children, index
+        self.saved_at = saved_at
+
+    def _load_from_disk(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            self._build(data['rows'], data['saved_at'])
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Не удалось прочитать кэш регионов: {e}")
+            return False
+
+    def _load_preloaded(self):
+        try:
+            data = self.preload()
+            if data:
+                self._build(data['rows'], data['saved_at'])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Не удалось восстановить справочник регионов из снимка: {e}")
+        self.preload = None
+
+    def export(self):
+        """Справочник для снимка состояния: {'saved_at', 'rows'} или None, если он не загружен"""
+        with self._lock:
+            names, parents, saved_at = self.names, self.parents, self.saved_at
+        if not names:
+            return None
+        # Словари хранят порядок обхода дерева, поэтому строки восстанавливаются в прежнем порядке
+        return {'saved_at': saved_at, 'rows': [[area_id, parents[area_id], name] for area_id, name in names.items()]}
+
+    def _save_to_disk(self, rows, saved_at):
+        tmp_path = self.path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({'saved_at': saved_at, 'rows': rows}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Скачивает справочник заново и сохраняет его на диск"""
+        rows = flatten_areas(self.fetch_tree())
+        saved_at = time.time()
+        with self._lock:
+            self._build(rows, saved_at)
+        try:
+            self._save_to_disk(rows, saved_at)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш регионов: {e}")
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Ошибка обновления справочника регионов: {e}")
+        finally:
+            self._refreshing = False
+
+    def load_local(self):
+        """
+        Загружает справочник из снимка или с диска, если он еще не загружен, без обращения
+        к HH.ru. Возвращает True, если справочник загружен
+        """
+        if not self.index:
+            with self._lock:
+                if not self.index and self.preload is not None:
+                    self._load_preloaded()
+                if not self.index and os.path.exists(self.path):
+                    self._load_from_disk()
+        return bool(self.index)
+
+    def ensure_loaded(self):
+        """Гарантирует, что справочник загружен; устаревший обновляется в фоне"""
+        if not self.index:
+            with self._load_lock:
+                # Одновременные первые вызовы скачивают /areas один раз
+                if not self.load_local():
+                    self.refresh()
+                    return
+
+        if time.time() - self.saved_at > self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def find_id(self, name):
+        """Возвращает ID региона по точному названию (без учета регистра) или None"""
+        self.ensure_loaded()
+        return self.index.get(name.strip().lower())
+
+    def get_name(self, area_id):
+        """Возвращает название региона по его ID"""
+        self.ensure_loaded()
+        return self.names.get(area_id)
+
+    def descendants(self, area_id):
+        """ID региона и всех вложенных в него регионов"""
+        self.ensure_loaded()
+        result = [area_id]
+        stack = [area_id]
+        while stack:
+            for child_id in self.children.get(stack.pop(), ()):
+                result.append(child_id)
+                stack.append(child_id)
+        return result
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from telebot import apihelper, types
+
+from updates import update_chat_id
+
+# Таймаут long polling запроса getUpdates (секунды)
+POLL_TIMEOUT = 30
+
+# Потоки для синхронных обработчиков: они только формируют ответы,
+# а ожидание HH.ru происходит на событийном цикле
+HANDLER_WORKERS = 8
+
+# Сколько обновлений может обрабатываться одновременно
+MAX_CONCURRENT_UPDATES = 500
+
+# Общие ограничения для неблокирующих HTTP-запросов
+HTTP_CONNECTION_LIMIT = 100
+HTTP_TIMEOUT = 10
+
+
+class AsyncRuntime:
+    """
+    Асинхронный режим работы бота: обновления Telegram получаются и
+    распределяются на событийном цикле, запросы к HH.ru выполняются
+    неблокирующим HTTP-клиентом (хук prefetch), а существующие обработчики
+    и клавиатуры запускаются в небольшом пуле потоков.
+    Обновления одного чата обрабатываются строго по порядку
+    """
+
+    def __init__(self, bot, prefetch=None, workers=HANDLER_WORKERS,
+                 max_updates=MAX_CONCURRENT_UPDATES, poll_timeout=POLL_TIMEOUT):
+        self.bot = bot
+        self.prefetch = prefetch
+        self.workers = workers
+        self.max_updates = max_updates
+        self.poll_timeout = poll_timeout
+        self.http = None
+        self._executor = None
+        self._limit = None
+        self._chat_locks = {}
+        self._tasks = set()
+
+    def run(self):
+        """Запускает бота до прерывания (Ctrl+C)"""
+        asyncio.run(self.main())
+
+    async def main(self):
+        # Обработчики запускаются нашим пулом, а не внутренним пулом TeleBot
+        self.bot.threaded = False
+        self.bot.remove_webhook()
+
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='handler')
+        self._limit = asyncio.Semaphore(self.max_updates)
+        connector = aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            self.http = http
+            try:
+                await self.poll()
+            finally:
+                self._executor.shutdown(wait=False)
+
+    async def poll(self):
+        """Получает обновления через long polling и запускает их обработку"""
+        url = apihelper.API_URL.format(self.bot.token, 'getUpdates')
+        timeout = aiohttp.ClientTimeout(total=self.poll_timeout + HTTP_TIMEOUT)
+        offset = None
+
+        while True:
+            params = {
+                'timeout': self.poll_timeout,
+                'allowed_updates': json.dumps(['message', 'callback_query'])
+            }
+            if offset is not None:
+                params['offset'] = offset
+
+            try:
+                async with self.http.get(url, params=params, timeout=timeout) as response:
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                print(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not data.get('ok'):
+                print(f"Ошибка получения обновлений: {data.get('description')}")
+                await asyncio.sleep(1)
+                continue
+
+            for raw_update in data['result']:
+                offset = raw_update['update_id'] + 1
+                await self.submit(types.Update.de_json(raw_update))
+
+    async def submit(self, update):
+        """Ставит обновление в обработку; ждет, если обрабатывается слишком много"""
+        await self._limit.acquire()
+        task = asyncio.create_task(self.handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def handle(self, update):
+        chat_id = update_chat_id(update)
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                if self.prefetch is not None:
+                    try:
+                        await self.prefetch(update, self.http)
+                    except Exception as e:
+                        print(f"Ошибка предзагрузки: {e}")
+
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._executor, self.bot.process_new_updates, [update])
+        except Exception as e:
+            print(f"Ошибка обработки обновления: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+            self._limit.release()
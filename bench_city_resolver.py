@@ -0,0 +1,104 @@
+"""
+Микробенчмарк поиска городов CityResolver на справочнике размером с /areas HH.ru:
+точные, префиксные запросы и запросы с опечатками. Проверяет, что город находится
+по запросу с одной опечаткой и что медиана поиска с опечатками укладывается в бюджет.
+Запуск: python bench_city_resolver.py
+"""
+import random
+import time
+
+from city_resolver import CityResolver, normalize_name
+
+AREAS = 12000
+QUERIES = 2000
+
+# Бюджет медианы поиска с опечатками, мс
+TYPO_BUDGET_MS = 1.0
+
+PREFIXES = ('', '', '', 'Ново', 'Старо', 'Верхне', 'Нижне', 'Красно', 'Бело', 'Усть-', 'Большая ', 'Малая ')
+ROOTS = ('мос', 'волг', 'сибир', 'камен', 'берез', 'сосн', 'кур', 'орл', 'твер', 'ряз', 'клин', 'луг', 'озер',
+         'горн', 'речн', 'лес', 'яблон', 'вишн', 'тагил', 'урал', 'донск', 'кубан', 'ольх', 'дуб', 'кедр', 'слав',
+         'петр', 'алекс', 'иван', 'михайл', 'никол', 'андре', 'серг', 'дмитр', 'влад', 'бор', 'глеб', 'мир', 'свет',
+         'ярос', 'кост', 'тамб', 'пенз', 'самар', 'сарат', 'омск', 'томск', 'кемер', 'магн', 'челяб', 'перм', 'вят')
+MIDDLES = ('', 'ов', 'ин', 'ен', 'ан', 'ол', 'ер', 'ич', 'уш', 'ян')
+SUFFIXES = ('ск', 'ово', 'ино', 'евка', 'овка', 'ий', 'ое', 'ая', 'инск', 'град', 'поль', 'город', 'ец', 'ики')
+SECOND_WORDS = ('Новгород', 'Посад', 'Городок', 'Луки', 'Камень', 'Бор')
+
+
+class SampleDirectory:
+    """Справочник регионов, похожий на /areas: много похожих названий из общих корней"""
+
+    def __init__(self, size, rng):
+        self.names = {'113': 'Россия', '1': 'Москва', '2': 'Санкт-Петербург', '3': 'Екатеринбург',
+                      '4': 'Новосибирск', '66': 'Нижний Новгород'}
+        self.parents = {area_id: '113' for area_id in self.names}
+        self.parents['113'] = None
+        while len(self.names) < size:
+            name = rng.choice(PREFIXES) + rng.choice(ROOTS) + rng.choice(MIDDLES) + rng.choice(SUFFIXES)
+            if rng.random() < 0.1:
+                name += ' ' + rng.choice(SECOND_WORDS)
+            area_id = str(1000 + len(self.names))
+            self.names[area_id] = name[0].upper() + name[1:]
+            self.parents[area_id] = '113'
+        self.saved_at = 1
+
+    def ensure_loaded(self):
+        pass
+
+
+def with_typo(key, rng):
+    """Название с одной опечаткой: пропуск, лишняя буква, замена или перестановка соседних"""
+    i = rng.randrange(len(key))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return key[:i] + key[i + 1:]
+    if kind == 1:
+        return key[:i] + 'а' + key[i:]
+    if kind == 2:
+        return key[:i] + 'о' + key[i + 1:]
+    return key[:i] + key[i + 1:i + 2] + key[i:i + 1] + key[i + 2:]
+
+
+def measure(resolver, queries):
+    """Время каждого запроса в миллисекундах, по возрастанию"""
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        resolver.resolve(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)
+
+
+def main():
+    rng = random.Random(1)
+    directory = SampleDirectory(AREAS, rng)
+    resolver = CityResolver(directory, popular_ids=('1', '2'))
+    start = time.perf_counter()
+    resolver.rebuild()
+    print(f"регионов: {len(directory.names)}, построение индекса {time.perf_counter() - start:.2f} с")
+
+    areas = list(directory.names.items())
+    exact, prefix, typos = [], [], []
+    while len(typos) < QUERIES:
+        area_id, name = rng.choice(areas)
+        key = normalize_name(name)
+        typo = normalize_name(with_typo(key, rng))
+        if not typo or typo == key:
+            continue
+        # Город должен находиться по запросу с одной опечаткой
+        assert area_id in resolver._fuzzy(typo, 1 if len(typo) <= 5 else 2), (name, typo)
+        exact.append(name)
+        prefix.append(key[:3])
+        typos.append(typo)
+
+    print(f"{'запросы':>10} | {'p50, мс':>8} | {'p95, мс':>8} | {'p99, мс':>8}")
+    for label, queries in (('точные', exact), ('префиксы', prefix), ('опечатки', typos)):
+        times = measure(resolver, queries)
+        p50, p95, p99 = (times[int(len(times) * q)] for q in (0.5, 0.95, 0.99))
+        print(f"{label:>10} | {p50:>8.3f} | {p95:>8.3f} | {p99:>8.3f}")
+        if label == 'опечатки':
+            assert p50 < TYPO_BUDGET_MS, f"поиск с опечатками: медиана {p50:.3f} мс"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Микробенчмарк маршрутизации обновлений: таблицы Dispatcher против
+цепочки предикатов, как у @bot.message_handler(func=...).
+Запуск: python bench_dispatch.py
+"""
+import time
+from types import SimpleNamespace
+
+from dispatch import Dispatcher
+
+HANDLER_COUNTS = (10, 100, 1000, 10000)
+ITERATIONS = 200000
+
+# Шаги диалога пользователей: как в хранилище сессий, по chat_id
+STEPS = {1: 1, 2: 2, 3: None}
+
+
+def get_step(chat_id):
+    return STEPS.get(chat_id)
+
+
+def handler(update):
+    pass
+
+
+def build_dispatcher(count):
+    dispatcher = Dispatcher(get_step)
+    for i in range(count):
+        dispatcher.message(text=f"button {i}")(handler)
+        dispatcher.message(step=100 + i)(handler)
+        dispatcher.callback(f"action_{i}")(handler)
+        dispatcher.callback(prefix=f"group{i}_")(handler)
+    dispatcher.message(step=1)(handler)
+    dispatcher.message(fallback=True)(handler)
+    return dispatcher
+
+
+def build_chain(count):
+    """Список (предикат, обработчик), проверяемых по порядку"""
+    messages = []
+    callbacks = []
+    for i in range(count):
+        messages.append((lambda m, t=f"button {i}": m.text == t, handler))
+        messages.append((lambda m, s=100 + i: get_step(m.chat.id) == s, handler))
+        callbacks.append((lambda c, d=f"action_{i}": c.data == d, handler))
+        callbacks.append((lambda c, p=f"group{i}_": c.data.startswith(p), handler))
+    messages.append((lambda m: get_step(m.chat.id) == 1, handler))
+    messages.append((lambda m: True, handler))
+    return messages, callbacks
+
+
+def route_chain(chain, update):
+    for predicate, chain_handler in chain:
+        if predicate(update):
+            return chain_handler
+    return None
+
+
+def measure(route, updates, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        route(updates[i % len(updates)])
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    # Худший для цепочки случай: сообщение по шагу и callback из последней группы
+    def sample_updates(count):
+        messages = [
+            SimpleNamespace(text="python developer", chat=SimpleNamespace(id=1)),
+            SimpleNamespace(text="hello", chat=SimpleNamespace(id=3)),
+        ]
+        calls = [SimpleNamespace(data=f"group{count - 1}_42", message=SimpleNamespace(chat=SimpleNamespace(id=2)))]
+        return messages, calls
+
+    print(f"{'обработчиков':>12} | {'таблица, сообщение':>18} | {'таблица, callback':>17} | "
+          f"{'цепочка, сообщение':>18} | {'цепочка, callback':>17}")
+    for count in HANDLER_COUNTS:
+        dispatcher = build_dispatcher(count)
+        message_chain, callback_chain = build_chain(count)
+        messages, calls = sample_updates(count)
+        chain_iterations = max(ITERATIONS // count, 100)
+
+        table_message = measure(dispatcher.route_message, messages, ITERATIONS)
+        table_callback = measure(dispatcher.route_callback, calls, ITERATIONS)
+        chain_message = measure(lambda m: route_chain(message_chain, m), messages, chain_iterations)
+        chain_callback = measure(lambda c: route_chain(callback_chain, c), calls, chain_iterations)
+
+        print(f"{count * 4:>12} | {table_message:>15.0f} нс | {table_callback:>14.0f} нс | "
+              f"{chain_message:>15.0f} нс | {chain_callback:>14.0f} нс")
+
+
+if __name__ == '__main__':
+    main()
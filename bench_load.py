@@ -0,0 +1,490 @@
+"""
+Нагрузочный тест: настоящие обработчики main.py на синтетических диалогах
+(старт -> профессия -> фильтры -> город -> поиск) против локальных заглушек
+Telegram Bot API и api.hh.ru с настраиваемыми задержкой и долей ошибок.
+
+Запуск: python bench_load.py --chats 200 --hh-latency 80 --hh-errors 0.02
+Повтор того же потока: python bench_load.py --record flow.jsonl, затем --replay flow.jsonl
+Проверка регрессий (код возврата 1 при нарушении порогов):
+    python bench_load.py --min-rate 200 --max-p95 250 --max-session-bytes 4096
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BOT_TOKEN = '123456:LOADTEST'
+
+PROFESSIONS = (
+    'python разработчик', 'аналитик данных', 'менеджер проектов', 'дизайнер',
+    'бухгалтер', 'тестировщик', 'devops инженер', 'frontend разработчик',
+)
+POPULAR_CITY_IDS = ('1', '2', '3', '4', '88', '66')
+CITY_INPUTS = ('Воронеж', 'Самара', 'Краснодар', 'Нижний', 'Великий Новгород')
+SALARIES = ('80000', '120 000', '200000')
+EXPERIENCE_IDS = ('noExperience', 'between1And3', 'between3And6', 'moreThan6')
+
+AREAS_TREE = [{'id': '113', 'name': 'Россия', 'areas': [
+    {'id': '1', 'name': 'Москва', 'areas': []},
+    {'id': '2', 'name': 'Санкт-Петербург', 'areas': []},
+    {'id': '1620', 'name': 'Свердловская область', 'areas': [{'id': '3', 'name': 'Екатеринбург', 'areas': []}]},
+    {'id': '1624', 'name': 'Новосибирская область', 'areas': [{'id': '4', 'name': 'Новосибирск', 'areas': []}]},
+    {'id': '1679', 'name': 'Нижегородская область', 'areas': [
+        {'id': '66', 'name': 'Нижний Новгород', 'areas': []},
+        {'id': '1680', 'name': 'Нижний Ломов', 'areas': []},
+    ]},
+    {'id': '1624', 'name': 'Республика Татарстан', 'areas': [{'id': '88', 'name': 'Казань', 'areas': []}]},
+    {'id': '1844', 'name': 'Воронежская область', 'areas': [{'id': '26', 'name': 'Воронеж', 'areas': []}]},
+    {'id': '1586', 'name': 'Самарская область', 'areas': [{'id': '78', 'name': 'Самара', 'areas': []}]},
+    {'id': '1438', 'name': 'Краснодарский край', 'areas': [{'id': '53', 'name': 'Краснодар', 'areas': []}]},
+    {'id': '1051', 'name': 'Новгородская область', 'areas': [{'id': '67', 'name': 'Великий Новгород', 'areas': []}]},
+]}]
+
+
+DICTIONARIES = {'currency': [
+    {'code': 'RUR', 'abbr': '₽', 'name': 'Рубли', 'default': True, 'rate': 1.0, 'in_use': True},
+    {'code': 'USD', 'abbr': '$', 'name': 'Доллары', 'default': False, 'rate': 0.0112, 'in_use': True},
+    {'code': 'EUR', 'abbr': '€', 'name': 'Евро', 'default': False, 'rate': 0.0104, 'in_use': True},
+    {'code': 'KZT', 'abbr': '₸', 'name': 'Тенге', 'default': False, 'rate': 5.6, 'in_use': True},
+    {'code': 'BYR', 'abbr': 'Br', 'name': 'Белорусские рубли', 'default': False, 'rate': 0.036, 'in_use': True},
+]}
+
+
+class FakeServer:
+    """
+    Заглушка HTTP API в отдельном потоке. respond(method, path, query, headers) -> (статус, JSON)
+    или (статус, JSON, заголовки ответа), JSON None - ответ без тела;
+    каждый запрос задерживается на latency (мс, +-50%), доля error_rate получает ошибку error()
+    """
+
+    def __init__(self, respond, error, latency=0, error_rate=0.0, seed=0):
+        self.respond = respond
+        self.error = error
+        self.latency = latency / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                parts = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+                if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    query.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+
+                with server._lock:
+                    server.requests += 1
+                    failed = server.random.random() < server.error_rate
+                    delay = server.latency * server.random.uniform(0.5, 1.5)
+                    if failed:
+                        server.errors += 1
+                if delay:
+                    time.sleep(delay)
+                status, payload, *extra = server.error() if failed else \
+                    server.respond(self.command, parts.path, query, self.headers)
+
+                data = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                if payload is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def fake_vacancies(query):
+    """Детерминированная страница /vacancies для параметров запроса"""
+    text = query.get('text', '')
+    per_page = int(query.get('per_page', 20))
+    page = int(query.get('page', 0))
+    rng = random.Random(f"{text}|{query.get('area')}|{query.get('schedule')}|{query.get('experience')}")
+    found = rng.randint(0, 600)
+    pages = -(-min(found, 2000) // per_page)
+    start = page * per_page
+    base_id = rng.randint(1, 10 ** 7) * 1000
+    rates = {currency['code']: currency['rate'] for currency in DICTIONARIES['currency']}
+    items = []
+    for i in range(start, min(found, start + per_page)):
+        salary_from = rng.choice((None, 60000, 90000, 150000))
+        currency = rng.choice(('RUR', 'RUR', 'RUR', 'KZT', 'USD'))
+        # Каждая пятая вакансия - перепубликация предыдущей тем же работодателем
+        original = i - 1 if i % 5 == 4 else i
+        employer_id = random.Random(f"{text}|{original}").randint(1, 300)
+        items.append({
+            'id': str(base_id + i),
+            'name': f"{text.split(' ')[0].capitalize()} (уровень {original % 3 + 1}) #{original}",
+            'employer': {'id': str(employer_id), 'name': f"ООО «Компания {employer_id}»"},
+            'area': {'id': query.get('area', '1'), 'name': 'Город'},
+            'salary': {'from': round(salary_from * rates[currency]), 'to': None, 'currency': currency}
+            if salary_from and original == i else None,
+            'snippet': {'requirement': f"Опыт работы от {original % 4 + 1} лет, знание SQL и Git",
+                        'responsibility': f"Разработка и поддержка сервиса номер {original}"},
+            'schedule': {'id': query.get('schedule', 'fullDay')},
+            'experience': {'id': query.get('experience', 'between1And3')},
+            'published_at': '2024-05-01T10:00:00+0300',
+            'alternate_url': f"https://hh.ru/vacancy/{base_id + i}",
+        })
+    return {'items': items, 'found': found, 'pages': pages, 'page': page, 'per_page': per_page}
+
+
+def fake_vacancy(vacancy_id):
+    """Детерминированная полная карточка /vacancies/{id}"""
+    rng = random.Random(vacancy_id)
+    skills = rng.sample(('Python', 'SQL', 'Git', 'Docker', 'Linux', 'Excel', 'Английский язык'), 3)
+    return {
+        'id': vacancy_id,
+        'name': f"Вакансия #{vacancy_id}",
+        'employer': {'name': f"ООО «Компания {rng.randint(1, 300)}»"},
+        'salary': {'from': rng.choice((60000, 90000, 150000)), 'to': None, 'currency': 'RUR'},
+        'area': {'id': '1', 'name': 'Москва'},
+        'experience': {'id': 'between1And3', 'name': 'От 1 года до 3 лет'},
+        'schedule': {'id': 'fullDay', 'name': 'Полный день'},
+        'employment': {'id': 'full', 'name': 'Полная занятость'},
+        'key_skills': [{'name': skill} for skill in skills],
+        'description': '<p><strong>Обязанности:</strong></p><ul>'
+                       + ''.join(f'<li>задача {i} &amp; еще одна</li>' for i in range(rng.randint(3, 8)))
+                       + '</ul>' + '<p>Описание компании. </p>' * rng.randint(5, 30),
+        'alternate_url': f"https://hh.ru/vacancy/{vacancy_id}",
+        'archived': False,
+    }
+
+
+def hh_respond(method, path, query, headers):
+    if path == '/vacancies':
+        return 200, fake_vacancies(query)
+    if path.startswith('/vacancies/'):
+        vacancy_id = path.rsplit('/', 1)[-1]
+        etag = f'"{vacancy_id}-1"'
+        if headers.get('If-None-Match') == etag:
+            return 304, None, {'ETag': etag}
+        return 200, fake_vacancy(vacancy_id), {'ETag': etag}
+    if path == '/areas':
+        return 200, AREAS_TREE
+    if path == '/dictionaries':
+        return 200, DICTIONARIES
+    return 404, {'errors': [{'type': 'not_found'}]}
+
+
+def hh_error():
+    return 503, {'errors': [{'type': 'service_unavailable'}]}
+
+
+_message_ids = iter(range(1, 10 ** 9))
+
+
+def telegram_respond(method, path, query, headers):
+    api_method = path.rsplit('/', 1)[-1]
+    if api_method in ('sendMessage', 'editMessageText'):
+        chat_id = int(query.get('chat_id', 0))
+        return 200, {'ok': True, 'result': {
+            'message_id': next(_message_ids), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': query.get('text', ''),
+        }}
+    if api_method == 'getMe':
+        return 200, {'ok': True, 'result': {'id': 123456, 'is_bot': True, 'first_name': 'JobFinder'}}
+    return 200, {'ok': True, 'result': True}
+
+
+def telegram_error():
+    return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                 'parameters': {'retry_after': 1}}
+
+
+def conversation(rng):
+    """Шаги диалога одного пользователя: список (тип, текст или data)"""
+    steps = [
+        ('message', '/start'),
+        ('message', '🔍 Найти вакансии'),
+        ('message', rng.choice(PROFESSIONS)),
+    ]
+    for data in rng.sample(('toggle_salary', 'toggle_remote'), rng.randint(0, 2)):
+        steps.append(('callback', data))
+    if rng.random() < 0.4:
+        steps += [('callback', 'set_min_salary'), ('message', rng.choice(SALARIES))]
+    if rng.random() < 0.4:
+        steps += [('callback', 'set_experience'), ('callback', f"exp_{rng.choice(EXPERIENCE_IDS)}")]
+    steps.append(('callback', 'set_city'))
+    if rng.random() < 0.7:
+        steps.append(('callback', f"city_{rng.choice(POPULAR_CITY_IDS)}"))
+    else:
+        steps += [('callback', 'city_custom'), ('message', rng.choice(CITY_INPUTS)), ('callback', 'city_text')]
+    steps.append(('callback', 'search_jobs'))
+    if rng.random() < 0.3:
+        # Подробности вакансии: заглушка отдает карточку по любому ID, часть ID повторяется
+        steps.append(('callback', f"vac_{rng.randint(1, 200)}"))
+    return steps
+
+
+def generate_stream(chats, seed, first_chat=1):
+    """Поток шагов нескольких диалогов, перемешанных как у одновременно работающих пользователей"""
+    rng = random.Random(seed)
+    pending = {chat_id: conversation(rng) for chat_id in range(first_chat, first_chat + chats)}
+    stream = []
+    while pending:
+        chat_id = rng.choice(list(pending))
+        kind, data = pending[chat_id].pop(0)
+        stream.append({'chat': chat_id, 'kind': kind, 'data': data})
+        if not pending[chat_id]:
+            del pending[chat_id]
+    return stream
+
+
+def make_update(update_id, step):
+    user = {'id': step['chat'], 'is_bot': False, 'first_name': 'Load'}
+    chat = {'id': step['chat'], 'type': 'private'}
+    if step['kind'] == 'message':
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'chat': chat, 'from': user, 'text': step['data']}}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': str(step['chat']), 'data': step['data'], 'from': user,
+        'message': {'message_id': update_id, 'date': 0, 'chat': chat, 'from': user, 'text': '...'}}}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def load_bot(args, hh, telegram, workdir):
+    """Импортирует main.py с заглушками вместо внешних сервисов"""
+    os.environ.update({
+        'BOT_TOKEN': BOT_TOKEN,
+        'HH_API_URL': hh.url,
+        'SESSION_BACKEND': args.sessions,
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'SUBSCRIPTIONS_DB_PATH': os.path.join(workdir, 'subscriptions.db'),
+        'VACANCY_INDEX_PATH': os.path.join(workdir, 'vacancies.db'),
+        'FINGERPRINTS_DB_PATH': os.path.join(workdir, 'fingerprints.db'),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from telebot import apihelper
+    apihelper.API_URL = telegram.url + '/bot{0}/{1}'
+
+    import main
+    import outbox
+    main.bot.threaded = False
+    main.area_directory.path = os.path.join(workdir, 'areas_cache.json.gz')
+    main.currency_rates.path = os.path.join(workdir, 'currency_rates.json')
+    if not args.telegram_limits:
+        # Заглушка Telegram не ограничивает скорость: меряем пропускную способность самого бота
+        outbox.CHAT_RATE = outbox.CHAT_BURST = 10 ** 9
+        main.outbox.global_bucket = outbox.TokenBucket(10 ** 9, 10 ** 9)
+    if not args.admission_limits:
+        # Синтетические чаты ищут чаще живых пользователей: лимиты допуска мешали бы замеру
+        main.dispatcher.admission = None
+    return main
+
+
+def run_stream(main, stream, workers, rate, first_update_id=1):
+    """
+    Прогоняет поток через очередь обработчиков, как в режиме webhook.
+    Возвращает (задержки обновлений в секундах, длительность прогона)
+    """
+    from telebot import types
+    from webhook import UpdateQueue
+
+    submitted = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def process(updates):
+        try:
+            main.bot.process_new_updates(updates)
+        finally:
+            done = time.perf_counter()
+            with lock:
+                for update in updates:
+                    latencies.append(done - submitted[update.update_id])
+
+    updates = UpdateQueue(process, workers=workers, queue_size=1000)
+    updates.start()
+    started = time.perf_counter()
+    for i, step in enumerate(stream):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        update_id = first_update_id + i
+        update = types.Update.de_json(make_update(update_id, step))
+        submitted[update_id] = time.perf_counter()
+        while not updates.submit(update):
+            # Очередь чата переполнена: ждем, как Telegram после ответа 503
+            time.sleep(0.01)
+
+    while updates.stats()['processed'] + updates.stats()['failed'] < len(stream):
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    updates.stop()
+    return latencies, elapsed, updates.stats()['failed']
+
+
+def drain_outbox(main, timeout=30):
+    """Ждет, пока исходящая очередь Telegram опустеет"""
+    deadline = time.monotonic() + timeout
+    while main.outbox.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def measure_session_memory(main, sessions, seed, first_chat):
+    """Прирост памяти на одну активную сессию (диалоги, остановленные на настройке фильтров)"""
+    rng = random.Random(seed)
+    stream = []
+    for chat_id in range(first_chat, first_chat + sessions):
+        for kind, data in (('message', '/start'), ('message', '🔍 Найти вакансии'),
+                           ('message', rng.choice(PROFESSIONS)), ('callback', 'toggle_remote')):
+            stream.append({'chat': chat_id, 'kind': kind, 'data': data})
+
+    before_sessions = len(main.user_states)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run_stream(main, stream, workers=4, rate=0, first_update_id=10 ** 7)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    active = len(main.user_states) - before_sessions
+    return used / active if active else 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=200, help='число одновременных диалогов')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора потока')
+    parser.add_argument('--workers', type=int, default=8, help='число обработчиков обновлений')
+    parser.add_argument('--rate', type=float, default=0, help='обновлений в секунду (0 - без ограничения)')
+    parser.add_argument('--sessions', choices=('memory', 'sqlite'), default='memory', help='хранилище сессий')
+    parser.add_argument('--hh-latency', type=float, default=50, help='задержка HH.ru, мс')
+    parser.add_argument('--hh-errors', type=float, default=0.0, help='доля ответов HH.ru с ошибкой 503')
+    parser.add_argument('--tg-latency', type=float, default=20, help='задержка Telegram, мс')
+    parser.add_argument('--tg-errors', type=float, default=0.0, help='доля ответов Telegram с ошибкой 429')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='оставить ограничения скорости отправки, как у настоящего Telegram')
+    parser.add_argument('--admission-limits', action='store_true',
+                        help='оставить лимиты допуска запросов к HH.ru на чат и общий')
+    parser.add_argument('--memory-sessions', type=int, default=1000, help='сессий для замера памяти (0 - не мерить)')
+    parser.add_argument('--record', help='сохранить поток шагов в файл JSON Lines')
+    parser.add_argument('--replay', help='прогнать поток шагов из файла вместо генерации')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    parser.add_argument('--min-rate', type=float, help='порог: не меньше обновлений в секунду')
+    parser.add_argument('--max-p95', type=float, help='порог: p95 задержки не больше, мс')
+    parser.add_argument('--max-p99', type=float, help='порог: p99 задержки не больше, мс')
+    parser.add_argument('--max-session-bytes', type=float, help='порог: памяти на сессию не больше, байт')
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay, encoding='utf-8') as f:
+            stream = [json.loads(line) for line in f if line.strip()]
+    else:
+        stream = generate_stream(args.chats, args.seed)
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            for step in stream:
+                f.write(json.dumps(step, ensure_ascii=False) + '\n')
+
+    hh = FakeServer(hh_respond, hh_error, args.hh_latency, args.hh_errors, seed=args.seed).start()
+    telegram = FakeServer(telegram_respond, telegram_error, args.tg_latency, args.tg_errors, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    main = load_bot(args, hh, telegram, workdir)
+
+    latencies, elapsed, failed = run_stream(main, stream, args.workers, args.rate)
+    latencies.sort()
+    drain_outbox(main)
+    session_bytes = None
+    if args.memory_sessions:
+        session_bytes = measure_session_memory(main, args.memory_sessions, args.seed, first_chat=10 ** 6)
+        drain_outbox(main)
+    main.outbox.stop()
+
+    report = {
+        'updates': len(stream),
+        'chats': len({step['chat'] for step in stream}),
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(len(stream) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'session_bytes': round(session_bytes) if session_bytes is not None else None,
+        'hh_requests': hh.requests,
+        'hh_errors': hh.errors,
+        'telegram_requests': telegram.requests,
+        'telegram_errors': telegram.errors,
+        'cache': main.vacancy_cache.stats(),
+        'admission': main.admission.stats(),
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"обновлений: {report['updates']} от {report['chats']} чатов за {report['seconds']} с, "
+              f"ошибок обработки: {report['failed']}")
+        print(f"пропускная способность: {report['updates_per_second']} обновлений/с")
+        print(f"задержка: p50 {report['p50_ms']} мс, p95 {report['p95_ms']} мс, p99 {report['p99_ms']} мс")
+        if session_bytes is not None:
+            print(f"память на активную сессию: {report['session_bytes']} байт")
+        print(f"HH.ru: {report['hh_requests']} запросов ({report['hh_errors']} с ошибкой), "
+              f"Telegram: {report['telegram_requests']} запросов ({report['telegram_errors']} с ошибкой)")
+        cache = report['cache']
+        print(f"кэш результатов: {cache['hits']} попаданий, {cache['misses']} промахов, "
+              f"{cache['coalesced']} объединенных запросов")
+        if args.admission_limits:
+            admission = report['admission']
+            print(f"допуск запросов: {admission['admitted']} допущено, {admission['limited']} отклонено по лимиту, "
+                  f"{admission['coalesced']} повторных")
+
+    violations = []
+    if args.min_rate is not None and report['updates_per_second'] < args.min_rate:
+        violations.append(f"пропускная способность {report['updates_per_second']} < {args.min_rate}")
+    if args.max_p95 is not None and report['p95_ms'] > args.max_p95:
+        violations.append(f"p95 {report['p95_ms']} мс > {args.max_p95} мс")
+    if args.max_p99 is not None and report['p99_ms'] > args.max_p99:
+        violations.append(f"p99 {report['p99_ms']} мс > {args.max_p99} мс")
+    if args.max_session_bytes is not None and session_bytes is not None and session_bytes > args.max_session_bytes:
+        violations.append(f"память на сессию {report['session_bytes']} > {args.max_session_bytes} байт")
+    if failed:
+        violations.append(f"ошибок обработки: {failed}")
+
+    hh.stop()
+    telegram.stop()
+    if violations:
+        print("ПОРОГИ НАРУШЕНЫ: " + '; '.join(violations), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,120 @@
+"""
+Микробенчмарк отрисовки вакансий: rendering (replace только встреченных спецсимволов, шаблоны, join)
+против прежней реализации (18 проходов replace, словарь валют на каждый вызов, +=).
+Запуск: python bench_rendering.py
+"""
+import time
+
+from rendering import escape_markdown_v2, render_results_page
+
+PAGE_SIZES = (10, 50, 100)
+VACANCIES = 20000
+
+
+def legacy_escape_markdown_v2(text):
+    if not text:
+        return ""
+    special_chars = r'_*[]()~`>#+-=|{}.!'
+    result = str(text)
+    for char in special_chars:
+        result = result.replace(char, '\\' + char)
+    return result
+
+
+def legacy_format_salary(salary_data):
+    if not salary_data:
+        return "не указана"
+    currency_map = {
+        'RUR': '₽',
+        'USD': '$',
+        'EUR': '€',
+        'KZT': '₸',
+        'BYR': 'Br'
+    }
+    currency_symbol = currency_map.get(salary_data.get('currency', 'RUR'), salary_data.get('currency'))
+    parts = []
+    if salary_data.get('from'):
+        parts.append(f"от {salary_data['from']}")
+    if salary_data.get('to'):
+        parts.append(f"до {salary_data['to']}")
+    if not parts:
+        return "не указана"
+    return f"{' '.join(parts)} {currency_symbol}"
+
+
+def legacy_format_vacancy(vacancy):
+    name = legacy_escape_markdown_v2(vacancy.get('name', ''))
+    company = legacy_escape_markdown_v2(vacancy.get('employer', {}).get('name', 'Не указана'))
+    city = legacy_escape_markdown_v2(vacancy.get('area', {}).get('name', 'Не указан'))
+    url = vacancy.get('alternate_url', '')
+    salary_str = legacy_escape_markdown_v2(legacy_format_salary(vacancy.get('salary')))
+    return (
+        f"💼 *{name}*\n"
+        f"🏢 {company}\n"
+        f"💰 {salary_str}\n"
+        f"📍 {city}\n"
+        f"[Ссылка на вакансию ➡️]({url})"
+    )
+
+
+def legacy_render_results_page(profession, found, page, page_count, first, vacancies):
+    result_text = f"✅ Найдено *{found}* вакансий по запросу *{legacy_escape_markdown_v2(profession)}*"
+    if page_count > 1:
+        result_text += f" \\(страница {page + 1} из {page_count}\\)"
+    result_text += ":\n\n"
+    for i, vac in enumerate(vacancies, first):
+        result_text += f"{i}\\. {legacy_format_vacancy(vac)}\n\n"
+    return result_text
+
+
+def sample_vacancies(count):
+    """Вакансии, похожие на ответ HH.ru: со спецсимволами в названиях и без зарплаты у части"""
+    currencies = ('RUR', 'USD', 'EUR', 'KZT')
+    return [
+        {
+            'id': str(i),
+            'name': f"Python-разработчик (Senior) #{i}. Django/FastAPI!",
+            'employer': {'name': f"ООО «Компания {i}» [IT-отдел]"},
+            'area': {'name': 'Санкт-Петербург'},
+            'salary': None if i % 3 == 0 else {'from': 150000 + i, 'to': 250000 + i, 'currency': currencies[i % 4]},
+            'alternate_url': f"https://hh.ru/vacancy/{90000000 + i}",
+        }
+        for i in range(count)
+    ]
+
+
+def measure(render, vacancies, page_size):
+    """Вакансий в секунду при отрисовке страницами по page_size"""
+    start = time.perf_counter()
+    for offset in range(0, len(vacancies), page_size):
+        render('C++ / C# разработчик', 1234, offset // page_size, 20, offset + 1, vacancies[offset:offset + page_size])
+    return len(vacancies) / (time.perf_counter() - start)
+
+
+def main():
+    vacancies = sample_vacancies(VACANCIES)
+
+    page = vacancies[:10]
+    assert render_results_page('C++', 1, 0, 2, 1, page) == legacy_render_results_page('C++', 1, 0, 2, 1, page)
+
+    text = ' '.join(vacancy['name'] + vacancy['employer']['name'] for vacancy in vacancies[:100])
+    iterations = 2000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        escape_markdown_v2(text)
+    single = (time.perf_counter() - start) / iterations * 1e6
+    start = time.perf_counter()
+    for _ in range(iterations):
+        legacy_escape_markdown_v2(text)
+    replace = (time.perf_counter() - start) / iterations * 1e6
+    print(f"экранирование {len(text)} символов: rendering {single:.0f} мкс, 18 проходов replace {replace:.0f} мкс\n")
+
+    print(f"{'на странице':>11} | {'rendering, вак/с':>16} | {'прежний, вак/с':>14}")
+    for page_size in PAGE_SIZES:
+        current = measure(render_results_page, vacancies, page_size)
+        legacy = measure(legacy_render_results_page, vacancies, page_size)
+        print(f"{page_size:>11} | {current:>16.0f} | {legacy:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Параметры кэша результатов поиска по умолчанию
+CACHE_MAX_ENTRIES = 1000
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_TTL = 5 * 60
+
+# Сколько секунд после TTL запись еще можно отдать как устаревшую, обновляя ее в фоне
+CACHE_STALE_TTL = 60 * 60
+
+# Потоки фонового обновления устаревших записей
+REVALIDATE_WORKERS = 4
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    if isinstance(value, (list, tuple)):
+        # Несколько значений фильтра: порядок выбора на результат не влияет
+        return tuple(sorted(_normalize_value(item) for item in value))
+    return value
+
+
+def canonical_query(profession, filters):
+    """
+    Каноничный ключ запроса: профессия и фильтры в нижнем регистре,
+    с нормализованными пробелами, отсортированными ключами и списками значений
+    """
+    items = tuple(sorted(
+        (key, _normalize_value(value))
+        for key, value in filters.items()
+        if value not in (None, '', False)
+    ))
+    return _normalize_value(profession), items
+
+
+def estimate_size(value):
+    """Приблизительный размер значения в байтах (по длине JSON)"""
+    return len(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+class _Pending:
+    """Запрос к источнику, результат которого ждут несколько потоков"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    LRU-кэш с ограничением по числу записей и объему памяти и TTL для каждой записи.
+    Одновременные промахи по одному ключу выполняют один общий запрос к источнику.
+    Истекшие записи хранятся еще stale_ttl секунд для stale-while-revalidate
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL,
+                 sizeof=estimate_size, stale_ttl=CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def _expire(self, key, expires_at):
+        """Удаляет истекшую запись, если ее уже нельзя отдать как устаревшую"""
+        if expires_at + self.stale_ttl < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+
+    def get(self, key):
+        """Возвращает значение из кэша или None, если его нет или оно устарело"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                self._expire(key, expires_at)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """
+        Значение из кэша или None, как get, но без учета в статистике и без
+        продвижения в LRU: для проверок, а не для отдачи результата
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        """Сохраняет значение, вытесняя самые давно использованные записи при переполнении"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, cache_if=None):
+        """
+        Возвращает значение из кэша, а при промахе вызывает loader().
+        Если тот же ключ уже загружается другим потоком, дожидается его результата.
+        cache_if(результат) решает, стоит ли сохранять результат в кэш
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = _Pending()
+                self._pending[key] = pending
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        return self._load(key, pending, loader, cache_if)
+
+    def _load(self, key, pending, loader, cache_if):
+        try:
+            pending.result = loader()
+            if cache_if is None or cache_if(pending.result):
+                self.put(key, pending.result)
+            return pending.result
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.event.set()
+
+    def get_or_revalidate(self, key, loader, cache_if=None):
+        """
+        Как get_or_load, но истекшая запись в пределах stale_ttl возвращается сразу,
+        а loader() обновляет ее в фоне. Возвращает (значение, устарело ли оно)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, False
+                self._expire(key, expires_at)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    self._revalidate(key, loader, cache_if)
+                    return value, True
+
+        return self.get_or_load(key, loader, cache_if), False
+
+    def _revalidate(self, key, loader, cache_if):
+        """Запускает фоновое обновление записи, если оно еще не идет (вызывается под блокировкой)"""
+        if key in self._pending:
+            return
+        pending = _Pending()
+        self._pending[key] = pending
+        self.revalidations += 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(REVALIDATE_WORKERS, thread_name_prefix='revalidate')
+        self._executor.submit(self._revalidate_in_background, key, pending, loader, cache_if)
+
+    def _revalidate_in_background(self, key, pending, loader, cache_if):
+        try:
+            self._load(key, pending, loader, cache_if)
+        except Exception as e:
+            print(f"Ошибка фонового обновления кэша: {e}")
+
+    def export(self, limit):
+        """
+        Самые свежие по использованию записи для снимка состояния (не больше limit):
+        список (ключ, значение, время истечения по часам системы)
+        """
+        now = time.monotonic()
+        wall_now = time.time()
+        with self._lock:
+            entries = list(self._entries.items())[-limit:]
+        return [
+            (key, value, wall_now + expires_at - now)
+            for key, (value, expires_at, _) in reversed(entries)
+            if expires_at + self.stale_ttl >= now
+        ]
+
+    def restore(self, entries):
+        """
+        Загружает записи из снимка состояния. Истекшие, но еще допустимые для
+        stale-while-revalidate, отдаются как устаревшие и обновляются при обращении
+        """
+        wall_now = time.time()
+        for key, value, expires_at in reversed(entries):
+            ttl = expires_at - wall_now
+            # Запись, загруженная уже после запуска, свежее снимка
+            if ttl + self.stale_ttl >= 0 and key not in self._entries:
+                self.put(key, value, ttl=ttl)
+
+    def stats(self):
+        """Счетчики попаданий, промахов и вытеснений"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'coalesced': self.coalesced,
+            'stale_hits': self.stale_hits,
+            'revalidations': self.revalidations,
+        }
@@ -0,0 +1,276 @@
+import threading
+from itertools import chain
+
+# Разговорные названия и сокращения городов (ID из API HH.ru)
+CITY_ALIASES = {
+    'мск': '1',
+    'москва': '1',
+    'спб': '2',
+    'питер': '2',
+    'санкт петербург': '2',
+    'петербург': '2',
+    'екб': '3',
+    'екат': '3',
+    'нск': '4',
+    'новосиб': '4',
+    'нн': '66',
+    'нижний': '66',
+}
+
+# Сколько лучших регионов хранить в каждом узле дерева для префиксного поиска
+NODE_TOP_SIZE = 10
+
+# Вес популярного города при ранжировании
+POPULAR_WEIGHT = 1000
+
+
+def _deletions(key):
+    """Строки, получаемые из ключа удалением одного символа"""
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def _distance(a, b, max_distance):
+    """
+    Расстояние Левенштейна или max_distance + 1, если оно больше. Считается только
+    полоса шириной 2 * max_distance + 1 вокруг диагонали таблицы
+    """
+    limit = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return limit
+    prev_row = [min(j, limit) for j in range(len(b) + 1)]
+    for i, char in enumerate(a, 1):
+        row = [limit] * (len(b) + 1)
+        row[0] = best = min(i, limit)
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            value = min(row[j - 1] + 1, prev_row[j] + 1, prev_row[j - 1] + (char != b[j - 1]), limit)
+            row[j] = value
+            if value < best:
+                best = value
+        if best == limit:
+            return limit
+        prev_row = row
+    return prev_row[-1]
+
+
+def normalize_name(name):
+    """Приводит название к виду для поиска: нижний регистр, ё -> е, дефисы -> пробелы"""
+    name = name.lower().replace('ё', 'е').replace('-', ' ')
+    return ' '.join(name.split())
+
+
+class _Node:
+    __slots__ = ('children', 'ids', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+        self.top = []
+
+
+class CityResolver:
+    """
+    Нечеткий и префиксный поиск регионов по префиксному дереву названий.
+    Строится по справочнику AreaDirectory и перестраивается при его обновлении
+    """
+
+    def __init__(self, directory, popular_ids=()):
+        self.directory = directory
+        self.popular_ids = set(popular_ids)
+        self.usage = {}
+        self.root = _Node()
+        self.weights = {}
+        # Ключи дерева (название, слова, сокращения), под которыми записан регион
+        self.keys = {}
+        # Индекс для поиска с опечатками: все ключи дерева, их регионы и хеш ключа
+        # или ключа без одного символа -> номер ключа (список номеров при совпадении)
+        self.fuzzy_keys = []
+        self.fuzzy_ids = []
+        self.deletions = {}
+        self.paths = {}
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def _weight(self, area_id):
+        weight = self.usage.get(area_id, 0)
+        if area_id in self.popular_ids:
+            weight += POPULAR_WEIGHT
+        return weight
+
+    def _region_path(self, area_id):
+        """Название родительских регионов через запятую, от ближайшего"""
+        parts = []
+        parent_id = self.directory.parents.get(area_id)
+        while parent_id:
+            parts.append(self.directory.names[parent_id])
+            parent_id = self.directory.parents.get(parent_id)
+        return ', '.join(parts)
+
+    @staticmethod
+    def _insert(root, keys, key, area_id):
+        node = root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+        if area_id not in node.ids:
+            node.ids.append(area_id)
+            keys.setdefault(area_id, []).append(key)
+        return node
+
+    def _rank_key(self, weights):
+        names = self.directory.names
+        return lambda area_id: (-weights[area_id], len(names[area_id]))
+
+    def _fill_top(self, node, rank_key):
+        """Заполняет в каждом узле список лучших регионов его поддерева"""
+        candidates = set(node.ids)
+        for child in node.children.values():
+            candidates.update(self._fill_top(child, rank_key))
+        node.top = sorted(candidates, key=rank_key)[:NODE_TOP_SIZE]
+        return node.top
+
+    def rebuild(self):
+        """
+        Строит дерево заново по текущему содержимому справочника. Дерево строится
+        в стороне и подменяется целиком, поиск тем временем идет по прежнему
+        """
+        names = self.directory.names
+        root = _Node()
+        keys = {}
+        # Ключ -> список регионов его узла (тот же объект, что node.ids)
+        key_ids = {}
+        weights = {area_id: self._weight(area_id) for area_id in names}
+        for area_id, name in names.items():
+            key = normalize_name(name)
+            key_ids[key] = self._insert(root, keys, key, area_id).ids
+            # Составные названия ищутся и по отдельным словам ("Новгород")
+            words = key.split(' ')
+            for i in range(1, len(words)):
+                suffix = ' '.join(words[i:])
+                key_ids[suffix] = self._insert(root, keys, suffix, area_id).ids
+        for alias, area_id in CITY_ALIASES.items():
+            if area_id in names:
+                key_ids[alias] = self._insert(root, keys, alias, area_id).ids
+        self._fill_top(root, self._rank_key(weights))
+
+        fuzzy_keys = list(key_ids)
+        # Хранятся хеши, а не строки: индекс в 2-3 раза меньше, а случайные
+        # совпадения хешей отсеет проверка расстоянием
+        deletions = {}
+        for index, key in enumerate(fuzzy_keys):
+            for variant in _deletions(key) | {key}:
+                variant = hash(variant)
+                known = deletions.get(variant)
+                if known is None:
+                    deletions[variant] = index
+                elif isinstance(known, list):
+                    known.append(index)
+                else:
+                    deletions[variant] = [known, index]
+
+        self.root, self.weights, self.keys, self.paths = root, weights, keys, {}
+        self.fuzzy_keys, self.fuzzy_ids, self.deletions = fuzzy_keys, [key_ids[key] for key in fuzzy_keys], deletions
+        self._built_at = self.directory.saved_at
+
+    def _ensure_built(self):
+        self.directory.ensure_loaded()
+        if self._built_at != self.directory.saved_at:
+            with self._lock:
+                if self._built_at != self.directory.saved_at:
+                    self.rebuild()
+
+    def _fuzzy(self, query, max_distance):
+        """
+        Поиск с ограниченным расстоянием Левенштейна по индексу удалений: из запроса
+        удаляется до max_distance символов, из ключей в индексе - до одного, и совпавшие
+        строки дают кандидатов, для которых считается расстояние. Находятся все ключи
+        на расстоянии 1 и те на расстоянии 2, где ключу хватает одного удаления
+        (не находятся две замены подряд). Время - десятки поисков в словаре, а не обход дерева
+        """
+        variants = frontier = {query}
+        for _ in range(max_distance):
+            frontier = set(chain.from_iterable(_deletions(variant) for variant in frontier))
+            variants = variants | frontier
+
+        deletions = self.deletions
+        candidates = set()
+        for variant in variants:
+            known = deletions.get(hash(variant))
+            if isinstance(known, list):
+                candidates.update(known)
+            elif known is not None:
+                candidates.add(known)
+
+        keys, ids = self.fuzzy_keys, self.fuzzy_ids
+        found = {}
+        for index in candidates:
+            distance = _distance(query, keys[index], max_distance)
+            if distance <= max_distance:
+                for area_id in ids[index]:
+                    if distance < found.get(area_id, max_distance + 1):
+                        found[area_id] = distance
+        return found
+
+    def get_path(self, area_id):
+        """Путь родительских регионов для показа пользователю"""
+        path = self.paths.get(area_id)
+        if path is None:
+            path = self._region_path(area_id)
+            self.paths[area_id] = path
+        return path
+
+    def resolve(self, text, limit=5):
+        """
+        Возвращает список кандидатов (id, название, путь регионов, расстояние),
+        лучшие первыми: точные совпадения, затем префиксные; с опечатками
+        ищется, только если ни точных, ни префиксных совпадений нет
+        """
+        self._ensure_built()
+        query = normalize_name(text)
+        if not query:
+            return []
+
+        # (расстояние, вид совпадения) для каждого найденного региона
+        matches = {}
+
+        node = self.root
+        for char in query:
+            node = node.children.get(char)
+            if node is None:
+                break
+        if node is not None:
+            for area_id in node.ids:
+                matches[area_id] = (0, 0)
+            for area_id in node.top:
+                matches.setdefault(area_id, (0, 1))
+
+        if not matches:
+            max_distance = 1 if len(query) <= 5 else 2
+            for area_id, distance in self._fuzzy(query, max_distance).items():
+                if distance > 0:
+                    matches.setdefault(area_id, (distance, 2))
+
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (item[1], -self.weights.get(item[0], 0), len(self.directory.names[item[0]]))
+        )
+        return [
+            (area_id, self.directory.names[area_id], self.get_path(area_id), rank[0])
+            for area_id, rank in ranked[:limit]
+        ]
+
+    def record_choice(self, area_id):
+        """Учитывает выбор пользователя: часто выбираемые регионы поднимаются выше"""
+        self.usage[area_id] = self.usage.get(area_id, 0) + 1
+        if area_id not in self.weights:
+            return
+        weights = self.weights
+        weights[area_id] = self._weight(area_id)
+        # Вес только растет, поэтому достаточно поднять регион в списках лучших
+        # на пути каждого его ключа; списки подменяются целиком, без блокировки поиска
+        rank_key = self._rank_key(weights)
+        for key in self.keys.get(area_id, ()):
+            node = self.root
+            for char in key:
+                node = node.children[char]
+                top = node.top
+                if area_id in top or len(top) < NODE_TOP_SIZE or rank_key(area_id) < rank_key(top[-1]):
+                    node.top = sorted(set(top) | {area_id}, key=rank_key)[:NODE_TOP_SIZE]
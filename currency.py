@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+# Валюта, к которой приводятся зарплаты (в ней же задается минимальная зарплата в фильтрах)
+BASE_CURRENCY = 'RUR'
+
+# Файл с локальной копией курсов валют из справочника HH.ru
+RATES_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'currency_rates.json')
+
+# HH.ru обновляет курсы раз в сутки
+RATES_TTL = 24 * 60 * 60
+
+# Через сколько секунд повторять загрузку курсов после ошибки
+RATES_RETRY_INTERVAL = 60
+
+
+def parse_rates(dictionaries):
+    """
+    Курсы из ответа /dictionaries: {код валюты: сколько единиц валюты в одной единице базовой}
+    """
+    return {
+        currency['code']: currency['rate']
+        for currency in dictionaries.get('currency', [])
+        if currency.get('code') and currency.get('rate')
+    }
+
+
+def meets_min_salary(vacancy, min_salary):
+    """
+    Подходит ли вакансия под минимальную зарплату в базовой валюте:
+    вилка позволяет получать не меньше min_salary. Вакансии без пересчета не отсеиваются
+    """
+    base = vacancy.get('salary_base')
+    if not min_salary or base is None:
+        return True
+    if base['to'] is not None:
+        return base['to'] >= min_salary
+    return base['from'] is not None
+
+
+class CurrencyRates:
+    """
+    Курсы валют HH.ru для приведения зарплат к базовой валюте: загружаются один раз,
+    хранятся на диске и обновляются в фоне по истечении TTL
+    """
+
+    def __init__(self, fetch_dictionaries, path=RATES_CACHE_FILE, ttl=RATES_TTL):
+        self.fetch_dictionaries = fetch_dictionaries
+        self.path = path
+        self.ttl = ttl
+        self.saved_at = 0
+        # Код валюты -> множитель для перевода в базовую валюту
+        self.factors = {}
+        self._lock = threading.Lock()
+        # Первая загрузка выполняется одним потоком, остальные ждут ее результата
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._failed_at = 0
+
+    def _build(self, rates, saved_at):
+        factors = {code: 1 / rate for code, rate in rates.items()}
+        factors[BASE_CURRENCY] = 1
+        self.factors = factors
+        self.saved_at = saved_at
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._build(data['rates'], data['saved_at'])
+            return True
+        except (OSError, ValueError, KeyError, ZeroDivisionError) as e:
+            print(f"Не удалось прочитать кэш курсов валют: {e}")
+            return False
+
+    def _save_to_disk(self, rates, saved_at):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': saved_at, 'rates': rates}, f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Скачивает курсы заново и сохраняет их на диск"""
+        rates = parse_rates(self.fetch_dictionaries())
+        saved_at = time.time()
+        with self._lock:
+            self._build(rates, saved_at)
+        try:
+            self._save_to_disk(rates, saved_at)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш курсов валют: {e}")
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Ошибка обновления курсов валют: {e}")
+        finally:
+            self._refreshing = False
+
+    def ensure_loaded(self):
+        """
+        Гарантирует, что курсы загружены; устаревшие обновляются в фоне.
+        Если загрузить не удалось, зарплаты остаются без пересчета
+        """
+        if not self.factors:
+            with self._load_lock:
+                with self._lock:
+                    if not self.factors and os.path.exists(self.path):
+                        self._load_from_disk()
+                # Одновременные первые вызовы скачивают /dictionaries один раз,
+                # а после ошибки ждут RATES_RETRY_INTERVAL, а не повторяют ее по очереди
+                if not self.factors:
+                    if time.monotonic() - self._failed_at < RATES_RETRY_INTERVAL:
+                        return
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        self._failed_at = time.monotonic()
+                        print(f"Ошибка загрузки курсов валют: {e}")
+                    return
+
+        if time.time() - self.saved_at > self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def normalize_page(self, vacancies):
+        """
+        Добавляет вакансиям с зарплатой поле salary_base - вилку в базовой валюте.
+        Вся страница пересчитывается за один проход по одной таблице множителей
+        """
+        self.ensure_loaded()
+        factors = self.factors
+        if not factors:
+            return vacancies
+        for vacancy in vacancies:
+            salary = vacancy.get('salary')
+            if not salary:
+                continue
+            factor = factors.get(salary.get('currency') or BASE_CURRENCY)
+            if factor is None:
+                continue
+            salary_from = salary.get('from')
+            salary_to = salary.get('to')
+            vacancy['salary_base'] = {
+                'from': round(salary_from * factor) if salary_from else None,
+                'to': round(salary_to * factor) if salary_to else None,
+            }
+        return vacancies
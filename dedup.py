@@ -0,0 +1,253 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# Вакансии считаются одной, если их SimHash отличается не больше чем в стольких битах
+SIMHASH_MAX_DISTANCE = 3
+
+# SimHash делится на полосы: похожие по расстоянию не больше 3 совпадают хотя бы в одной из 4
+SIMHASH_BANDS = 4
+_BAND_BITS = 64 // SIMHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# Текст короче этого числа слов слишком беден для сравнения по SimHash
+SIMHASH_MIN_TOKENS = 6
+
+# Сколько хранить отпечатки вакансий, которые больше не встречались
+FINGERPRINT_RETENTION = 7 * 24 * 60 * 60
+
+# Как часто (в пакетах) удалять старые отпечатки
+FINGERPRINT_PURGE_EVERY = 1000
+
+_WORD = re.compile(r'\w+')
+_HIGHLIGHT = re.compile(r'</?highlighttext>')
+
+
+def normalize_title(title):
+    """Название без регистра, пунктуации и лишних пробелов"""
+    return ' '.join(_WORD.findall((title or '').lower()))
+
+
+@lru_cache(maxsize=65536)
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(tokens):
+    """
+    64-битный SimHash по словам и парам соседних слов. Бит результата равен 1, если он
+    установлен у большинства хешей признаков; единицы считаются сразу по всем 64 позициям
+    счетчиками в битовых плоскостях (planes[k] - k-й разряд счетчиков всех позиций)
+    """
+    features = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+    planes = []
+    for feature in features:
+        carry = _token_hash(feature)
+        for k, plane in enumerate(planes):
+            if not carry:
+                break
+            planes[k], carry = plane ^ carry, plane & carry
+        if carry:
+            planes.append(carry)
+
+    # Позиции, где счетчик не меньше порога: сравнение со старшего разряда
+    threshold = len(features) // 2 + 1
+    planes += [0] * (threshold.bit_length() - len(planes))
+    greater = 0
+    equal = (1 << 64) - 1
+    for k in range(len(planes) - 1, -1, -1):
+        if threshold >> k & 1:
+            equal &= planes[k]
+        else:
+            greater |= equal & planes[k]
+            equal &= ~planes[k]
+    return (greater | equal) & ((1 << 64) - 1)
+
+
+def fingerprint(vacancy):
+    """
+    Отпечаток вакансии: (ключ перепубликации, нормализованное название, SimHash или None).
+    Ключ перепубликации - работодатель, название и вилка: так выглядит одна вакансия,
+    размещенная в нескольких регионах. SimHash по названию и фрагментам описания
+    находит копии одного текста у разных работодателей (кадровые агентства)
+    """
+    title = normalize_title(vacancy.get('name'))
+    employer = vacancy.get('employer') or {}
+    salary = vacancy.get('salary') or {}
+    repost_key = '|'.join((
+        str(employer.get('id') or normalize_title(employer.get('name'))),
+        title,
+        str(salary.get('from') or ''),
+        str(salary.get('to') or ''),
+        salary.get('currency') or '',
+    ))
+    snippet = vacancy.get('snippet') or {}
+    text = ' '.join((title, snippet.get('requirement') or '', snippet.get('responsibility') or ''))
+    tokens = _WORD.findall(_HIGHLIGHT.sub('', text.lower()))
+    return repost_key, title, simhash(tokens) if len(tokens) >= SIMHASH_MIN_TOKENS else None
+
+
+def _blocking_keys(repost_key, title, sim):
+    """Ключи, по которым ищутся кандидаты в дубли: совпадение хотя бы одного обязательно"""
+    keys = ['r|' + repost_key]
+    if sim is not None:
+        keys.extend(f's|{band}|{sim >> (band * _BAND_BITS) & _BAND_MASK}|{title}' for band in range(SIMHASH_BANDS))
+    return keys
+
+
+def _signed(value):
+    # SQLite хранит знаковые 64-битные числа
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _is_duplicate(a, b):
+    repost_a, title_a, sim_a = a
+    repost_b, title_b, sim_b = b
+    if repost_a == repost_b:
+        return True
+    return (title_a == title_b and sim_a is not None and sim_b is not None
+            and bin((sim_a ^ sim_b) & ((1 << 64) - 1)).count('1') <= SIMHASH_MAX_DISTANCE)
+
+
+class FingerprintStore:
+    """
+    Отпечатки вакансий в SQLite: каждой вакансии назначается кластер - ID первой
+    встреченной вакансии с тем же отпечатком. Кандидаты ищутся по индексу ключей
+    блокировки, поэтому пакет обрабатывается за время, близкое к линейному
+    """
+
+    def __init__(self, path, retention=FINGERPRINT_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        # Назначение кластеров выполняется по одному пакету, чтобы одновременные
+        # пакеты с одинаковыми вакансиями не создали два кластера
+        self._lock = threading.Lock()
+        self._batches = 0
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            'vacancy_id TEXT PRIMARY KEY, '
+            'cluster_id TEXT NOT NULL, '
+            'repost_key TEXT NOT NULL, '
+            'title TEXT NOT NULL, '
+            'simhash INTEGER, '
+            'seen_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS fingerprints_seen_at ON fingerprints (seen_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprint_keys ('
+            'key TEXT NOT NULL, '
+            'vacancy_id TEXT NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS fingerprint_keys_key ON fingerprint_keys (key)')
+        conn.execute('CREATE INDEX IF NOT EXISTS fingerprint_keys_vacancy ON fingerprint_keys (vacancy_id)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _select_in(conn, query, values):
+        rows = []
+        values = list(values)
+        # Ограничение SQLite на число параметров запроса
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            rows.extend(conn.execute(query.format(', '.join('?' * len(chunk))), chunk))
+        return rows
+
+    def assign(self, vacancies):
+        """
+        Добавляет вакансиям поле cluster - ID кластера дублей (для уникальной - ее собственный ID).
+        Возвращает тот же список
+        """
+        batch = []
+        for vacancy in vacancies:
+            vacancy_id = vacancy.get('id')
+            if vacancy_id is not None:
+                batch.append((str(vacancy_id), vacancy, fingerprint(vacancy)))
+        if not batch:
+            return vacancies
+
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                clusters = dict(self._select_in(
+                    conn, 'SELECT vacancy_id, cluster_id FROM fingerprints WHERE vacancy_id IN ({})',
+                    {vacancy_id for vacancy_id, _, _ in batch}
+                ))
+                conn.executemany(
+                    'UPDATE fingerprints SET seen_at = ? WHERE vacancy_id = ?',
+                    [(now, vacancy_id) for vacancy_id in clusters]
+                )
+                new = [(vacancy_id, fp) for vacancy_id, _, fp in batch if vacancy_id not in clusters]
+                if new:
+                    self._cluster_new(conn, new, clusters, now)
+            self._batches += 1
+            if self._batches % FINGERPRINT_PURGE_EVERY == 0:
+                self.purge(now - self.retention)
+
+        for vacancy_id, vacancy, _ in batch:
+            vacancy['cluster'] = clusters.get(vacancy_id, vacancy_id)
+        return vacancies
+
+    def _cluster_new(self, conn, new, clusters, now):
+        keys = {vacancy_id: _blocking_keys(*fp) for vacancy_id, fp in new}
+        # Кандидаты из уже известных вакансий: по любому общему ключу блокировки
+        candidates = {}
+        rows = self._select_in(
+            conn,
+            'SELECT k.key, f.vacancy_id, f.cluster_id, f.repost_key, f.title, f.simhash '
+            'FROM fingerprint_keys k JOIN fingerprints f ON f.vacancy_id = k.vacancy_id WHERE k.key IN ({})',
+            {key for vacancy_keys in keys.values() for key in vacancy_keys}
+        )
+        for key, vacancy_id, cluster_id, repost_key, title, sim in rows:
+            candidates.setdefault(key, []).append((cluster_id, (repost_key, title, sim)))
+
+        fingerprint_rows = []
+        key_rows = []
+        for vacancy_id, fp in new:
+            cluster_id = vacancy_id
+            for key in keys[vacancy_id]:
+                match = next((c for c, other in candidates.get(key, ()) if _is_duplicate(fp, other)), None)
+                if match is not None:
+                    cluster_id = match
+                    break
+            clusters[vacancy_id] = cluster_id
+            # Новые вакансии пакета тоже становятся кандидатами для следующих
+            for key in keys[vacancy_id]:
+                candidates.setdefault(key, []).append((cluster_id, fp))
+                key_rows.append((key, vacancy_id))
+            repost_key, title, sim = fp
+            fingerprint_rows.append(
+                (vacancy_id, cluster_id, repost_key, title, None if sim is None else _signed(sim), now)
+            )
+
+        conn.executemany(
+            'INSERT OR REPLACE INTO fingerprints (vacancy_id, cluster_id, repost_key, title, simhash, seen_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            fingerprint_rows
+        )
+        conn.executemany('INSERT INTO fingerprint_keys (key, vacancy_id) VALUES (?, ?)', key_rows)
+
+    def purge(self, older_than):
+        """Удаляет отпечатки вакансий, которые давно не встречались"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'DELETE FROM fingerprint_keys WHERE vacancy_id IN '
+                '(SELECT vacancy_id FROM fingerprints WHERE seen_at < ?)',
+                (older_than,)
+            )
+            conn.execute('DELETE FROM fingerprints WHERE seen_at < ?', (older_than,))
@@ -0,0 +1,170 @@
+import time
+
+
+class Dispatcher:
+    """
+    Маршрутизация обновлений по хеш-таблицам вместо цепочки предикатов:
+    сообщения - по команде, тексту и шагу диалога, callback-запросы -
+    по точному значению data или по его префиксу до первого '_'.
+    Стоимость маршрутизации не зависит от числа обработчиков.
+    Обработчики с limited проходят через допуск admission, а отклоненные
+    обновления получают дешевый ответ on_rejected(обновление, через сколько повторить)
+    """
+
+    def __init__(self, get_step, metrics=None, admission=None, on_rejected=None):
+        self.get_step = get_step
+        # Необязательные метрики: время обработчиков и трассы обновлений
+        self.metrics = metrics
+        self.admission = admission
+        self.on_rejected = on_rejected
+        # Обработчик -> True или предикат needs_upstream(обновление)
+        self.limited = {}
+        self.commands = {}
+        self.priority_texts = {}
+        self.step_texts = {}
+        self.steps = {}
+        self.texts = {}
+        self.message_fallback = None
+        self.callbacks = {}
+        self.callback_prefixes = {}
+        self.callback_fallback = None
+
+    def message(self, commands=None, text=None, step=None, priority=False, fallback=False, limited=False):
+        """
+        Регистрирует обработчик сообщений.
+        priority=True: текст проверяется раньше шага диалога (кнопки главного меню),
+        limited=True: обработчик обращается к HH.ru и подчиняется лимитам запросов;
+        limited=предикат(сообщение): подчиняется, только если предикат истинен
+        """
+        def decorator(handler):
+            if limited:
+                self.limited[handler] = limited
+            if commands:
+                for command in commands:
+                    self.commands[command] = handler
+            elif fallback:
+                self.message_fallback = handler
+            elif step is not None and text is not None:
+                self.step_texts[(step, text)] = handler
+            elif step is not None:
+                self.steps[step] = handler
+            elif priority:
+                self.priority_texts[text] = handler
+            else:
+                self.texts[text] = handler
+            return handler
+        return decorator
+
+    def callback(self, data=None, prefix=None, fallback=False, limited=False):
+        """
+        Регистрирует обработчик callback-запросов по точному data или префиксу вида 'city_'.
+        limited=True: обработчик обращается к HH.ru и подчиняется лимитам запросов;
+        limited=предикат(callback-запрос): подчиняется, только если запрос уйдет в HH.ru
+        (например, страница уже в кэше - не уйдет)
+        """
+        def decorator(handler):
+            if limited:
+                self.limited[handler] = limited
+            if fallback:
+                self.callback_fallback = handler
+            elif prefix is not None:
+                self.callback_prefixes[prefix] = handler
+            else:
+                self.callbacks[data] = handler
+            return handler
+        return decorator
+
+    def route_message(self, message):
+        """Обработчик для сообщения или None"""
+        text = message.text or ''
+
+        if text.startswith('/'):
+            command = text[1:].split(maxsplit=1)[0].split('@', 1)[0] if len(text) > 1 else ''
+            handler = self.commands.get(command)
+            if handler is not None:
+                return handler
+
+        handler = self.priority_texts.get(text)
+        if handler is not None:
+            return handler
+
+        step = self.get_step(message.chat.id)
+        if step is not None:
+            handler = self.step_texts.get((step, text)) or self.steps.get(step)
+            if handler is not None:
+                return handler
+
+        return self.texts.get(text, self.message_fallback)
+
+    def route_callback(self, call):
+        """Обработчик для callback-запроса или None"""
+        data = call.data or ''
+        handler = self.callbacks.get(data)
+        if handler is not None:
+            return handler
+
+        separator = data.find('_')
+        if separator != -1:
+            handler = self.callback_prefixes.get(data[:separator + 1])
+            if handler is not None:
+                return handler
+
+        return self.callback_fallback
+
+    def dispatch_message(self, message):
+        handler = self.route_message(message)
+        if handler is not None:
+            self._run(handler, message, message.chat.id)
+
+    def dispatch_callback(self, call):
+        handler = self.route_callback(call)
+        if handler is not None:
+            self._run(handler, call, call.message.chat.id if call.message else None)
+
+    def _is_limited(self, handler, update, chat_id):
+        if self.admission is None or chat_id is None:
+            return False
+        limited = self.limited.get(handler, False)
+        return limited is True or (limited is not False and limited(update))
+
+    def admits_callback(self, call):
+        """
+        Будет ли callback-запрос допущен, если прийти с ним сейчас; маркеры не расходуются.
+        Для предзагрузки, которая выполняется до самого обработчика
+        """
+        handler = self.route_callback(call)
+        chat_id = call.message.chat.id if call.message else None
+        if handler is None or not self._is_limited(handler, call, chat_id):
+            return True
+        return self.admission.check(chat_id, (chat_id, handler.__name__)) == 0
+
+    def _run(self, handler, update, chat_id):
+        if not self._is_limited(handler, update, chat_id):
+            self._call(handler, update, chat_id)
+            return
+
+        key = (chat_id, handler.__name__)
+        retry_after = self.admission.admit(chat_id, key)
+        if retry_after != 0:
+            if self.on_rejected is not None:
+                self.on_rejected(update, retry_after)
+            return
+        try:
+            self._call(handler, update, chat_id)
+        finally:
+            self.admission.release(key)
+
+    def _call(self, handler, update, chat_id):
+        metrics = self.metrics
+        if metrics is None:
+            handler(update)
+            return
+
+        name = handler.__name__
+        metrics.start_trace(handler=name, chat_id=chat_id)
+        started = time.perf_counter()
+        try:
+            handler(update)
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, name)
+            metrics.finish_trace()
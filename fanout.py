@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product, zip_longest
+
+from pagination import MAX_UPSTREAM_RESULTS, UPSTREAM_PAGE_SIZE
+from vacancy_index import NOT_FOUND
+
+# Потоки для параллельных запросов одного поиска по нескольким фильтрам
+FANOUT_WORKERS = 16
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def split_query(filters):
+    """
+    Разбивает фильтры с несколькими значениями на фильтры отдельных запросов к HH.ru.
+    Все выбранные города идут в один запрос (HH.ru принимает несколько area),
+    а каждый уровень опыта и поиск города по названию - в свой
+    """
+    base = {key: value for key, value in filters.items() if key not in ('city', 'city_text', 'experience')}
+
+    locations = []
+    if filters.get('city'):
+        locations.append({'city': filters['city']})
+    if filters.get('city_text'):
+        locations.append({'city_text': filters['city_text']})
+
+    experiences = [{'experience': exp_id} for exp_id in _as_list(filters['experience'])] \
+        if filters.get('experience') else []
+
+    return [
+        {**base, **location, **experience}
+        for location, experience in product(locations or [{}], experiences or [{}])
+    ]
+
+
+def merge_items(item_lists):
+    """
+    Объединяет ранжированные списки вакансий: по очереди берет вакансии одного ранга
+    из каждого списка, повторы по ID пропускает
+    """
+    merged = []
+    seen = set()
+    for rank in zip_longest(*item_lists):
+        for vacancy in rank:
+            if vacancy is not None and vacancy['id'] not in seen:
+                seen.add(vacancy['id'])
+                merged.append(vacancy)
+    return merged
+
+
+def merge_pages(results):
+    """
+    Объединяет страницы ответов нескольких запросов с одним номером.
+    Результат - как у fetch_vacancies; parts - сколько вакансий можно пролистать
+    по каждому запросу (для постраничного просмотра). Запросы с ошибкой пропускаются,
+    ошибка возвращается, только если ответа нет ни по одному
+    """
+    pages = [data for data, _ in results if data is not None]
+    if not pages:
+        errors = [error for _, error in results if error != NOT_FOUND]
+        return None, errors[0] if errors else NOT_FOUND
+
+    merged = {
+        'items': merge_items([data['items'] for data in pages]),
+        'found': sum(data['found'] for data in pages),
+        'pages': max(data['pages'] for data in pages),
+        'parts': [min(data['found'], data['pages'] * UPSTREAM_PAGE_SIZE, MAX_UPSTREAM_RESULTS) for data in pages],
+    }
+    if any(data.get('stale') for data in pages):
+        merged['stale'] = True
+    return merged, None
+
+
+class FanOut:
+    """Параллельное выполнение запросов одного поиска: задержка - как у самого медленного запроса"""
+
+    def __init__(self, workers=FANOUT_WORKERS):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='fanout')
+
+    def map(self, func, profession, queries, *args):
+        """[func(profession, query, *args) для каждого query]; первый выполняется в текущем потоке"""
+        futures = [self._executor.submit(func, profession, query, *args) for query in queries[1:]]
+        first = func(profession, queries[0], *args)
+        return [first] + [future.result() for future in futures]
+
+    def stream(self, func, profession, queries, *args):
+        """Результаты func(profession, query, *args) по мере готовности: пары (номер запроса, результат)"""
+        futures = {self._executor.submit(func, profession, query, *args): index for index, query in enumerate(queries)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
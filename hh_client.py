@@ -0,0 +1,242 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import NULL_SPAN
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker
+
+# Базовый адрес API HH.ru
+HH_API_URL = 'https://api.hh.ru'
+
+# Сколько keep-alive соединений держать открытыми на один хост
+POOL_SIZE = 20
+
+# Сколько запросов к одному хосту может выполняться одновременно
+HOST_CONCURRENCY = 10
+
+# Повторы при ошибке соединения, 429 и 5xx: задержка между попытками растет как backoff * 2^n.
+# Таймаут чтения не повторяется: медленный HH.ru не должен держать обработчик в несколько раз дольше
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Верхняя граница таймаута; фактический подстраивается под наблюдаемую задержку
+REQUEST_TIMEOUT = 10
+
+
+class HHClient:
+    """
+    Общий HTTP-клиент для всех запросов к HH.ru: пул keep-alive соединений,
+    повторы с экспоненциальной задержкой и ограничение параллельности по хостам.
+    Для каждого хоста - предохранитель, для каждого раздела API - адаптивный таймаут
+    """
+
+    def __init__(self, headers, base_url=HH_API_URL, pool_size=POOL_SIZE,
+                 host_concurrency=HOST_CONCURRENCY, max_retries=MAX_RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, timeout=REQUEST_TIMEOUT, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.metrics = metrics
+        self.timeout = timeout
+        self.host_concurrency = host_concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        retry = Retry(
+            total=max_retries,
+            read=False,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._host_limits = {}
+        self._breakers = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            with self._lock:
+                limit = self._host_limits.setdefault(host, threading.BoundedSemaphore(self.host_concurrency))
+        return limit
+
+    def _breaker(self, url):
+        host = urlsplit(url).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker())
+        return breaker
+
+    @staticmethod
+    def _section(url):
+        """Раздел API по адресу: vacancies, areas, dictionaries"""
+        return urlsplit(url).path.strip('/').split('/', 1)[0]
+
+    def _latency(self, url):
+        """Задержки раздела API: /vacancies и /areas отвечают с очень разной скоростью"""
+        key = urlsplit(url).netloc + '/' + self._section(url)
+        tracker = self._latencies.get(key)
+        if tracker is None:
+            with self._lock:
+                tracker = self._latencies.setdefault(key, LatencyTracker(max_timeout=self.timeout))
+        return tracker
+
+    def url(self, path):
+        """Полный адрес для пути API (полные адреса возвращаются как есть)"""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    @staticmethod
+    def _query_pairs(params):
+        """Параметры запроса парами: несколько значений параметра (area) повторяют его"""
+        return [(name, item) for name, value in (params or {}).items()
+                for item in (value if isinstance(value, list) else [value])]
+
+    def _allow(self, url):
+        """Предохранитель хоста; разомкнутый - CircuitOpenError без обращения к сети"""
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            if self.metrics is not None:
+                self.metrics.upstream_seconds.observe(0, self._section(url), 'circuit_open')
+            raise CircuitOpenError(f"HH.ru временно недоступен, повторите через {int(breaker.retry_after()) + 1} с")
+        return breaker
+
+    @staticmethod
+    def _record_status(breaker, status):
+        # Ошибки клиента (404, 400) не говорят о том, что HH.ru недоступен
+        if status >= 500 or status == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _observe(self, url, started, status):
+        if self.metrics is not None:
+            self.metrics.upstream_seconds.observe(time.monotonic() - started, self._section(url), status)
+
+    def get(self, path, params=None, timeout=None, headers=None):
+        """
+        Выполняет GET-запрос через общий пул соединений.
+        Ошибочный статус после всех повторов вызывает requests.HTTPError,
+        разомкнутый предохранитель - CircuitOpenError без обращения к сети
+        """
+        url = self.url(path)
+        breaker = self._allow(url)
+        latency = self._latency(url)
+        started = time.monotonic()
+        status = 'error'
+        try:
+            with self._span(url):
+                with self._host_limit(url):
+                    response = self.session.get(
+                        url,
+                        params=self._query_pairs(params),
+                        headers=headers,
+                        timeout=timeout or latency.timeout()
+                    )
+                status = response.status_code
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            self._record_status(breaker, e.response.status_code)
+            raise
+        except requests.exceptions.Timeout:
+            latency.observe_timeout()
+            breaker.record_failure()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            self._observe(url, started, status)
+
+        breaker.record_success()
+        latency.observe(time.monotonic() - started)
+        return response
+
+    async def get_json_async(self, http, path, params=None):
+        """
+        Неблокирующий GET с разбором JSON через aiohttp-сессию http (асинхронный режим).
+        Путь тот же, что у get: параметры, заголовки, предохранитель, адаптивный таймаут,
+        повторы при ошибке соединения, 429 и 5xx и метрики запросов к HH.ru.
+        Ошибочный статус после всех повторов вызывает aiohttp.ClientResponseError,
+        разомкнутый предохранитель - CircuitOpenError без обращения к сети
+        """
+        import aiohttp
+
+        url = self.url(path)
+        breaker = self._allow(url)
+        latency = self._latency(url)
+        # Как и у get, в метриках - один замер на вызов вместе с повторами
+        started = time.monotonic()
+        status = 'error'
+        try:
+            for attempt in range(self.max_retries + 1):
+                retry_after = self.backoff_factor * 2 ** attempt
+                attempt_started = time.monotonic()
+                status = 'error'
+                try:
+                    async with http.get(
+                        url,
+                        params=self._query_pairs(params),
+                        headers=dict(self.session.headers),
+                        timeout=aiohttp.ClientTimeout(total=latency.timeout())
+                    ) as response:
+                        status = response.status
+                        if status in RETRY_STATUSES and attempt < self.max_retries:
+                            retry_after = float(response.headers.get('Retry-After') or retry_after)
+                        else:
+                            self._record_status(breaker, status)
+                            response.raise_for_status()
+                            data = await response.json()
+                            latency.observe(time.monotonic() - attempt_started)
+                            return data
+                except asyncio.TimeoutError:
+                    latency.observe_timeout()
+                    breaker.record_failure()
+                    raise
+                except aiohttp.ClientResponseError:
+                    raise
+                except aiohttp.ClientConnectionError:
+                    if attempt == self.max_retries:
+                        breaker.record_failure()
+                        raise
+                except aiohttp.ClientError:
+                    breaker.record_failure()
+                    raise
+                await asyncio.sleep(retry_after)
+        finally:
+            self._observe(url, started, status)
+
+    def _span(self, url):
+        if self.metrics is None:
+            return NULL_SPAN
+        return self.metrics.span('hh.request', endpoint=self._section(url))
+
+    def get_json(self, path, params=None, timeout=None):
+        """GET-запрос с разбором JSON-ответа"""
+        return self.get(path, params=params, timeout=timeout).json()
+
+    def health(self):
+        """Состояние предохранителей по хостам и задержки по разделам API"""
+        return {
+            'breakers': {host: breaker.state for host, breaker in self._breakers.items()},
+            'timeouts': {key: tracker.timeout() for key, tracker in self._latencies.items()},
+            'latency': {key: tracker.percentiles() for key, tracker in self._latencies.items()},
+        }
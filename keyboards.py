@@ -0,0 +1,43 @@
+from functools import lru_cache, wraps
+
+from telebot import types
+
+# Сколько вариантов клавиатуры фильтров держать в памяти
+FILTERS_KEYBOARD_CACHE_SIZE = 4096
+
+
+class FrozenKeyboard(types.JsonSerializable):
+    """
+    Готовая неизменяемая клавиатура: JSON считается один раз при создании,
+    TeleBot передает его в запрос как есть
+    """
+
+    def __init__(self, markup):
+        self.json = markup.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+def static_keyboard(builder):
+    """Клавиатура без параметров: собирается и сериализуется при первом вызове"""
+    keyboard = None
+
+    @wraps(builder)
+    def get():
+        nonlocal keyboard
+        if keyboard is None:
+            keyboard = FrozenKeyboard(builder())
+        return keyboard
+    return get
+
+
+def cached_keyboard(maxsize):
+    """Клавиатура от хешируемых аргументов: готовые варианты хранятся в LRU-кэше"""
+    def decorator(builder):
+        @lru_cache(maxsize=maxsize)
+        @wraps(builder)
+        def get(*args):
+            return FrozenKeyboard(builder(*args))
+        return get
+    return decorator
@@ -1,20 +1,132 @@
+import asyncio
+import json
+import os
 import telebot
 import requests
 import re
+import sqlite3
+import threading
 from telebot import types
 
-# Замените на ваш токен от @BotFather
-BOT_TOKEN = 'тут токен'
+from admission import AdmissionControl
+from areas import AreaDirectory
+from cache import ResultCache, canonical_query
+from city_resolver import CITY_ALIASES, CityResolver, normalize_name
+from currency import CurrencyRates, meets_min_salary
+from dedup import FingerprintStore
+from dispatch import Dispatcher
+from fanout import FanOut, merge_items, merge_pages, split_query
+from hh_client import HHClient
+from keyboards import FILTERS_KEYBOARD_CACHE_SIZE, cached_keyboard, static_keyboard
+from metrics import NULL_SPAN, Metrics, MetricsServer
+from models import EXPERIENCE_CODES, MAX_CITIES, Filters, Session, Step
+from outbox import Outbox
+from pagination import RESULTS_PAGE_SIZE, UPSTREAM_PAGE_SIZE, SearchCursors
+from rendering import (
+    render_results_page, render_results_page_plain, render_subscription, render_subscription_plain,
+    render_vacancy_details, render_vacancy_details_plain
+)
+from sessions import create_session_store
+from snapshot import SNAPSHOT_CACHE_ENTRIES, Snapshot, Snapshotter
+from subscriptions import SubscriptionScheduler, SubscriptionStore
+from vacancy_details import DETAILS_PREFETCH, VacancyDetails
+from vacancy_index import NOT_FOUND, IndexHarvester, VacancyIndex
+
+# Замените на ваш токен от @BotFather (или задайте переменную окружения BOT_TOKEN)
+BOT_TOKEN = os.environ.get('BOT_TOKEN', 'тут токен')
+
+# Адрес API HH.ru (для нагрузочных тестов - адрес заглушки)
+HH_API_URL = os.environ.get('HH_API_URL', 'https://api.hh.ru')
+
+# Режим работы: polling (по умолчанию), async или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+
+# Настройки режима webhook: публичный адрес бота, секрет и пул обработчиков
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '100'))
+
+# Хранилище сессий: memory (в процессе) или sqlite (общее для нескольких процессов)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(24 * 60 * 60)))
+SESSION_MAX_SIZE = int(os.environ.get('SESSION_MAX_SIZE', '100000'))
+
+# Файл с подписками на новые вакансии
+SUBSCRIPTIONS_DB_PATH = os.environ.get('SUBSCRIPTIONS_DB_PATH', 'subscriptions.db')
+
+# Файл локального индекса вакансий
+VACANCY_INDEX_PATH = os.environ.get('VACANCY_INDEX_PATH', 'vacancies.db')
+
+# Файл отпечатков вакансий для склейки перепубликаций
+FINGERPRINTS_DB_PATH = os.environ.get('FINGERPRINTS_DB_PATH', 'fingerprints.db')
+
+# Снимок сессий, справочника регионов и горячего кэша для быстрого перезапуска
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'snapshot.bin')
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', str(5 * 60)))
+
+# Метрики Prometheus на http://<хост>:METRICS_PORT/metrics (0 - выключены)
+# и трассы обработки каждого обновления в stdout
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+TRACE_UPDATES = os.environ.get('TRACE_UPDATES', '') == '1'
 
 bot = telebot.TeleBot(BOT_TOKEN)
 
+# Метрики создаются, только если они нужны: иначе инструментирование не выполняется
+metrics = Metrics(trace=TRACE_UPDATES) if METRICS_PORT or TRACE_UPDATES else None
+
+
+def span(name, **attrs):
+    """Участок трассы текущего обновления"""
+    return metrics.span(name, **attrs) if metrics is not None else NULL_SPAN
+
+
+# Исходящие запросы к Telegram идут через очередь с ограничением скорости
+outbox = Outbox(bot, metrics=metrics)
+
 # User-Agent для запросов к HH.ru
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
+# Общий пул соединений для всех запросов к HH.ru
+hh_client = HHClient(HEADERS, base_url=HH_API_URL, metrics=metrics)
+
+# Кэш результатов поиска по каноничному запросу
+vacancy_cache = ResultCache()
+
 # Хранилище состояний пользователей
-user_states = {}
+user_states = create_session_store(SESSION_BACKEND, path=SESSION_DB_PATH, ttl=SESSION_TTL, max_size=SESSION_MAX_SIZE)
+
+
+def get_step(chat_id):
+    """Текущий шаг диалога пользователя или None"""
+    return user_states.get_step(chat_id)
+
+
+# Допуск запросов, которые обращаются к HH.ru: лимиты на чат и общий
+admission = AdmissionControl()
+
+
+def reject_update(update, retry_after):
+    """
+    Ответ на отклоненный запрос без обращений к HH.ru: на нажатие кнопки -
+    всплывающее уведомление, на сообщение - не чаще раза в несколько секунд
+    """
+    if retry_after is None:
+        text = "⏳ Запрос уже выполняется, подождите"
+    else:
+        text = f"⏳ Слишком много запросов. Повторите через {max(1, round(retry_after))} с"
+    if isinstance(update, types.CallbackQuery):
+        outbox.answer_callback_query(update.id, text)
+    elif admission.should_notify(update.chat.id):
+        outbox.send_message(update.chat.id, text)
+
+
+# Маршрутизация обновлений по таблицам вместо цепочки предикатов
+dispatcher = Dispatcher(get_step, metrics=metrics, admission=admission, on_rejected=reject_update)
 
 # Список доступных уровней опыта
 EXPERIENCE_LEVELS = {
@@ -38,29 +150,99 @@ POPULAR_CITIES = {
 }
 
 
-def escape_markdown_v2(text):
+def vacancy_cache_key(profession, filters, page=0):
+    """Ключ кэша для страницы результатов поиска"""
+    return canonical_query(profession, filters), page
+
+
+def query_key(profession, filters):
+    """Каноничный ключ запроса строкой (для подписок и локального индекса)"""
+    return json.dumps(canonical_query(profession, filters), ensure_ascii=False)
+
+
+def fetch_vacancies(profession, filters, page=0, on_partial=None):
     """
-    Надежное экранирование всех специальных символов для MarkdownV2
+    Страница результатов поиска. Фильтры с несколькими городами или уровнями опыта
+    разбиваются на отдельные запросы, которые выполняются параллельно,
+    а их результаты объединяются в один список без повторов.
+    on_partial(страница) получает объединенные результаты готовых запросов, пока ответили не все
     """
-    if not text:
-        return ""
-    # Все специальные символы для MarkdownV2
-    special_chars = r'_*[]()~`>#+-=|{}.!'
-    result = str(text)
-    for char in special_chars:
-        result = result.replace(char, '\\' + char)
+    queries = split_query(filters)
+    if len(queries) == 1:
+        return fetch_query(profession, queries[0], page)
+    with span('vacancies.fanout', queries=len(queries), page=page):
+        if on_partial is None:
+            return merge_pages(search_fanout.map(fetch_query, profession, queries, page))
+        results = [(None, NOT_FOUND)] * len(queries)
+        for done, (index, result) in enumerate(search_fanout.stream(fetch_query, profession, queries, page), 1):
+            results[index] = result
+            if result[0] is not None and done < len(queries):
+                on_partial(merge_pages(results)[0])
+        return merge_pages(results)
+
+
+def fetch_query(profession, filters, page=0):
+    """
+    Возвращает страницу результатов одного запроса: из кэша, а при промахе -
+    из локального индекса или API HH.ru. Истекший результат из кэша отдается сразу
+    с пометкой 'stale', а свежий загружается в фоне.
+    Результат - ({'items': [...], 'found': N, 'pages': M}, None) или (None, текст ошибки)
+    """
+    with span('vacancies.fetch', page=page):
+        result, stale = vacancy_cache.get_or_revalidate(
+            vacancy_cache_key(profession, filters, page),
+            lambda: load_vacancies(profession, filters, page),
+            cache_if=lambda result: result[0] is not None and not result[0].get('stale')
+        )
+    if stale:
+        return dict(result[0], stale=True), None
     return result
 
 
-def fetch_vacancies(profession, filters):
+def load_vacancies(profession, filters, page=0):
     """
-    Выполняет запрос к API HH.ru с указанными параметрами
+    Страница результатов без кэша. Запрос, полностью выкачанный в локальный индекс,
+    обслуживается по сохраненной выдаче HH.ru; остальные идут в HH.ru, а ответы пополняют индекс.
+    Если HH.ru недоступен, отвечает индекс по тому, что в нем есть
+    """
+    params = build_vacancy_params(profession, filters, page)
+    try:
+        key = query_key(profession, filters)
+        if vacancy_index.fresh_since(key) is not None:
+            local = vacancy_index.results_page(key, page, UPSTREAM_PAGE_SIZE)
+            if local[0] is not None:
+                cluster_vacancies(local[0]['items'])
+            return local
+    except sqlite3.Error as e:
+        print(f"Ошибка локального индекса вакансий: {e}")
+
+    result = request_vacancies(profession, filters, page)
+    if result[0] is not None:
+        vacancy_index.ingest_async(result[0]['items'])
+    elif result[1] != NOT_FOUND:
+        try:
+            # Сохраненная выдача, пусть и устаревшая, точнее приблизительного поиска по индексу
+            local = vacancy_index.results_page(query_key(profession, filters), page, UPSTREAM_PAGE_SIZE)
+            if local[0] is None:
+                local = vacancy_index.search(params, page, UPSTREAM_PAGE_SIZE)
+        except sqlite3.Error as e:
+            print(f"Ошибка локального индекса вакансий: {e}")
+        else:
+            if local[0] is not None:
+                local[0]['stale'] = True
+                cluster_vacancies(local[0]['items'])
+                return local
+    return result
+
+
+def build_vacancy_params(profession, filters, page=0):
+    """
+    Собирает параметры запроса к /vacancies по профессии и фильтрам
     """
-    base_url = 'https://api.hh.ru/vacancies'
     params = {
         'text': profession,
-        'per_page': 10,
-        'page': 0
+        'per_page': UPSTREAM_PAGE_SIZE,
+        'page': page
     }
 
     # Применение фильтров
@@ -77,20 +259,59 @@ def fetch_vacancies(profession, filters):
         params['experience'] = filters['experience']
 
     if filters.get('city'):
+        # Несколько регионов передаются повторяющимся параметром area
         params['area'] = filters['city']
-    elif filters.get('city_name'):
+    elif filters.get('city_text') or filters.get('city_name'):
         # Если указано название города (custom), ищем по названию через text
-        params['text'] = f"{profession} {filters['city_name']}"
+        params['text'] = f"{profession} {filters.get('city_text') or filters['city_name']}"
+
+    return params
 
+
+def fetch_dictionaries():
+    """Скачивает справочники HH.ru (из них нужна таблица курсов валют)"""
+    return hh_client.get_json('/dictionaries')
+
+
+# Курсы валют для приведения зарплат к рублям: загружаются один раз и хранятся на диске
+currency_rates = CurrencyRates(fetch_dictionaries)
+
+
+# Отпечатки вакансий: перепубликации и копии объединяются в кластеры дублей
+fingerprint_store = FingerprintStore(FINGERPRINTS_DB_PATH)
+
+
+def cluster_vacancies(vacancies):
+    """Отмечает у вакансий кластер дублей; при ошибке хранилища вакансии остаются без него"""
     try:
-        response = requests.get(base_url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        return fingerprint_store.assign(vacancies)
+    except sqlite3.Error as e:
+        print(f"Ошибка хранилища отпечатков вакансий: {e}")
+        return vacancies
 
-        if not data.get('items'):
-            return None, "Вакансий не найдено"
 
-        return data['items'], None
+def parse_vacancies(data):
+    """
+    Извлекает вакансии и общее число найденных из ответа /vacancies;
+    зарплаты всей страницы сразу приводятся к рублям, дубли отмечаются кластером
+    """
+    if not data.get('items'):
+        return None, NOT_FOUND
+
+    return {
+        'items': cluster_vacancies(currency_rates.normalize_page(data['items'])),
+        'found': data.get('found', len(data['items'])),
+        'pages': data.get('pages', 1)
+    }, None
+
+
+def request_vacancies(profession, filters, page=0):
+    """
+    Выполняет запрос к API HH.ru с указанными параметрами
+    """
+    try:
+        response = hh_client.get('/vacancies', params=build_vacancy_params(profession, filters, page))
+        return parse_vacancies(response.json())
 
     except requests.exceptions.RequestException as e:
         return None, f"Ошибка запроса к HH.ru: {str(e)}"
@@ -100,89 +321,159 @@ def fetch_vacancies(profession, filters):
         return None, f"Неизвестная ошибка: {str(e)}"
 
 
-def search_city_by_name(city_name):
+# Курсоры по результатам поисков для постраничного просмотра
+search_cursors = SearchCursors(fetch_vacancies)
+
+
+def request_vacancy(vacancy_id, headers):
+    """Условный запрос полной карточки вакансии (ответ 304 - карточка не менялась)"""
+    return hh_client.get(f'/vacancies/{vacancy_id}', headers=headers)
+
+
+# Полные карточки вакансий: загружаются по кнопке "подробнее" и заранее для первых результатов
+vacancy_details = VacancyDetails(request_vacancy, normalize=currency_rates.normalize_page)
+
+# Параллельные запросы поиска по нескольким городам или уровням опыта
+search_fanout = FanOut()
+
+
+def request_new_vacancies(profession, filters, date_from):
     """
-    Ищет ID города по его названию через API HH.ru
+    Запрашивает вакансии, опубликованные после date_from, для опроса подписок (без кэша).
+    Подписка с несколькими городами или уровнями опыта опрашивается параллельными запросами;
+    если хоть один не удался, опрос повторится целиком (уже отправленные вакансии отсеет seen)
     """
+    queries = split_query(filters)
+    if len(queries) == 1:
+        vacancies, error = request_new_query(profession, queries[0], date_from)
+        if error:
+            return None, error
+    else:
+        results = search_fanout.map(request_new_query, profession, queries, date_from)
+        for _, error in results:
+            if error:
+                return None, error
+        vacancies = merge_items([items for items, _ in results])
+
+    # HH.ru подбирает зарплату приблизительно: отсеиваем вилки ниже минимума после пересчета в рубли
+    min_salary = filters.get('min_salary')
+    return [vacancy for vacancy in vacancies if meets_min_salary(vacancy, min_salary)], None
+
+
+def request_new_query(profession, filters, date_from):
+    """Новые вакансии по одному запросу: все страницы выдачи, пока она не закончится"""
+    params = build_vacancy_params(profession, filters)
+    params['per_page'] = 100
+    params['date_from'] = date_from
+    params['order_by'] = 'publication_time'
+
+    vacancies = []
     try:
-        response = requests.get(
-            'https://api.hh.ru/areas',
-            headers=HEADERS,
-            timeout=10
-        )
-        response.raise_for_status()
-        areas = response.json()
-
-        # Рекурсивный поиск города
-        def find_city(areas_list, name):
-            name_lower = name.lower()
-            for area in areas_list:
-                if area['name'].lower() == name_lower:
-                    return area['id']
-                if 'areas' in area and area['areas']:
-                    result = find_city(area['areas'], name)
-                    if result:
-                        return result
-            return None
-
-        city_id = find_city(areas, city_name)
-        return city_id
+        pages = 1
+        while params['page'] < pages:
+            data = hh_client.get('/vacancies', params=params).json()
+            vacancies.extend(data.get('items', []))
+            pages = data.get('pages', 1)
+            params['page'] += 1
+        return cluster_vacancies(currency_rates.normalize_page(vacancies)), None
+    except requests.exceptions.RequestException as e:
+        return None, f"Ошибка запроса к HH.ru: {str(e)}"
+    except ValueError as e:
+        return None, f"Ошибка обработки ответа: {str(e)}"
+
+
+def query_page_cached(profession, filters, page):
+    """Отдается ли страница одного запроса без HH.ru: из кэша или из выкачанного индекса"""
+    if vacancy_cache.peek(vacancy_cache_key(profession, filters, page)) is not None:
+        return True
+    try:
+        return vacancy_index.fresh_since(query_key(profession, filters)) is not None
+    except sqlite3.Error:
+        return False
+
+
+async def prefetch_search(update, http):
+    """
+    Для асинхронного режима: заранее загружает результаты поиска на событийном цикле,
+    чтобы handle_search взял их из кэша, не блокируя поток на запросе к HH.ru
+    """
+    call = update.callback_query
+    if call is None or call.data != "search_jobs":
+        return
+    # Предзагрузка - тот же запрос к HH.ru, поэтому делается, только если поиск будет допущен
+    if not dispatcher.admits_callback(call):
+        return
+
+    state = user_states.get(call.message.chat.id)
+    if state is None:
+        return
+
+    profession = state.profession
+    queries = split_query(state.filters.as_dict())
+    await asyncio.gather(*(prefetch_query(http, profession, filters) for filters in queries))
+
+
+async def prefetch_query(http, profession, filters):
+    """Предзагрузка первой страницы одного запроса в кэш результатов"""
+    if query_page_cached(profession, filters, 0):
+        return
+
+    try:
+        data = await hh_client.get_json_async(http, '/vacancies', params=build_vacancy_params(profession, filters))
     except Exception as e:
-        print(f"Ошибка поиска города: {e}")
-        return None
-
-
-def format_salary(salary_data):
-    """Форматирует информацию о зарплате для отображения"""
-    if not salary_data:
-        return "не указана"
-
-    currency = salary_data.get('currency', 'RUR')
-    # Конвертируем код валюты в символ
-    currency_map = {
-        'RUR': '₽',
-        'USD': '$',
-        'EUR': '€',
-        'KZT': '₸',
-        'BYR': 'Br'
-    }
-    currency_symbol = currency_map.get(currency, currency)
+        # handle_search повторит запрос сам и покажет ошибку пользователю
+        print(f"Ошибка предзагрузки вакансий: {e}")
+        return
 
-    salary_from = salary_data.get('from')
-    salary_to = salary_data.get('to')
+    result = parse_vacancies(data)
+    if result[0] is not None:
+        vacancy_cache.put(vacancy_cache_key(profession, filters), result)
+        vacancy_index.ingest_async(result[0]['items'])
 
-    parts = []
-    if salary_from:
-        parts.append(f"от {salary_from}")
-    if salary_to:
-        parts.append(f"до {salary_to}")
 
-    if not parts:
-        return "не указана"
+def fetch_areas_tree():
+    """Скачивает полное дерево регионов HH.ru"""
+    return hh_client.get_json('/areas')
 
-    return f"{' '.join(parts)} {currency_symbol}"
 
+# Справочник регионов: загружается один раз и хранится на диске
+area_directory = AreaDirectory(fetch_areas_tree)
 
-def format_vacancy(vacancy):
-    """Форматирует одну вакансию в markdown"""
-    # Безопасное получение данных с экранированием
-    name = escape_markdown_v2(vacancy.get('name', ''))
-    company = escape_markdown_v2(vacancy.get('employer', {}).get('name', 'Не указана'))
-    city = escape_markdown_v2(vacancy.get('area', {}).get('name', 'Не указан'))
-    url = vacancy.get('alternate_url', '')
+# Нечеткий поиск городов по справочнику регионов
+city_resolver = CityResolver(area_directory, popular_ids=POPULAR_CITIES)
 
-    # Форматируем зарплату отдельно и экранируем
-    salary_str = escape_markdown_v2(format_salary(vacancy.get('salary')))
 
-    return (
-        f"💼 *{name}*\n"
-        f"🏢 {company}\n"
-        f"💰 {salary_str}\n"
-        f"📍 {city}\n"
-        f"[Ссылка на вакансию ➡️]({url})"
-    )
+def expand_area(area_id):
+    """Регион и все вложенные в него, как их учитывает поиск HH.ru"""
+    try:
+        return area_directory.descendants(area_id)
+    except Exception as e:
+        print(f"Ошибка загрузки справочника регионов: {e}")
+        return [area_id]
 
 
+# Локальный индекс всех полученных вакансий и фоновая выкачка популярных запросов
+vacancy_index = VacancyIndex(VACANCY_INDEX_PATH, expand_area=expand_area)
+index_harvester = IndexHarvester(vacancy_index, request_vacancies)
+
+
+def notify_subscriber(chat_id, profession, vacancies):
+    """Отправляет подписчику новые вакансии по его запросу"""
+    text = render_subscription(profession, vacancies, RESULTS_PAGE_SIZE)
+    try:
+        outbox.send_message(chat_id, text, parse_mode='MarkdownV2', disable_web_page_preview=True).result()
+    except Exception as e:
+        # Если ошибка форматирования, отправляем простым текстом
+        simple_text = render_subscription_plain(profession, vacancies, RESULTS_PAGE_SIZE)
+        outbox.send_message(chat_id, simple_text, disable_web_page_preview=True)
+
+
+# Подписки на новые вакансии и их фоновый опрос
+subscription_store = SubscriptionStore(SUBSCRIPTIONS_DB_PATH)
+subscription_scheduler = SubscriptionScheduler(subscription_store, request_new_vacancies, notify_subscriber)
+
+
+@static_keyboard
 def create_main_menu():
     """Создает главное меню с кнопками"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -194,65 +485,92 @@ def create_main_menu():
 
 def create_filters_keyboard(filters):
     """Создает клавиатуру для настройки фильтров"""
+    return build_filters_keyboard(filters.as_tuple())
+
+
+@cached_keyboard(FILTERS_KEYBOARD_CACHE_SIZE)
+def build_filters_keyboard(key):
+    """Клавиатура фильтров по ключу Filters.as_tuple()"""
+    filters = Filters(*key)
     markup = types.InlineKeyboardMarkup(row_width=1)
 
     # Кнопка "С зарплатой"
-    salary_text = "✅ Только с зарплатой" if filters.get('with_salary') else "С зарплатой"
+    salary_text = "✅ Только с зарплатой" if filters.with_salary else "С зарплатой"
     markup.add(types.InlineKeyboardButton(salary_text, callback_data="toggle_salary"))
 
     # Кнопка минимальной зарплаты
-    min_salary = filters.get('min_salary', 'не указана')
+    min_salary = filters.min_salary or 'не указана'
     min_salary_text = f"💰 Мин. зарплата: {min_salary}"
     markup.add(types.InlineKeyboardButton(min_salary_text, callback_data="set_min_salary"))
 
     # Кнопка удаленной работы
-    remote_text = "✅ Только удалёнка" if filters.get('remote') else "Удалённая работа"
+    remote_text = "✅ Только удалёнка" if filters.remote else "Удалённая работа"
     markup.add(types.InlineKeyboardButton(remote_text, callback_data="toggle_remote"))
 
     # Кнопка города
-    city_id = filters.get('city', '')
-    city_name = filters.get('city_name', '')
-    if city_name:
-        display_city = city_name
-    elif city_id:
-        display_city = POPULAR_CITIES.get(city_id, 'установлен')
+    city_names = [city_label(city_id) for city_id in filters.cities]
+    if filters.city_text:
+        city_names.append(filters.city_text)
+    if len(city_names) > 3:
+        display_city = f"{', '.join(city_names[:2])} и еще {len(city_names) - 2}"
     else:
-        display_city = 'любой'
+        display_city = ', '.join(city_names) or 'любой'
     city_text = f"🏙 Город: {display_city}"
     markup.add(types.InlineKeyboardButton(city_text, callback_data="set_city"))
 
     # Кнопка опыта
-    exp_level = filters.get('experience', '')
-    exp_text = f"💼 Опыт: {EXPERIENCE_LEVELS.get(exp_level, 'любой')}"
+    exp_names = [EXPERIENCE_LEVELS[exp_id] for exp_id in filters.experience_ids]
+    exp_text = f"💼 Опыт: {', '.join(exp_names) or 'любой'}"
     markup.add(types.InlineKeyboardButton(exp_text, callback_data="set_experience"))
 
     # Кнопка поиска
     markup.add(types.InlineKeyboardButton("🚀 Начать поиск", callback_data="search_jobs"))
 
+    # Кнопка подписки на новые вакансии
+    markup.add(types.InlineKeyboardButton("🔔 Подписаться на новые вакансии", callback_data="subscribe"))
+
     # Кнопка отмены
     markup.add(types.InlineKeyboardButton("❌ Отменить поиск", callback_data="cancel_search"))
 
     return markup
 
 
-def create_experience_keyboard():
-    """Создает клавиатуру для выбора опыта"""
+@cached_keyboard(FILTERS_KEYBOARD_CACHE_SIZE)
+def create_experience_keyboard(experience_mask):
+    """Создает клавиатуру для выбора опыта (можно выбрать несколько уровней)"""
+    selected = Filters(experience_mask=experience_mask).experience_ids
     markup = types.InlineKeyboardMarkup(row_width=1)
     for exp_id, exp_name in EXPERIENCE_LEVELS.items():
-        markup.add(types.InlineKeyboardButton(exp_name, callback_data=f"exp_{exp_id}"))
-    markup.add(types.InlineKeyboardButton("Любой опыт", callback_data="exp_any"))
-    markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_filters"))
+        text = f"✅ {exp_name}" if exp_id in selected else exp_name
+        markup.add(types.InlineKeyboardButton(text, callback_data=f"exp_{exp_id}"))
+    markup.add(types.InlineKeyboardButton("✅ Любой опыт" if not selected else "Любой опыт", callback_data="exp_any"))
+    markup.add(types.InlineKeyboardButton("⬅️ Готово", callback_data="back_to_filters"))
     return markup
 
 
-def create_city_keyboard():
-    """Создает клавиатуру для выбора города"""
+def city_label(city_id):
+    """
+    Название города для кнопок. Берется только из уже загруженного справочника
+    (или снимка и файла на диске), без запроса /areas к HH.ru; если названия нет - ID города
+    """
+    if city_id in POPULAR_CITIES:
+        return POPULAR_CITIES[city_id]
+    area_directory.load_local()
+    return area_directory.names.get(city_id) or city_id
+
+
+@cached_keyboard(FILTERS_KEYBOARD_CACHE_SIZE)
+def create_city_keyboard(cities):
+    """Создает клавиатуру для выбора городов (можно выбрать несколько)"""
     markup = types.InlineKeyboardMarkup(row_width=2)
 
-    # Создаем кнопки для популярных городов
+    # Создаем кнопки для популярных городов и выбранных через ввод названия
     buttons = []
-    for city_id, city_name in POPULAR_CITIES.items():
-        buttons.append(types.InlineKeyboardButton(city_name, callback_data=f"city_{city_id}"))
+    for city_id in list(POPULAR_CITIES) + [city_id for city_id in cities if city_id not in POPULAR_CITIES]:
+        text = city_label(city_id)
+        if city_id in cities:
+            text = f"✅ {text}"
+        buttons.append(types.InlineKeyboardButton(text, callback_data=f"city_{city_id}"))
 
     # Добавляем кнопки по 2 в ряд
     for i in range(0, len(buttons), 2):
@@ -264,18 +582,70 @@ def create_city_keyboard():
     # Кнопка для ввода своего города
     markup.add(types.InlineKeyboardButton("✍️ Ввести свой город", callback_data="city_custom"))
 
-    # Кнопки "Любой город" и "Назад"
+    # Кнопки "Любой город" и "Готово"
     markup.add(types.InlineKeyboardButton("🌍 Любой город", callback_data="city_any"))
+    markup.add(types.InlineKeyboardButton("⬅️ Готово", callback_data="back_to_filters"))
+    return markup
+
+
+def create_city_suggestions_keyboard(candidates):
+    """Создает клавиатуру с найденными вариантами города"""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for city_id, city_name, region_path, _ in candidates:
+        text = f"{city_name} ({region_path})" if region_path else city_name
+        markup.add(types.InlineKeyboardButton(text, callback_data=f"city_{city_id}"))
+    markup.add(types.InlineKeyboardButton("🔎 Искать по названию", callback_data="city_text"))
     markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_filters"))
     return markup
 
 
-@bot.message_handler(commands=['start'])
+@static_keyboard
+def create_results_menu():
+    """Создает клавиатуру под результатами поиска"""
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(types.KeyboardButton("🔍 Новый поиск"))
+    markup.add(types.KeyboardButton("🏠 В главное меню"))
+    return markup
+
+
+def create_pagination_keyboard(cursor_id, page, page_count, vacancies=(), first=1):
+    """
+    Создает кнопки подробностей для вакансий страницы (по номерам, начиная с first)
+    и кнопки перехода между страницами результатов
+    """
+    markup = types.InlineKeyboardMarkup(row_width=5)
+    details = [
+        types.InlineKeyboardButton(f"ℹ️ {i}", callback_data=f"vac_{vacancy['id']}")
+        for i, vacancy in enumerate(vacancies, first)
+    ]
+    if details:
+        markup.add(*details)
+    if page_count <= 1:
+        return markup
+
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"page_{cursor_id}_{page - 1}"))
+    buttons.append(types.InlineKeyboardButton(f"{page + 1}/{page_count}", callback_data=f"page_{cursor_id}_-1"))
+    if page + 1 < page_count:
+        buttons.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=f"page_{cursor_id}_{page + 1}"))
+    markup.row(*buttons)
+    return markup
+
+
+def create_subscriptions_keyboard(subscriptions):
+    """Создает клавиатуру со списком подписок для отписки"""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for subscription_id, profession, _ in subscriptions:
+        markup.add(types.InlineKeyboardButton(f"❌ {profession}", callback_data=f"unsub_{subscription_id}"))
+    return markup
+
+
+@dispatcher.message(commands=['start'])
 def send_welcome(message):
     chat_id = message.chat.id
     # Очищаем состояние пользователя
-    if chat_id in user_states:
-        del user_states[chat_id]
+    user_states.delete(chat_id)
 
     welcome_text = (
         "👋 Добро пожаловать в JobFinder Bot!\n\n"
@@ -283,14 +653,14 @@ def send_welcome(message):
         "Используйте кнопки ниже для начала поиска"
     )
 
-    bot.send_message(
+    outbox.send_message(
         chat_id,
         welcome_text,
         reply_markup=create_main_menu()
     )
 
 
-@bot.message_handler(func=lambda message: message.text == "ℹ️ Помощь")
+@dispatcher.message(text="ℹ️ Помощь", priority=True)
 def send_help(message):
     help_text = (
         "<b>Как пользоваться ботом:</b>\n\n"
@@ -302,11 +672,13 @@ def send_help(message):
         "   • <b>Удалённая работа</b> - только remote-вакансии\n"
         "   • <b>Город</b> - выберите город для поиска\n"
         "   • <b>Опыт</b> - выберите требуемый опыт работы\n"
-        "4️⃣ Нажмите <b>'🚀 Начать поиск'</b> для получения результатов\n\n"
+        "4️⃣ Нажмите <b>'🚀 Начать поиск'</b> для получения результатов\n"
+        "5️⃣ Или нажмите <b>'🔔 Подписаться'</b>, чтобы получать новые вакансии по этим фильтрам\n\n"
+        "📋 Ваши подписки: /subscriptions\n"
         "💡 <i>Совет:</i> Вы можете сбросить фильтры, начав новый поиск"
     )
 
-    bot.send_message(
+    outbox.send_message(
         message.chat.id,
         help_text,
         reply_markup=create_main_menu(),
@@ -314,18 +686,14 @@ def send_help(message):
     )
 
 
-@bot.message_handler(func=lambda message: message.text == "🔍 Найти вакансии")
+@dispatcher.message(text="🔍 Найти вакансии", priority=True)
 def start_job_search(message):
     chat_id = message.chat.id
 
     # Инициализируем состояние пользователя
-    user_states[chat_id] = {
-        'step': 'waiting_profession',
-        'profession': '',
-        'filters': {}
-    }
+    user_states.save(chat_id, Session())
 
-    bot.send_message(
+    outbox.send_message(
         chat_id,
         "🔍 <b>Введите название профессии для поиска</b>\n\n"
         "Примеры: <code>Python developer</code>, <code>Data scientist</code>, <code>Product manager</code>",
@@ -334,26 +702,28 @@ def start_job_search(message):
     )
 
 
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id, {}).get('step') == 'waiting_profession')
+@dispatcher.message(step=Step.WAITING_PROFESSION)
 def handle_profession(message):
     chat_id = message.chat.id
 
-    if chat_id not in user_states:
-        bot.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
         return
 
     profession = message.text.strip()
 
     if len(profession) < 2:
-        bot.send_message(chat_id, "Название профессии слишком короткое. Попробуйте еще раз:")
+        outbox.send_message(chat_id, "Название профессии слишком короткое. Попробуйте еще раз:")
         return
 
-    user_states[chat_id]['profession'] = profession
-    user_states[chat_id]['step'] = 'setting_filters'
+    state.profession = profession
+    state.step = Step.SETTING_FILTERS
+    user_states.save(chat_id, state)
 
-    filters = user_states[chat_id]['filters']
+    filters = state.filters
 
-    bot.send_message(
+    outbox.send_message(
         chat_id,
         f"✅ Профессия: <b>{profession}</b>\n\n"
         "Теперь настройте фильтры поиска:",
@@ -362,57 +732,62 @@ def handle_profession(message):
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_"))
+@dispatcher.callback(prefix="toggle_")
 def handle_toggle_filters(call):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    filters = user_states[chat_id]['filters']
+    filters = state.filters
 
     if call.data == "toggle_salary":
-        filters['with_salary'] = not filters.get('with_salary', False)
+        filters.with_salary = not filters.with_salary
     elif call.data == "toggle_remote":
-        filters['remote'] = not filters.get('remote', False)
+        filters.remote = not filters.remote
+    user_states.save(chat_id, state)
 
-    bot.edit_message_text(
+    outbox.edit_message_text(
         chat_id=chat_id,
         message_id=message_id,
-        text=f"✅ Профессия: <b>{user_states[chat_id]['profession']}</b>\n\nНастройте фильтры:",
+        text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
         parse_mode='HTML',
         reply_markup=create_filters_keyboard(filters)
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "set_min_salary")
+@dispatcher.callback("set_min_salary")
 def handle_set_min_salary(call):
     chat_id = call.message.chat.id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    user_states[chat_id]['step'] = 'waiting_min_salary'
+    state.step = Step.WAITING_MIN_SALARY
+    user_states.save(chat_id, state)
 
-    bot.send_message(
+    outbox.send_message(
         chat_id,
         "💰 <b>Введите минимальную зарплату (в рублях):</b>\n\n"
         "Пример: <code>100000</code> или <code>150000</code>",
         parse_mode='HTML'
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id, {}).get('step') == 'waiting_min_salary')
+@dispatcher.message(step=Step.WAITING_MIN_SALARY)
 def handle_min_salary_input(message):
     chat_id = message.chat.id
 
-    if chat_id not in user_states:
-        bot.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
         return
 
     try:
@@ -423,12 +798,13 @@ def handle_min_salary_input(message):
         if salary < 10000:
             raise ValueError
 
-        user_states[chat_id]['filters']['min_salary'] = salary
-        user_states[chat_id]['step'] = 'setting_filters'
+        state.filters.min_salary = salary
+        state.step = Step.SETTING_FILTERS
+        user_states.save(chat_id, state)
 
-        filters = user_states[chat_id]['filters']
+        filters = state.filters
 
-        bot.send_message(
+        outbox.send_message(
             chat_id,
             f"✅ Минимальная зарплата установлена: <b>{salary:,} ₽</b>\n\n"
             "Вы можете продолжить настройку фильтров:",
@@ -436,7 +812,7 @@ def handle_min_salary_input(message):
             reply_markup=create_filters_keyboard(filters)
         )
     except ValueError:
-        bot.send_message(
+        outbox.send_message(
             chat_id,
             "❌ Некорректное значение. Введите целое число (в рублях):\n"
             "Пример: <code>100000</code>",
@@ -444,323 +820,682 @@ def handle_min_salary_input(message):
         )
 
 
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id, {}).get('step') == 'waiting_city_name')
+@dispatcher.message(step=Step.WAITING_CITY_NAME, limited=True)
 def handle_city_name_input(message):
     chat_id = message.chat.id
 
-    if chat_id not in user_states:
-        bot.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.send_message(chat_id, "Сессия устарела. Начните поиск заново.", reply_markup=create_main_menu())
         return
 
     city_name = message.text.strip()
 
     if len(city_name) < 2:
-        bot.send_message(
+        outbox.send_message(
             chat_id,
             "❌ Название города слишком короткое. Попробуйте еще раз:",
             parse_mode='HTML'
         )
         return
 
-    # Ищем ID города через API
-    bot.send_message(chat_id, f"🔍 Ищу город <b>'{city_name}'</b>...", parse_mode='HTML')
+    try:
+        with span('city.resolve'):
+            candidates = city_resolver.resolve(city_name)
+    except Exception as e:
+        print(f"Ошибка поиска города: {e}")
+        candidates = []
+
+    query = normalize_name(city_name)
+    exact = [c for c in candidates if normalize_name(c[1]) == query or CITY_ALIASES.get(query) == c[0]]
+
+    if len(exact) == 1:
+        # Однозначное совпадение - сразу добавляем ID к выбранным городам
+        city_id = exact[0][0]
+        city_resolver.record_choice(city_id)
+        state.city_query = ''
+        if city_id not in state.filters.cities and not state.filters.toggle_city(city_id):
+            outbox.send_message(chat_id, f"❌ Можно выбрать не больше {MAX_CITIES} городов")
+            return
+        state.step = Step.SETTING_FILTERS
+        user_states.save(chat_id, state)
+        filters = state.filters
+
+        outbox.send_message(
+            chat_id,
+            f"✅ Город <b>'{exact[0][1]}'</b> найден и добавлен!\n\n"
+            "Вы можете продолжить настройку фильтров:",
+            parse_mode='HTML',
+            reply_markup=create_filters_keyboard(filters)
+        )
+        return
 
-    city_id = search_city_by_name(city_name)
+    if candidates:
+        # Предлагаем выбрать из найденных вариантов
+        state.city_query = city_name
+        user_states.save(chat_id, state)
+        outbox.send_message(
+            chat_id,
+            f"🔍 Уточните город по запросу <b>'{city_name}'</b>\n\n"
+            "Выберите вариант из списка или введите название еще раз:",
+            parse_mode='HTML',
+            reply_markup=create_city_suggestions_keyboard(candidates)
+        )
+        return
 
-    if city_id:
-        # Город найден - используем ID
-        user_states[chat_id]['filters']['city'] = city_id
-        user_states[chat_id]['filters']['city_name'] = city_name
-        success_msg = f"✅ Город <b>'{city_name}'</b> найден и установлен!"
-    else:
-        # Город не найден - сохраняем название для поиска по тексту
-        user_states[chat_id]['filters']['city_name'] = city_name
-        if 'city' in user_states[chat_id]['filters']:
-            del user_states[chat_id]['filters']['city']
-        success_msg = f"✅ Установлен поиск по названию: <b>'{city_name}'</b>\n\n" \
-                      "⚠️ <i>Точное совпадение не найдено в базе HH.ru, " \
-                      "будет выполнен текстовый поиск</i>"
-
-    user_states[chat_id]['step'] = 'setting_filters'
-    filters = user_states[chat_id]['filters']
-
-    bot.send_message(
+    # Город не найден - сохраняем название для поиска по тексту
+    state.city_query = ''
+    state.filters.city_text = city_name
+    state.step = Step.SETTING_FILTERS
+    user_states.save(chat_id, state)
+    filters = state.filters
+
+    outbox.send_message(
         chat_id,
-        success_msg + "\n\nВы можете продолжить настройку фильтров:",
+        f"✅ Установлен поиск по названию: <b>'{city_name}'</b>\n\n"
+        "⚠️ <i>Город не найден в базе HH.ru, будет выполнен текстовый поиск</i>\n\n"
+        "Вы можете продолжить настройку фильтров:",
         parse_mode='HTML',
         reply_markup=create_filters_keyboard(filters)
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "set_experience")
+@dispatcher.callback("set_experience")
 def handle_set_experience(call):
     chat_id = call.message.chat.id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    bot.edit_message_text(
+    outbox.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
-        text="<b>💼 Выберите требуемый опыт работы:</b>",
+        text="<b>💼 Выберите требуемый опыт работы:</b>\n\nМожно отметить несколько вариантов",
         parse_mode='HTML',
-        reply_markup=create_experience_keyboard()
+        reply_markup=create_experience_keyboard(state.filters.experience_mask)
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "set_city")
+@dispatcher.callback("set_city")
 def handle_set_city(call):
     chat_id = call.message.chat.id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    bot.edit_message_text(
+    outbox.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
-        text="<b>🏙 Выберите город для поиска:</b>",
+        text="<b>🏙 Выберите город для поиска:</b>\n\nМожно отметить несколько городов",
         parse_mode='HTML',
-        reply_markup=create_city_keyboard()
+        reply_markup=create_city_keyboard(state.filters.cities)
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("exp_"))
+@dispatcher.callback(prefix="exp_")
 def handle_experience_selection(call):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
     exp_data = call.data.split('_')[1]
 
     if exp_data == "any":
-        if 'experience' in user_states[chat_id]['filters']:
-            del user_states[chat_id]['filters']['experience']
-    else:
-        user_states[chat_id]['filters']['experience'] = exp_data
-
-    filters = user_states[chat_id]['filters']
-
-    if exp_data == "any" or exp_data in EXPERIENCE_LEVELS:
-        bot.edit_message_text(
+        # Любой опыт - сбрасываем выбор и возвращаемся к фильтрам
+        state.filters.experience_mask = 0
+        user_states.save(chat_id, state)
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=message_id,
-            text=f"✅ Профессия: <b>{user_states[chat_id]['profession']}</b>\n\nНастройте фильтры:",
+            text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
             parse_mode='HTML',
-            reply_markup=create_filters_keyboard(filters)
+            reply_markup=create_filters_keyboard(state.filters)
+        )
+    elif exp_data in EXPERIENCE_CODES:
+        # Отмечаем или снимаем уровень опыта, оставаясь в списке
+        state.filters.toggle_experience(exp_data)
+        user_states.save(chat_id, state)
+        outbox.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text="<b>💼 Выберите требуемый опыт работы:</b>\n\nМожно отметить несколько вариантов",
+            parse_mode='HTML',
+            reply_markup=create_experience_keyboard(state.filters.experience_mask)
         )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("city_"))
+@dispatcher.callback(prefix="city_")
 def handle_city_selection(call):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
     city_data = call.data.split('_', 1)[1]
 
     if city_data == "any":
         # Убираем все фильтры по городу
-        if 'city' in user_states[chat_id]['filters']:
-            del user_states[chat_id]['filters']['city']
-        if 'city_name' in user_states[chat_id]['filters']:
-            del user_states[chat_id]['filters']['city_name']
+        state.filters.cities = ()
+        state.filters.city_text = ''
+        user_states.save(chat_id, state)
 
-        filters = user_states[chat_id]['filters']
-        bot.edit_message_text(
+        filters = state.filters
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=message_id,
-            text=f"✅ Профессия: <b>{user_states[chat_id]['profession']}</b>\n\nНастройте фильтры:",
+            text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
             parse_mode='HTML',
             reply_markup=create_filters_keyboard(filters)
         )
     elif city_data == "custom":
         # Переход к вводу своего города
-        user_states[chat_id]['step'] = 'waiting_city_name'
-        bot.send_message(
+        state.step = Step.WAITING_CITY_NAME
+        user_states.save(chat_id, state)
+        outbox.send_message(
             chat_id,
             "🏙 <b>Введите название города:</b>\n\n"
             "Примеры: <code>Воронеж</code>, <code>Краснодар</code>, <code>Самара</code>",
             parse_mode='HTML'
         )
-        bot.delete_message(chat_id, message_id)
-    else:
-        # Выбран город из списка
-        user_states[chat_id]['filters']['city'] = city_data
-        # Удаляем custom город если был
-        if 'city_name' in user_states[chat_id]['filters']:
-            del user_states[chat_id]['filters']['city_name']
-
-        filters = user_states[chat_id]['filters']
-        bot.edit_message_text(
+        outbox.delete_message(chat_id, message_id)
+    elif city_data == "text":
+        # Поиск по названию из последнего ввода пользователя
+        city_name = state.city_query
+        state.city_query = ''
+        if city_name:
+            state.filters.city_text = city_name
+        state.step = Step.SETTING_FILTERS
+        user_states.save(chat_id, state)
+
+        filters = state.filters
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=message_id,
-            text=f"✅ Профессия: <b>{user_states[chat_id]['profession']}</b>\n\nНастройте фильтры:",
+            text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
             parse_mode='HTML',
             reply_markup=create_filters_keyboard(filters)
         )
+    elif state.city_query:
+        # Выбран вариант из подсказок по введенному названию - добавляем и возвращаемся к фильтрам
+        city_resolver.record_choice(city_data)
+        if city_data not in state.filters.cities and not state.filters.toggle_city(city_data):
+            outbox.answer_callback_query(call.id, f"Можно выбрать не больше {MAX_CITIES} городов", show_alert=True)
+            return
+        state.city_query = ''
+        state.step = Step.SETTING_FILTERS
+        user_states.save(chat_id, state)
+
+        filters = state.filters
+        outbox.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
+            parse_mode='HTML',
+            reply_markup=create_filters_keyboard(filters)
+        )
+    else:
+        # Город из списка - отмечаем или снимаем, оставаясь в списке
+        if not state.filters.toggle_city(city_data):
+            outbox.answer_callback_query(call.id, f"Можно выбрать не больше {MAX_CITIES} городов", show_alert=True)
+            return
+        user_states.save(chat_id, state)
+        outbox.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text="<b>🏙 Выберите город для поиска:</b>\n\nМожно отметить несколько городов",
+            parse_mode='HTML',
+            reply_markup=create_city_keyboard(state.filters.cities)
+        )
 
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "back_to_filters")
+@dispatcher.callback("back_to_filters")
 def handle_back_to_filters(call):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    filters = user_states[chat_id]['filters']
+    # Возврат из ввода города отменяет ожидание названия
+    state.city_query = ''
+    state.step = Step.SETTING_FILTERS
+    user_states.save(chat_id, state)
+    filters = state.filters
 
-    bot.edit_message_text(
+    outbox.edit_message_text(
         chat_id=chat_id,
         message_id=message_id,
-        text=f"✅ Профессия: <b>{user_states[chat_id]['profession']}</b>\n\nНастройте фильтры:",
+        text=f"✅ Профессия: <b>{state.profession}</b>\n\nНастройте фильтры:",
         parse_mode='HTML',
         reply_markup=create_filters_keyboard(filters)
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "search_jobs")
+@dispatcher.callback("search_jobs", limited=True)
 def handle_search(call):
     chat_id = call.message.chat.id
 
-    if chat_id not in user_states:
-        bot.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
         return
 
-    profession = user_states[chat_id]['profession']
-    filters = user_states[chat_id]['filters']
+    profession = state.profession
+    filters = state.filters.as_dict()
+
+    # Кнопки нового поиска остаются под полем ввода, а под результатами - навигация
+    outbox.send_message(
+        chat_id,
+        f"🚀 Ищу вакансии по запросу <b>'{profession}'</b>...",
+        parse_mode='HTML',
+        reply_markup=create_results_menu()
+    )
+
+    # Частые запросы выкачиваются в локальный индекс заранее (каждый запрос объединенного поиска отдельно)
+    try:
+        for query in split_query(filters):
+            vacancy_index.record_query(query_key(profession, query), profession, query)
+    except sqlite3.Error as e:
+        print(f"Ошибка локального индекса вакансий: {e}")
 
-    bot.send_message(chat_id, f"🚀 Ищу вакансии по запросу <b>'{profession}'</b>...", parse_mode='HTML')
+    # Результаты объединенного поиска показываются по мере ответов на отдельные запросы
+    message_ids = []
 
-    vacancies, error = fetch_vacancies(profession, filters)
+    def show_partial(data):
+        message_id = send_partial_results(chat_id, profession, data, message_ids[0] if message_ids else None)
+        if message_id is not None and not message_ids:
+            message_ids.append(message_id)
+
+    first_page, error = fetch_vacancies(profession, filters, on_partial=show_partial)
 
     if error:
-        bot.send_message(
+        outbox.send_message(
             chat_id,
             f"❌ {error}",
             reply_markup=create_main_menu()
         )
-        if chat_id in user_states:
-            del user_states[chat_id]
-        bot.answer_callback_query(call.id)
+        user_states.delete(chat_id)
+        outbox.answer_callback_query(call.id)
         return
 
-    if not vacancies:
-        bot.send_message(
-            chat_id,
-            "❌ Вакансий по вашему запросу не найдено",
-            reply_markup=create_main_menu()
-        )
-        if chat_id in user_states:
-            del user_states[chat_id]
-        bot.answer_callback_query(call.id)
+    cursor_id = search_cursors.create(profession, filters, first_page)
+    error = send_results_page(chat_id, cursor_id, 0, message_id=message_ids[0] if message_ids else None)
+    if error:
+        outbox.send_message(chat_id, f"❌ {error}", reply_markup=create_main_menu())
+
+    # Удаляем состояние после завершения поиска
+    user_states.delete(chat_id)
+    outbox.answer_callback_query(call.id)
+
+
+def send_partial_results(chat_id, profession, data, message_id=None):
+    """
+    Промежуточные результаты поиска без кнопок навигации: первый показ - новым сообщением,
+    следующие правят его. Возвращает ID сообщения (None, если отправить не удалось)
+    """
+    vacancies = []
+    clusters = set()
+    for vacancy in data['items']:
+        cluster = vacancy.get('cluster', vacancy['id'])
+        if cluster not in clusters:
+            clusters.add(cluster)
+            vacancies.append(vacancy)
+            if len(vacancies) == RESULTS_PAGE_SIZE:
+                break
+
+    text = render_results_page(profession, data['found'], 0, 1, 1, vacancies, data.get('stale', False), pending=True)
+    try:
+        if message_id is None:
+            return outbox.send_message(chat_id, text, parse_mode='MarkdownV2',
+                                       disable_web_page_preview=True).result().message_id
+        # Правку не ждем: еще не отправленная заменится следующей
+        outbox.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode='MarkdownV2',
+                                 disable_web_page_preview=True)
+    except Exception as e:
+        # Промежуточный показ необязателен: итоговая страница отправится в любом случае
+        print(f"Ошибка показа промежуточных результатов: {e}")
+    return message_id
+
+
+def send_results_page(chat_id, cursor_id, page, message_id=None):
+    """
+    Показывает страницу результатов: новым сообщением или правкой message_id.
+    Возвращает текст ошибки, если страницу показать не удалось
+    """
+    cursor = search_cursors.get(cursor_id)
+    if cursor is None:
+        return "Результаты поиска устарели. Начните поиск заново."
+
+    vacancies, error = search_cursors.page_items(cursor, page)
+    if error:
+        return error
+
+    first = page * RESULTS_PAGE_SIZE + 1
+    markup = create_pagination_keyboard(cursor_id, page, cursor.page_count, vacancies, first)
+
+    def deliver(text, parse_mode):
+        # Ждем результата, чтобы при ошибке разметки отправить простой текст
+        if message_id is None:
+            outbox.send_message(chat_id, text, parse_mode=parse_mode,
+                                disable_web_page_preview=True, reply_markup=markup).result()
+        else:
+            outbox.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode=parse_mode,
+                                     disable_web_page_preview=True, reply_markup=markup).result()
+
+    page_args = (cursor.profession, cursor.found, page, cursor.page_count, first, vacancies, cursor.stale)
+    try:
+        deliver(render_results_page(*page_args), 'MarkdownV2')
+    except Exception as e:
+        # Если ошибка форматирования, отправляем простым текстом
+        deliver(render_results_page_plain(*page_args), None)
+
+    # Следующая страница и карточки первых вакансий загружаются заранее, пока пользователь читает текущую
+    search_cursors.prefetch(cursor, page + 1)
+    vacancy_details.prefetch([vacancy['id'] for vacancy in vacancies[:DETAILS_PREFETCH]])
+    return None
+
+
+def results_page_needs_upstream(call):
+    """Уйдет ли листание в HH.ru: нужной страницы HH.ru нет в кэше хотя бы у одного запроса"""
+    _, cursor_id, page = call.data.split('_', 2)
+    cursor = search_cursors.get(cursor_id)
+    if cursor is None or int(page) == -1:
+        return False
+    upstream_page, _ = cursor.start(int(page))
+    return not all(query_page_cached(cursor.profession, query, upstream_page)
+                   for query in split_query(cursor.filters))
+
+
+def vacancy_details_needs_upstream(call):
+    """Уйдет ли запрос карточки в HH.ru: ее нет в кэше и она не загружается заранее"""
+    return not vacancy_details.is_cached(call.data.split('_', 1)[1])
+
+
+@dispatcher.callback(prefix="page_", limited=results_page_needs_upstream)
+def handle_results_page(call):
+    _, cursor_id, page = call.data.split('_', 2)
+    page = int(page)
+
+    if page == -1:
+        # Кнопка с номером страницы ничего не делает
+        outbox.answer_callback_query(call.id)
         return
 
-    # Формируем результаты
-    profession_escaped = escape_markdown_v2(profession)
-    result_text = f"✅ Найдено *{len(vacancies)}* вакансий по запросу *{profession_escaped}*:\n\n"
+    error = send_results_page(call.message.chat.id, cursor_id, page, message_id=call.message.message_id)
+    if error:
+        outbox.answer_callback_query(call.id, error, show_alert=True)
+        return
+    outbox.answer_callback_query(call.id)
 
-    for i, vac in enumerate(vacancies[:10], 1):
-        result_text += f"{i}\\. {format_vacancy(vac)}\n\n"
 
-    # Добавляем кнопку для нового поиска
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(types.KeyboardButton("🔍 Новый поиск"))
-    markup.add(types.KeyboardButton("🏠 В главное меню"))
+@dispatcher.callback(prefix="vac_", limited=vacancy_details_needs_upstream)
+def handle_vacancy_details(call):
+    chat_id = call.message.chat.id
+    vacancy_id = call.data.split('_', 1)[1]
+
+    with span('vacancy.details'):
+        vacancy, error = vacancy_details.get(vacancy_id)
+    if error:
+        outbox.answer_callback_query(call.id, error, show_alert=True)
+        return
+    outbox.answer_callback_query(call.id)
 
     try:
-        bot.send_message(
-            chat_id,
-            result_text,
-            parse_mode='MarkdownV2',
-            disable_web_page_preview=True,
-            reply_markup=markup
-        )
+        outbox.send_message(chat_id, render_vacancy_details(vacancy), parse_mode='MarkdownV2',
+                            disable_web_page_preview=True).result()
     except Exception as e:
         # Если ошибка форматирования, отправляем простым текстом
-        simple_text = f"✅ Найдено {len(vacancies)} вакансий по запросу '{profession}':\n\n"
-
-        for i, vac in enumerate(vacancies[:10], 1):
-            name = vac.get('name', '')
-            company = vac.get('employer', {}).get('name', 'Не указана')
-            city = vac.get('area', {}).get('name', 'Не указан')
-            salary_str = format_salary(vac.get('salary'))
-            url = vac.get('alternate_url', '')
-
-            simple_text += (
-                f"{i}. 💼 {name}\n"
-                f"🏢 {company}\n"
-                f"💰 {salary_str}\n"
-                f"📍 {city}\n"
-                f"🔗 {url}\n\n"
-            )
+        outbox.send_message(chat_id, render_vacancy_details_plain(vacancy), disable_web_page_preview=True)
 
-        bot.send_message(
-            chat_id,
-            simple_text,
-            disable_web_page_preview=True,
-            reply_markup=markup
+
+@dispatcher.callback("subscribe")
+def handle_subscribe(call):
+    chat_id = call.message.chat.id
+
+    state = user_states.get(chat_id)
+    if state is None:
+        outbox.answer_callback_query(call.id, "Сессия устарела. Начните поиск заново.", show_alert=True)
+        return
+
+    profession = state.profession
+    filters = state.filters.as_dict()
+
+    # Уже найденные вакансии не присылаем повторно
+    seen_ids = []
+    for query in split_query(filters):
+        cached = vacancy_cache.peek(vacancy_cache_key(profession, query))
+        if cached and cached[0]:
+            for vac in cached[0]['items']:
+                seen_ids.append(vac['id'])
+                seen_ids.append(vac.get('cluster', vac['id']))
+
+    subscription_id = subscription_store.add(
+        chat_id,
+        profession,
+        filters,
+        query_key(profession, filters),
+        seen_ids
+    )
+
+    if subscription_id is None:
+        outbox.answer_callback_query(
+            call.id,
+            "Такая подписка уже есть или достигнут лимит подписок",
+            show_alert=True
         )
+        return
 
-    # Удаляем состояние после завершения поиска
-    if chat_id in user_states:
-        del user_states[chat_id]
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id, "🔔 Подписка оформлена! Новые вакансии будут приходить сюда.", show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "cancel_search")
+@dispatcher.message(commands=['subscriptions'])
+def list_subscriptions(message):
+    subscriptions = subscription_store.list_for_chat(message.chat.id)
+
+    if not subscriptions:
+        outbox.send_message(
+            message.chat.id,
+            "У вас нет подписок. Настройте фильтры поиска и нажмите <b>'🔔 Подписаться'</b>",
+            parse_mode='HTML',
+            reply_markup=create_main_menu()
+        )
+        return
+
+    outbox.send_message(
+        message.chat.id,
+        "<b>🔔 Ваши подписки</b>\n\nНажмите на подписку, чтобы отменить её:",
+        parse_mode='HTML',
+        reply_markup=create_subscriptions_keyboard(subscriptions)
+    )
+
+
+@dispatcher.callback(prefix="unsub_")
+def handle_unsubscribe(call):
+    chat_id = call.message.chat.id
+    subscription_id = int(call.data.split('_', 1)[1])
+
+    subscription_store.remove(chat_id, subscription_id)
+    subscriptions = subscription_store.list_for_chat(chat_id)
+
+    outbox.edit_message_text(
+        "<b>🔔 Ваши подписки</b>\n\nНажмите на подписку, чтобы отменить её:" if subscriptions
+        else "Подписок больше нет",
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        parse_mode='HTML',
+        reply_markup=create_subscriptions_keyboard(subscriptions)
+    )
+    outbox.answer_callback_query(call.id, "Подписка отменена")
+
+
+@dispatcher.callback("cancel_search")
 def handle_cancel_search(call):
     chat_id = call.message.chat.id
 
-    if chat_id in user_states:
-        del user_states[chat_id]
+    user_states.delete(chat_id)
 
-    bot.send_message(
+    outbox.send_message(
         chat_id,
         "❌ Поиск отменён",
         reply_markup=create_main_menu()
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
 
-@bot.message_handler(func=lambda message: message.text == "🔍 Новый поиск")
+@dispatcher.message(text="🔍 Новый поиск")
 def new_search(message):
     start_job_search(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "🏠 В главное меню")
+@dispatcher.message(text="🏠 В главное меню")
 def back_to_main_menu(message):
     send_welcome(message)
 
 
-@bot.message_handler(func=lambda message: True)
+@dispatcher.message(fallback=True)
 def handle_unknown(message):
-    bot.send_message(
+    outbox.send_message(
         message.chat.id,
         "Неизвестная команда. Используйте кнопки для навигации:",
         reply_markup=create_main_menu()
     )
 
 
+def cache_requests():
+    stats = vacancy_cache.stats()
+    return {'hit': stats['hits'], 'stale': stats['stale_hits'], 'miss': stats['misses']}
+
+
+def cache_hit_ratio():
+    stats = vacancy_cache.stats()
+    lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+    return (stats['hits'] + stats['stale_hits']) / lookups if lookups else 0
+
+
+if metrics is not None:
+    metrics.gauge('jobfinder_active_sessions', 'Активные сессии пользователей', lambda: len(user_states))
+    metrics.gauge('jobfinder_cache_requests_total', 'Обращения к кэшу результатов поиска',
+                  cache_requests, label='result', kind='counter')
+    metrics.gauge('jobfinder_cache_hit_ratio', 'Доля обращений к кэшу, обслуженных без HH.ru', cache_hit_ratio)
+    metrics.gauge('jobfinder_cache_bytes', 'Объем кэша результатов поиска', lambda: vacancy_cache.stats()['bytes'])
+    metrics.gauge('jobfinder_vacancy_details_requests_total', 'Обращения к кэшу карточек вакансий',
+                  lambda: {result: count for result, count in vacancy_details.stats().items() if result != 'entries'},
+                  label='result', kind='counter')
+    metrics.gauge('jobfinder_admission_requests_total', 'Дорогие запросы: допущенные, отклоненные и повторные',
+                  admission.stats, label='result', kind='counter')
+    metrics.gauge('jobfinder_outbox_queue_depth', 'Запросы к Telegram в очереди',
+                  lambda: outbox.stats()['queue_depth'])
+    metrics.gauge('jobfinder_hh_circuit_open', 'Предохранитель HH.ru разомкнут (1) или замкнут (0)',
+                  lambda: {host: int(state != 'closed') for host, state in hh_client.health()['breakers'].items()},
+                  label='host')
+
+
+def collect_snapshot():
+    """Состояние для снимка: сессии, справочник регионов с выбором городов и горячий кэш"""
+    # Справочник загружается при первом поиске города; если поиска еще не было,
+    # он берется из прежнего снимка или с диска, чтобы не пропасть из нового снимка
+    area_directory.load_local()
+    areas = area_directory.export()
+    if areas is not None:
+        areas['usage'] = dict(city_resolver.usage)
+    return {
+        'sessions': user_states.export(),
+        'areas': areas,
+        'cache': vacancy_cache.export(SNAPSHOT_CACHE_ENTRIES),
+    }
+
+
+def restore_snapshot(snapshot):
+    """
+    Подключает снимок прошлого запуска. Сессии берутся из него при первом обращении
+    к чату, справочник регионов - при первом поиске города, кэш загружается в фоне
+    """
+    user_states.restore_from(snapshot)
+
+    def preload_areas():
+        data = snapshot.areas()
+        if data:
+            for area_id, count in data.get('usage', {}).items():
+                city_resolver.usage[area_id] = city_resolver.usage.get(area_id, 0) + count
+        return data
+
+    area_directory.preload = preload_areas
+
+    def restore_cache():
+        try:
+            vacancy_cache.restore(snapshot.cache_entries())
+        except ValueError as e:
+            print(f"Не удалось восстановить кэш из снимка: {e}")
+
+    threading.Thread(target=restore_cache, name='snapshot-restore', daemon=True).start()
+
+
+# Снимок сохраняется периодически и при остановке
+snapshotter = Snapshotter(collect_snapshot, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL)
+
+
+@bot.message_handler(func=lambda message: True)
+def route_message(message):
+    dispatcher.dispatch_message(message)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+def route_callback(call):
+    dispatcher.dispatch_callback(call)
+
+
 if __name__ == '__main__':
     print("JobFinder Bot запущен...")
     print("Для остановки нажмите Ctrl+C")
+    snapshot = Snapshot.open(SNAPSHOT_PATH)
+    if snapshot is not None:
+        restore_snapshot(snapshot)
+    snapshotter.start()
+    subscription_scheduler.start()
+    index_harvester.start()
+    if METRICS_PORT:
+        MetricsServer(metrics, port=METRICS_PORT).start()
     try:
-        bot.infinity_polling()
+        if BOT_MODE == 'async':
+            from async_runtime import AsyncRuntime
+            AsyncRuntime(bot, prefetch=prefetch_search).run()
+        elif BOT_MODE == 'webhook':
+            from webhook import WebhookServer
+            server = WebhookServer(
+                bot,
+                path='/webhook',
+                secret_token=WEBHOOK_SECRET or None,
+                port=WEBHOOK_PORT,
+                workers=WEBHOOK_WORKERS,
+                queue_size=WEBHOOK_QUEUE_SIZE
+            )
+            server.serve_forever(public_url=WEBHOOK_URL)
+        else:
+            bot.infinity_polling()
     except KeyboardInterrupt:
-        print("\nБот остановлен")
\ No newline at end of file
+        print("\nБот остановлен")
+    finally:
+        outbox.stop()
+        try:
+            snapshotter.save()
+        except Exception as e:
+            print(f"Ошибка сохранения снимка состояния: {e}")
\ No newline at end of file
@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм задержки (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_HOST = '0.0.0.0'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами для каждого набора значений меток"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # значения меток -> [счетчики по корзинам (последняя - +Inf), сумма]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'started')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        finished = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.append({
+            'name': self.name,
+            'start_ms': round((self.started - self.trace[0]) * 1000, 3),
+            'duration_ms': round((finished - self.started) * 1000, 3),
+            **self.attrs,
+        })
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+    Метрики бота в формате Prometheus и трассировка обработки обновлений.
+    Компоненты получают объект Metrics необязательным параметром:
+    без него инструментирование не выполняется совсем
+    """
+
+    def __init__(self, trace=False):
+        self.handler_seconds = Histogram(
+            'jobfinder_handler_seconds', 'Время работы обработчиков обновлений', ('handler',))
+        self.upstream_seconds = Histogram(
+            'jobfinder_hh_request_seconds', 'Задержка запросов к HH.ru', ('endpoint', 'status'))
+        self.telegram_seconds = Histogram(
+            'jobfinder_telegram_request_seconds', 'Задержка запросов к Telegram', ('method', 'status'))
+        self.telegram_queue_seconds = Histogram(
+            'jobfinder_telegram_queue_seconds', 'Время от постановки в очередь до ответа Telegram', ('method',))
+        self.histograms = [self.handler_seconds, self.upstream_seconds, self.telegram_seconds,
+                           self.telegram_queue_seconds]
+        # name -> (тип, описание, функция, возвращающая число или словарь {значение метки: число}, метка)
+        self.gauges = {}
+        self.trace_enabled = trace
+        self._local = threading.local()
+
+    def gauge(self, name, help_text, collect, label=None, kind='gauge'):
+        """
+        Регистрирует показатель, который считается в момент выдачи метрик.
+        collect() возвращает число или, если указана метка label, словарь {значение метки: число}
+        """
+        self.gauges[name] = (kind, help_text, collect, label)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for name, (kind, help_text, collect, label) in self.gauges.items():
+            try:
+                value = collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрики {name}: {e}")
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if label is None:
+                lines.append(f'{name} {value}')
+            else:
+                for label_value, item in value.items():
+                    lines.append(f'{name}{_format_labels((label,), (label_value,))} {item}')
+        return '\n'.join(lines) + '\n'
+
+    def start_trace(self, **attrs):
+        """Начинает трассу обработки обновления в текущем потоке"""
+        if self.trace_enabled:
+            # Первый элемент - время начала трассы, дальше - завершенные участки
+            self._local.trace = [time.perf_counter()]
+            self._local.attrs = attrs
+
+    def span(self, name, **attrs):
+        """Участок трассы: with metrics.span('hh.request', endpoint='vacancies'): ..."""
+        trace = getattr(self._local, 'trace', None) if self.trace_enabled else None
+        if trace is None:
+            return NULL_SPAN
+        return _Span(trace, name, attrs)
+
+    def finish_trace(self):
+        """Завершает трассу и выводит ее одной строкой JSON"""
+        trace = getattr(self._local, 'trace', None) if self.trace_enabled else None
+        if trace is None:
+            return
+        self._local.trace = None
+        total_ms = round((time.perf_counter() - trace[0]) * 1000, 3)
+        print(json.dumps(
+            {'trace': self._local.attrs, 'duration_ms': total_ms, 'spans': trace[1:]},
+            ensure_ascii=False, default=str
+        ))
+
+
+class MetricsServer:
+    """HTTP-сервер с метриками: GET /metrics"""
+
+    def __init__(self, metrics, host=METRICS_HOST, port=9100):
+        self.metrics = metrics
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
@@ -0,0 +1,184 @@
+import struct
+from enum import IntEnum
+
+
+class Step(IntEnum):
+    """Шаг диалога пользователя с ботом"""
+    WAITING_PROFESSION = 1
+    SETTING_FILTERS = 2
+    WAITING_MIN_SALARY = 3
+    WAITING_CITY_NAME = 4
+
+
+# Уровни опыта HH.ru по коду (0 - любой опыт)
+EXPERIENCE_IDS = (None, 'noExperience', 'between1And3', 'between3And6', 'moreThan6')
+EXPERIENCE_CODES = {exp_id: code for code, exp_id in enumerate(EXPERIENCE_IDS) if exp_id}
+
+# Сколько городов можно выбрать для одного поиска
+MAX_CITIES = 10
+
+# Бинарный формат сессии: версия, шаг, флаги, маска уровней опыта, мин. зарплата, число городов,
+# затем ID городов и строки профессии, названия города для текстового поиска и ожидающего уточнения запроса.
+# В версии 1 вместо маски был один код опыта, а вместо списка - один ID города
+_FORMAT_VERSION = 2
+_HEADER = struct.Struct('<BBBBIB')
+_HEADER_V1 = struct.Struct('<BBBBII')
+_CITY = struct.Struct('<I')
+_STR_LEN = struct.Struct('<H')
+
+_FLAG_WITH_SALARY = 1
+_FLAG_REMOTE = 2
+
+
+def _pack_str(value):
+    data = value.encode('utf-8')[:0xFFFF]
+    return _STR_LEN.pack(len(data)) + data
+
+
+def _unpack_str(data, offset):
+    (length,) = _STR_LEN.unpack_from(data, offset)
+    offset += _STR_LEN.size
+    return data[offset:offset + length].decode('utf-8', 'ignore'), offset + length
+
+
+def _one_or_list(values):
+    """Одно значение как есть, несколько - списком (формат фильтров fetch_vacancies)"""
+    return values[0] if len(values) == 1 else list(values)
+
+
+class Filters:
+    """Фильтры поиска вакансий"""
+
+    __slots__ = ('with_salary', 'remote', 'min_salary', 'cities', 'city_text', 'experience_mask')
+
+    def __init__(self, with_salary=False, remote=False, min_salary=0, cities=(), city_text='', experience_mask=0):
+        self.with_salary = with_salary
+        self.remote = remote
+        self.min_salary = min_salary
+        # ID регионов HH.ru строками, как в API, в порядке выбора
+        self.cities = tuple(cities)
+        # Название города для поиска по тексту, если его нет в справочнике
+        self.city_text = city_text
+        # Выбранные уровни опыта: бит (код - 1) для каждого кода из EXPERIENCE_IDS
+        self.experience_mask = experience_mask
+
+    @property
+    def experience_ids(self):
+        """Выбранные уровни опыта в формате API HH.ru"""
+        return tuple(
+            exp_id for code, exp_id in enumerate(EXPERIENCE_IDS)
+            if exp_id and self.experience_mask & (1 << (code - 1))
+        )
+
+    def toggle_experience(self, exp_id):
+        self.experience_mask ^= 1 << (EXPERIENCE_CODES[exp_id] - 1)
+
+    def toggle_city(self, city_id):
+        """Добавляет город к выбранным или убирает его; False, если выбрано слишком много"""
+        if city_id in self.cities:
+            self.cities = tuple(c for c in self.cities if c != city_id)
+        elif len(self.cities) >= MAX_CITIES:
+            return False
+        else:
+            self.cities += (city_id,)
+        return True
+
+    def as_tuple(self):
+        """Компактный неизменяемый ключ фильтров (для кэшей)"""
+        return self.with_salary, self.remote, self.min_salary, self.cities, self.city_text, self.experience_mask
+
+    def as_dict(self):
+        """
+        Фильтры в виде словаря с ключами, которые понимает fetch_vacancies.
+        Несколько городов или уровней опыта передаются списком
+        """
+        result = {}
+        if self.with_salary:
+            result['with_salary'] = True
+        if self.min_salary:
+            result['min_salary'] = self.min_salary
+        if self.remote:
+            result['remote'] = True
+        if self.cities:
+            result['city'] = _one_or_list(self.cities)
+        if self.city_text:
+            result['city_text'] = self.city_text
+        if self.experience_mask:
+            result['experience'] = _one_or_list(self.experience_ids)
+        return result
+
+
+class Session:
+    """Состояние диалога пользователя"""
+
+    __slots__ = ('step', 'profession', 'filters', 'city_query')
+
+    def __init__(self, step=Step.WAITING_PROFESSION, profession='', filters=None, city_query=''):
+        self.step = step
+        self.profession = profession
+        self.filters = filters if filters is not None else Filters()
+        # Название города, для которого пользователю предложены варианты
+        self.city_query = city_query
+
+    def to_bytes(self):
+        """Компактное бинарное представление для хранилища сессий"""
+        f = self.filters
+        flags = (_FLAG_WITH_SALARY if f.with_salary else 0) | (_FLAG_REMOTE if f.remote else 0)
+        cities = f.cities[:0xFF]
+        return b''.join((
+            _HEADER.pack(_FORMAT_VERSION, self.step, flags, f.experience_mask,
+                         min(f.min_salary, 0xFFFFFFFF), len(cities)),
+            *(_CITY.pack(int(city)) for city in cities),
+            _pack_str(self.profession),
+            _pack_str(f.city_text),
+            _pack_str(self.city_query),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        version = data[0]
+        if version == 1:
+            return cls._from_bytes_v1(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия сессии: {version}")
+        _, step, flags, experience_mask, min_salary, city_count = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        cities = []
+        for _ in range(city_count):
+            cities.append(str(_CITY.unpack_from(data, offset)[0]))
+            offset += _CITY.size
+        profession, offset = _unpack_str(data, offset)
+        city_text, offset = _unpack_str(data, offset)
+        city_query, offset = _unpack_str(data, offset)
+        filters = Filters(
+            with_salary=bool(flags & _FLAG_WITH_SALARY),
+            remote=bool(flags & _FLAG_REMOTE),
+            min_salary=min_salary,
+            cities=cities,
+            city_text=city_text,
+            experience_mask=experience_mask
+        )
+        return cls(Step(step), profession, filters, city_query)
+
+    @classmethod
+    def _from_bytes_v1(cls, data):
+        _, step, flags, experience, min_salary, city = _HEADER_V1.unpack_from(data)
+        offset = _HEADER_V1.size
+        profession, offset = _unpack_str(data, offset)
+        city_name, offset = _unpack_str(data, offset)
+        city_query, offset = _unpack_str(data, offset)
+        filters = Filters(
+            with_salary=bool(flags & _FLAG_WITH_SALARY),
+            remote=bool(flags & _FLAG_REMOTE),
+            min_salary=min_salary,
+            cities=(str(city),) if city else (),
+            # При выбранном ID название хранилось только для показа
+            city_text='' if city else city_name,
+            experience_mask=1 << (experience - 1) if experience else 0
+        )
+        return cls(Step(step), profession, filters, city_query)
+
+    @staticmethod
+    def peek_step(data):
+        """Шаг диалога прямо из бинарного представления, без разбора всей сессии"""
+        return Step(data[1])
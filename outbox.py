@@ -0,0 +1,337 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+# Общий лимит Telegram: около 30 сообщений в секунду на бота
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+
+# Лимит на один чат: около одного сообщения в секунду, с небольшим запасом на всплеск
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+# Потоки, выполняющие запросы к Telegram
+SEND_WORKERS = 8
+
+# Сколько последних задержек отправки хранить для статистики
+LATENCY_WINDOW = 1000
+
+# Через сколько секунд простоя забывать о чате
+CHAT_IDLE_TTL = 60
+
+# Сколько секунд при остановке ждать отправки уже поставленных запросов
+STOP_TIMEOUT = 5
+
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд будет доступен маркер (0 - уже доступен)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('method', 'args', 'kwargs', 'limited', 'merge_key', 'future', 'enqueued_at')
+
+    def __init__(self, method, args, kwargs, limited, merge_key):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.limited = limited
+        self.merge_key = merge_key
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Chat:
+    __slots__ = ('jobs', 'bucket', 'busy', 'scheduled', 'last_active')
+
+    def __init__(self):
+        self.jobs = deque()
+        self.bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+        self.busy = False
+        self.scheduled = False
+        self.last_active = time.monotonic()
+
+
+class Outbox:
+    """
+    Очередь исходящих запросов к Telegram с ограничением скорости:
+    общая маркерная корзина на бота и отдельная на каждый чат.
+    Запросы одного чата выполняются по порядку, при 429 чат ставится
+    на паузу на retry_after, подряд идущие правки одного сообщения склеиваются.
+    Методы возвращают Future с результатом вызова TeleBot
+    """
+
+    def __init__(self, bot, workers=SEND_WORKERS, metrics=None):
+        self.bot = bot
+        self.workers = workers
+        self.metrics = metrics
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.sent = 0
+        self.failed = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self.pending = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._chats = {}
+        self._ready = []
+        self._seq = itertools.count()
+        lock = threading.RLock()
+        self._cond = threading.Condition(lock)
+        # Отдельное условие для stop(), чтобы не перехватывать пробуждения потока расписания
+        self._idle = threading.Condition(lock)
+        self._closing = False
+        self._stopped = False
+        self._executor = None
+        self._thread = None
+        self._last_sweep = time.monotonic()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='outbox')
+            self._thread = threading.Thread(target=self._schedule_loop, name='outbox', daemon=True)
+            self._thread.start()
+
+    def _schedule(self, chat_key, chat, at):
+        chat.scheduled = True
+        heapq.heappush(self._ready, (at, next(self._seq), chat_key))
+        self._cond.notify()
+
+    def submit(self, chat_key, method, args, kwargs, limited=True, merge_key=None):
+        """Ставит вызов bot.<method>(*args, **kwargs) в очередь чата chat_key"""
+        with self._cond:
+            if self._closing:
+                job = _Job(method, args, kwargs, False, None)
+                job.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+                return job.future
+            self._ensure_started()
+            if chat_key is None:
+                # Вызовы вне чатов не ограничиваются и не ждут друг друга
+                job = _Job(method, args, kwargs, False, None)
+                self._executor.submit(self._execute_unordered, job)
+                return job.future
+
+            chat = self._chats.get(chat_key)
+            if chat is None:
+                chat = self._chats[chat_key] = _Chat()
+
+            # Подряд идущая правка того же сообщения заменяет еще не отправленную
+            if merge_key is not None and chat.jobs and chat.jobs[-1].merge_key == merge_key:
+                job = chat.jobs[-1]
+                job.args = args
+                job.kwargs = kwargs
+                self.merged += 1
+                return job.future
+
+            job = _Job(method, args, kwargs, limited, merge_key)
+            chat.jobs.append(job)
+            self.pending += 1
+            if not chat.busy and not chat.scheduled:
+                self._schedule(chat_key, chat, time.monotonic())
+            return job.future
+
+    def _schedule_loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                while not self._stopped and (not self._ready or self._ready[0][0] > now):
+                    timeout = self._ready[0][0] - now if self._ready else CHAT_IDLE_TTL
+                    self._cond.wait(timeout)
+                    now = time.monotonic()
+                if self._stopped:
+                    return
+
+                _, _, chat_key = heapq.heappop(self._ready)
+                chat = self._chats[chat_key]
+                chat.scheduled = False
+                job = chat.jobs[0]
+
+                if job.limited:
+                    wait = max(chat.bucket.wait_time(now), self.global_bucket.wait_time(now))
+                    if wait > 0:
+                        self._schedule(chat_key, chat, now + wait)
+                        continue
+                    chat.bucket.consume()
+                    self.global_bucket.consume()
+
+                chat.jobs.popleft()
+                chat.busy = True
+                self.pending -= 1
+                self._executor.submit(self._execute, chat_key, chat, job)
+
+                if now - self._last_sweep > CHAT_IDLE_TTL:
+                    self._sweep(now)
+
+    def _call(self, job):
+        """Выполняет вызов TeleBot, замеряя его задержку"""
+        if self.metrics is None:
+            return getattr(self.bot, job.method)(*job.args, **job.kwargs)
+        started = time.monotonic()
+        status = 'error'
+        try:
+            result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+            status = 'ok'
+            return result
+        except ApiTelegramException as e:
+            status = e.error_code
+            raise
+        finally:
+            self.metrics.telegram_seconds.observe(time.monotonic() - started, job.method, status)
+
+    def _execute(self, chat_key, chat, job):
+        retry_after = 0
+        try:
+            result = self._call(job)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+            else:
+                self._finish(job, error=e)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+
+        with self._cond:
+            chat.busy = False
+            chat.last_active = time.monotonic()
+            if retry_after:
+                self.rate_limited += 1
+                if self._stopped:
+                    # После остановки повторять уже некому
+                    job.future.cancel()
+                else:
+                    # Повторяем тот же запрос первым, когда Telegram разрешит
+                    chat.jobs.appendleft(job)
+                    self.pending += 1
+                    self._schedule(chat_key, chat, time.monotonic() + retry_after)
+            elif chat.jobs:
+                self._schedule(chat_key, chat, time.monotonic())
+            if self._closing:
+                self._idle.notify_all()
+
+    def _execute_unordered(self, job):
+        try:
+            result = self._call(job)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+
+    def _finish(self, job, result=None, error=None):
+        latency = time.monotonic() - job.enqueued_at
+        if self.metrics is not None:
+            self.metrics.telegram_queue_seconds.observe(latency, job.method)
+        with self._cond:
+            self._latencies.append(latency)
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+        if error is None:
+            job.future.set_result(result)
+        else:
+            print(f"Ошибка запроса к Telegram ({job.method}): {error}")
+            job.future.set_exception(error)
+
+    def _sweep(self, now):
+        """Забывает простаивающие чаты, чьи корзины уже полностью восстановились"""
+        self._last_sweep = now
+        for chat_key in [key for key, chat in self._chats.items()
+                         if not chat.jobs and not chat.busy and not chat.scheduled
+                         and now - chat.last_active > CHAT_IDLE_TTL and chat.bucket.is_full(now)]:
+            del self._chats[chat_key]
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Останавливает очередь: новые запросы отклоняются, поставленные отправляются
+        в течение timeout секунд, оставшиеся отменяются. Дожидается потока расписания
+        и уже начатых запросов. Возвращает число отмененных запросов
+        """
+        with self._cond:
+            self._closing = True
+            if self._thread is None:
+                return 0
+            deadline = time.monotonic() + timeout
+            while self.pending or any(chat.busy for chat in self._chats.values()):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._idle.wait(left)
+
+            cancelled = 0
+            for chat in self._chats.values():
+                while chat.jobs:
+                    chat.jobs.popleft().future.cancel()
+                    cancelled += 1
+                chat.scheduled = False
+            self.pending = 0
+            self._ready.clear()
+            self._stopped = True
+            self._cond.notify_all()
+
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        if cancelled:
+            print(f"Очередь отправки остановлена, отменено запросов: {cancelled}")
+        return cancelled
+
+    def stats(self):
+        """Глубина очереди, счетчики и задержка отправки (p50/p95, секунды)"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queue_depth': self.pending,
+                'chats': len(self._chats),
+                'sent': self.sent,
+                'failed': self.failed,
+                'merged': self.merged,
+                'rate_limited': self.rate_limited,
+            }
+        if latencies:
+            stats['latency_p50'] = latencies[len(latencies) // 2]
+            stats['latency_p95'] = latencies[int(len(latencies) * 0.95)]
+        return stats
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit(chat_id, 'send_message', (chat_id, text), kwargs)
+
+    def edit_message_text(self, text=None, chat_id=None, message_id=None, **kwargs):
+        kwargs.update(text=text, chat_id=chat_id, message_id=message_id)
+        return self.submit(chat_id, 'edit_message_text', (), kwargs, merge_key=('edit', message_id))
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        return self.submit(chat_id, 'delete_message', (chat_id, message_id), kwargs, limited=False)
+
+    def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        # Ответы на нажатия кнопок не считаются сообщениями и идут вне лимитов
+        return self.submit(None, 'answer_callback_query', (callback_query_id, text, show_alert), kwargs, limited=False)
@@ -0,0 +1,179 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Сколько вакансий запрашивать у HH.ru за раз и сколько показывать на одной странице
+UPSTREAM_PAGE_SIZE = 50
+RESULTS_PAGE_SIZE = 10
+
+# HH.ru отдает не больше 2000 вакансий по одному запросу
+MAX_UPSTREAM_RESULTS = 2000
+
+# Сколько курсоров поиска хранить и как долго
+CURSOR_MAX_SIZE = 10000
+CURSOR_TTL = 60 * 60
+
+# Потоки для фоновой загрузки следующих страниц
+PREFETCH_WORKERS = 4
+
+
+class SearchCursor:
+    """
+    Курсор по результатам одного поиска. Сами вакансии не хранит:
+    страницы HH.ru берутся через fetch_page (из кэша результатов или из API)
+    """
+
+    __slots__ = ('profession', 'filters', 'found', 'upstream_pages', 'expires_at', 'stale', 'parts',
+                 'starts', 'shown_on', 'exhausted_at')
+
+    def __init__(self, profession, filters, found, upstream_pages, expires_at, stale=False, parts=None):
+        self.profession = profession
+        self.filters = filters
+        self.found = found
+        self.upstream_pages = upstream_pages
+        self.expires_at = expires_at
+        # Результаты взяты из истекшего кэша или из локального индекса, когда HH.ru недоступен
+        self.stale = stale
+        # Для объединенного поиска по нескольким запросам - сколько вакансий можно пролистать в каждом
+        self.parts = parts
+        # Где в ответах HH.ru начинается страница показа: {страница: (страница HH.ru, смещение)}.
+        # Дубли пропускаются, поэтому начало известно только у уже пролистанных страниц
+        self.starts = {0: (0, 0)}
+        # Кластер дублей -> (страница показа, ID вакансии): какая вакансия кластера показана и где
+        self.shown_on = {}
+        # Номер последней страницы, если вакансии закончились раньше оценки
+        self.exhausted_at = None
+
+    @property
+    def total(self):
+        """Сколько вакансий реально можно пролистать"""
+        if self.parts:
+            return sum(self.parts)
+        return min(self.found, self.upstream_pages * UPSTREAM_PAGE_SIZE, MAX_UPSTREAM_RESULTS)
+
+    @property
+    def page_count(self):
+        if self.exhausted_at is not None:
+            return self.exhausted_at + 1
+        return max(1, -(-self.total // RESULTS_PAGE_SIZE))
+
+    def upstream_page_size(self, upstream_page):
+        """Сколько вакансий в странице HH.ru (у объединенного поиска - сумма по запросам)"""
+        if not self.parts:
+            return UPSTREAM_PAGE_SIZE
+        start = upstream_page * UPSTREAM_PAGE_SIZE
+        return sum(min(UPSTREAM_PAGE_SIZE, max(0, part - start)) for part in self.parts)
+
+    def locate(self, page):
+        """Номер страницы HH.ru и смещение в ней для страницы показа"""
+        start = page * RESULTS_PAGE_SIZE
+        if not self.parts:
+            return start // UPSTREAM_PAGE_SIZE, start % UPSTREAM_PAGE_SIZE
+        upstream_page = 0
+        size = self.upstream_page_size(0)
+        while size and start >= size:
+            start -= size
+            upstream_page += 1
+            size = self.upstream_page_size(upstream_page)
+        return upstream_page, start
+
+    def start(self, page):
+        """Начало страницы показа: найденное при листании или оценка без учета дублей"""
+        return self.starts.get(page) or self.locate(page)
+
+
+class SearchCursors:
+    """Хранилище курсоров поиска с LRU-вытеснением и TTL, плюс фоновая предзагрузка"""
+
+    def __init__(self, fetch_page, max_size=CURSOR_MAX_SIZE, ttl=CURSOR_TTL, prefetch_workers=PREFETCH_WORKERS):
+        self.fetch_page = fetch_page
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cursors = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(prefetch_workers, thread_name_prefix='prefetch')
+
+    def create(self, profession, filters, first_page):
+        """Создает курсор по первой странице ответа HH.ru и возвращает его ID"""
+        cursor = SearchCursor(
+            profession,
+            filters,
+            first_page['found'],
+            first_page['pages'],
+            time.monotonic() + self.ttl,
+            first_page.get('stale', False),
+            first_page.get('parts')
+        )
+        with self._lock:
+            cursor_id = format(next(self._ids), 'x')
+            self._cursors[cursor_id] = cursor
+            while len(self._cursors) > self.max_size:
+                self._cursors.popitem(last=False)
+        return cursor_id
+
+    def get(self, cursor_id):
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+            if cursor is None:
+                return None
+            if cursor.expires_at < time.monotonic():
+                del self._cursors[cursor_id]
+                return None
+            self._cursors.move_to_end(cursor_id)
+            return cursor
+
+    def page_items(self, cursor, page):
+        """
+        Вакансии страницы показа page. Из кластера дублей (поле cluster) показывается
+        только первая встреченная вакансия, остальные пропускаются.
+        Возвращает (список, None) или (None, текст ошибки)
+        """
+        upstream_page, offset = cursor.start(page)
+        items = []
+        while len(items) < RESULTS_PAGE_SIZE:
+            data, error = self.fetch_page(cursor.profession, cursor.filters, upstream_page)
+            if error:
+                if items:
+                    # Остаток страницы догрузится при переходе на следующую
+                    cursor.starts[page + 1] = (upstream_page, 0)
+                    return items, None
+                return None, error
+            upstream_items = data['items']
+            while offset < len(upstream_items) and len(items) < RESULTS_PAGE_SIZE:
+                vacancy = upstream_items[offset]
+                offset += 1
+                first = (page, vacancy['id'])
+                if cursor.shown_on.setdefault(vacancy.get('cluster', vacancy['id']), first) == first:
+                    items.append(vacancy)
+            if offset < len(upstream_items):
+                break
+            # Страница HH.ru закончилась: продолжаем со следующей, если она есть
+            upstream_page += 1
+            offset = 0
+            if upstream_page >= cursor.upstream_pages or not upstream_items:
+                cursor.exhausted_at = page if items or page == 0 else page - 1
+                break
+        cursor.starts[page + 1] = (upstream_page, offset)
+
+        if not items:
+            return None, "Больше вакансий нет"
+        return items, None
+
+    def prefetch(self, cursor, page):
+        """Загружает в фоне страницу HH.ru, нужную для страницы показа page"""
+        if page >= cursor.page_count:
+            return
+        upstream_page, _ = cursor.start(page)
+        if page > 0 and cursor.start(page - 1)[0] == upstream_page:
+            # Эта страница HH.ru уже загружена вместе с текущей
+            return
+        self._executor.submit(self._prefetch, cursor, upstream_page)
+
+    def _prefetch(self, cursor, upstream_page):
+        try:
+            self.fetch_page(cursor.profession, cursor.filters, upstream_page)
+        except Exception as e:
+            print(f"Ошибка предзагрузки страницы: {e}")
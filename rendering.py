@@ -0,0 +1,289 @@
+"""
+Отрисовка вакансий в текст сообщений: MarkdownV2 и простой текст.
+Экранирование - цепочка str.replace только по встреченным спецсимволам,
+карточки - по заранее подготовленным шаблонам, сообщение собирается одним join
+"""
+import html
+import re
+from functools import lru_cache
+
+# Специальные символы MarkdownV2, включая сам обратный слеш
+MARKDOWN_V2_SPECIAL = '\\_*[]()~`>#+-=|{}.!'
+MARKDOWN_V2_ESCAPES = {char: '\\' + char for char in MARKDOWN_V2_SPECIAL}
+
+# Сколько экранированных значений полей, которые часто повторяются
+# (компании, города, зарплаты), держать в памяти
+ESCAPE_CACHE_SIZE = 4096
+
+# Символы валют HH.ru для отображения зарплаты
+CURRENCY_SYMBOLS = {
+    'RUR': '₽',
+    'USD': '$',
+    'EUR': '€',
+    'KZT': '₸',
+    'BYR': 'Br',
+}
+
+NO_SALARY = "не указана"
+NO_COMPANY = "Не указана"
+NO_CITY = "Не указан"
+
+# Шаблоны карточки вакансии. Поля MarkdownV2 подставляются уже экранированными
+VACANCY_CARD = (
+    "💼 *{name}*\n"
+    "🏢 {company}\n"
+    "💰 {salary}\n"
+    "📍 {city}\n"
+    "[Ссылка на вакансию ➡️]({url})"
+).format
+VACANCY_CARD_PLAIN = (
+    "💼 {name}\n"
+    "🏢 {company}\n"
+    "💰 {salary}\n"
+    "📍 {city}\n"
+    "🔗 {url}"
+).format
+VACANCY_LINK_PLAIN = "💼 {name}\n🔗 {url}".format
+
+RESULTS_HEADER = "✅ Найдено *{found}* вакансий по запросу *{profession}*".format
+RESULTS_HEADER_PLAIN = "✅ Найдено {found} вакансий по запросу '{profession}'".format
+PAGE_SUFFIX = " \\(страница {page} из {pages}\\):\n\n".format
+PAGE_SUFFIX_PLAIN = " (страница {page} из {pages}):\n\n".format
+# Без спецсимволов MarkdownV2, подходит для обоих вариантов разметки
+STALE_NOTICE = "⚠️ Показаны сохраненные результаты, они могут быть устаревшими\n\n"
+SUBSCRIPTION_HEADER = "🔔 Новые вакансии по подписке *{profession}*:\n\n".format
+SUBSCRIPTION_HEADER_PLAIN = "🔔 Новые вакансии по подписке '{profession}':\n\n".format
+# Пока объединенный поиск получил ответы не на все запросы
+SEARCH_PENDING = "⏳ Загружаю остальные результаты…"
+
+# Ссылка в разметке MarkdownV2: внутри (...) не должно быть ), \ и пробелов
+_LINK_URL = re.compile(r'https?://[^\s()\\]+')
+
+
+# Описание вакансии в карточке подробностей обрезается, чтобы сообщение уложилось в лимит Telegram
+DETAILS_DESCRIPTION_LIMIT = 2500
+ARCHIVED_NOTICE = "⚠️ Вакансия в архиве\n\n"
+DETAILS_LINE = "{icon} {label}: {value}\n".format
+
+# Описание вакансии HH.ru приходит в HTML: пункты списков и абзацы превращаются в строки
+_HTML_LIST_ITEM = re.compile(r'<li[^>]*>', re.IGNORECASE)
+_HTML_LINE_BREAK = re.compile(r'<br\s*/?>|</(?:p|ul|ol|h\d|div)>', re.IGNORECASE)
+_HTML_TAG = re.compile(r'<[^>]+>')
+_BLANK_LINES = re.compile(r'\n\s*\n\s*(?:\n\s*)+')
+
+
+def escape_markdown_v2(text):
+    """
+    Экранирование всех специальных символов MarkdownV2. Обратный слеш идет первым
+    в MARKDOWN_V2_SPECIAL, чтобы не экранировать добавленные слеши повторно
+    """
+    if not text:
+        return ""
+    text = str(text)
+    for char in MARKDOWN_V2_SPECIAL:
+        if char in text:
+            text = text.replace(char, MARKDOWN_V2_ESCAPES[char])
+    return text
+
+
+# Для полей с повторяющимися значениями экранирование берется из кэша
+escape_field = lru_cache(maxsize=ESCAPE_CACHE_SIZE)(escape_markdown_v2)
+
+
+def _salary_amount(salary_from, salary_to):
+    if salary_from and salary_to:
+        return f"от {salary_from} до {salary_to}"
+    if salary_from:
+        return f"от {salary_from}"
+    if salary_to:
+        return f"до {salary_to}"
+    return None
+
+
+def format_salary(salary_data, salary_base=None):
+    """
+    Форматирует информацию о зарплате для отображения. Для зарплаты не в рублях
+    salary_base (вилка, приведенная к рублям) добавляется в скобках
+    """
+    if not salary_data:
+        return NO_SALARY
+
+    amount = _salary_amount(salary_data.get('from'), salary_data.get('to'))
+    if amount is None:
+        return NO_SALARY
+
+    currency = salary_data.get('currency') or 'RUR'
+    text = f"{amount} {CURRENCY_SYMBOLS.get(currency, currency)}"
+    if salary_base and currency != 'RUR':
+        base_amount = _salary_amount(salary_base['from'], salary_base['to'])
+        if base_amount:
+            text = f"{text} (≈ {base_amount} ₽)"
+    return text
+
+
+def vacancy_fields(vacancy):
+    """Поля карточки вакансии без разметки: (название, компания, город, зарплата, ссылка)"""
+    return (
+        vacancy.get('name', ''),
+        vacancy.get('employer', {}).get('name', NO_COMPANY),
+        vacancy.get('area', {}).get('name', NO_CITY),
+        format_salary(vacancy.get('salary'), vacancy.get('salary_base')),
+        vacancy.get('alternate_url', ''),
+    )
+
+
+def format_vacancy(vacancy):
+    """Карточка вакансии в MarkdownV2"""
+    name, company, city, salary, url = vacancy_fields(vacancy)
+    return VACANCY_CARD(
+        name=escape_markdown_v2(name),
+        company=escape_field(company),
+        salary=escape_field(salary),
+        city=escape_field(city),
+        url=url,
+    )
+
+
+def format_vacancy_plain(vacancy):
+    """Карточка вакансии без разметки"""
+    name, company, city, salary, url = vacancy_fields(vacancy)
+    return VACANCY_CARD_PLAIN(name=name, company=company, salary=salary, city=city, url=url)
+
+
+def _plain_card(vacancy):
+    try:
+        return format_vacancy_plain(vacancy)
+    except (AttributeError, TypeError, ValueError):
+        # Поля карточки не разобрать - остаются название и ссылка
+        return VACANCY_LINK_PLAIN(name=vacancy.get('name', ''), url=vacancy.get('alternate_url', ''))
+
+
+def format_result_card(vacancy):
+    """
+    Карточка вакансии для сообщения в MarkdownV2, проверенная отдельно: если поле
+    не укладывается в разметку (ссылка со спецсимволами, неожиданный тип значения),
+    только эта карточка выводится простым текстом, экранированным целиком
+    """
+    try:
+        if not _LINK_URL.fullmatch(vacancy.get('alternate_url', '')):
+            raise ValueError("ссылка не подходит для разметки")
+        return format_vacancy(vacancy)
+    except (AttributeError, TypeError, ValueError):
+        return escape_markdown_v2(_plain_card(vacancy))
+
+
+def render_results_page(profession, found, page, page_count, first, vacancies, stale=False, pending=False):
+    """
+    Страница результатов поиска в MarkdownV2; first - номер первой вакансии на странице,
+    stale - предупредить, что результаты могут быть устаревшими,
+    pending - отметить, что результаты еще догружаются
+    """
+    parts = [STALE_NOTICE] if stale else []
+    parts.append(RESULTS_HEADER(found=found, profession=escape_markdown_v2(profession)))
+    parts.append(PAGE_SUFFIX(page=page + 1, pages=page_count) if page_count > 1 else ":\n\n")
+    for i, vacancy in enumerate(vacancies, first):
+        parts.append(f"{i}\\. ")
+        parts.append(format_result_card(vacancy))
+        parts.append("\n\n")
+    if pending:
+        parts.append(escape_markdown_v2(SEARCH_PENDING))
+    return ''.join(parts)
+
+
+def render_results_page_plain(profession, found, page, page_count, first, vacancies, stale=False, pending=False):
+    """Страница результатов поиска без разметки (запасной вариант)"""
+    parts = [STALE_NOTICE] if stale else []
+    parts.append(RESULTS_HEADER_PLAIN(found=found, profession=profession))
+    parts.append(PAGE_SUFFIX_PLAIN(page=page + 1, pages=page_count) if page_count > 1 else ":\n\n")
+    for i, vacancy in enumerate(vacancies, first):
+        parts.append(f"{i}. ")
+        parts.append(_plain_card(vacancy))
+        parts.append("\n\n")
+    if pending:
+        parts.append(SEARCH_PENDING)
+    return ''.join(parts)
+
+
+def html_to_text(text):
+    """Текст описания вакансии без HTML-разметки"""
+    text = _HTML_LIST_ITEM.sub('\n• ', text or '')
+    text = _HTML_LINE_BREAK.sub('\n', text)
+    text = html.unescape(_HTML_TAG.sub('', text))
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+
+def _truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0] + '…'
+
+
+def details_fields(vacancy):
+    """
+    Поля карточки подробностей без разметки: (название, строки с условиями, навыки, описание, ссылка)
+    """
+    name, company, city, salary, url = vacancy_fields(vacancy)
+    address = (vacancy.get('address') or {}).get('raw')
+    lines = [
+        ("🏢", "Компания", company),
+        ("💰", "Зарплата", salary),
+        ("📍", "Адрес" if address else "Город", address or city),
+    ]
+    for icon, label, field in (("🎓", "Опыт", 'experience'), ("🕒", "График", 'schedule'),
+                               ("📄", "Занятость", 'employment')):
+        value = (vacancy.get(field) or {}).get('name')
+        if value:
+            lines.append((icon, label, value))
+    skills = ', '.join(skill['name'] for skill in vacancy.get('key_skills') or [] if skill.get('name'))
+    description = _truncate(html_to_text(vacancy.get('description')), DETAILS_DESCRIPTION_LIMIT)
+    return name, lines, skills, description, url
+
+
+def render_vacancy_details(vacancy):
+    """Подробная карточка вакансии в MarkdownV2"""
+    name, lines, skills, description, url = details_fields(vacancy)
+    parts = [ARCHIVED_NOTICE] if vacancy.get('archived') else []
+    parts.append(f"💼 *{escape_markdown_v2(name)}*\n\n")
+    for icon, label, value in lines:
+        parts.append(DETAILS_LINE(icon=icon, label=label, value=escape_field(value)))
+    if skills:
+        parts.append(f"\n🛠 *Навыки:* {escape_markdown_v2(skills)}\n")
+    if description:
+        parts.append(f"\n{escape_markdown_v2(description)}\n")
+    parts.append(f"\n[Открыть на HH\\.ru ➡️]({url})")
+    return ''.join(parts)
+
+
+def render_vacancy_details_plain(vacancy):
+    """Подробная карточка вакансии без разметки"""
+    name, lines, skills, description, url = details_fields(vacancy)
+    parts = [ARCHIVED_NOTICE] if vacancy.get('archived') else []
+    parts.append(f"💼 {name}\n\n")
+    for icon, label, value in lines:
+        parts.append(DETAILS_LINE(icon=icon, label=label, value=value))
+    if skills:
+        parts.append(f"\n🛠 Навыки: {skills}\n")
+    if description:
+        parts.append(f"\n{description}\n")
+    parts.append(f"\n🔗 {url}")
+    return ''.join(parts)
+
+
+def render_subscription(profession, vacancies, limit):
+    """Уведомление о новых вакансиях по подписке в MarkdownV2, не больше limit карточек"""
+    parts = [SUBSCRIPTION_HEADER(profession=escape_markdown_v2(profession))]
+    for vacancy in vacancies[:limit]:
+        parts.append(format_result_card(vacancy))
+        parts.append("\n\n")
+    if len(vacancies) > limit:
+        parts.append(escape_markdown_v2(f"...и еще {len(vacancies) - limit}"))
+    return ''.join(parts)
+
+
+def render_subscription_plain(profession, vacancies, limit):
+    """Уведомление о новых вакансиях по подписке без разметки"""
+    parts = [SUBSCRIPTION_HEADER_PLAIN(profession=profession)]
+    for vacancy in vacancies[:limit]:
+        parts.append(VACANCY_LINK_PLAIN(name=vacancy.get('name', ''), url=vacancy.get('alternate_url', '')))
+        parts.append("\n\n")
+    return ''.join(parts)
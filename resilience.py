@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+
+import requests
+
+# Предохранитель: сколько ошибок подряд его размыкают и через сколько секунд пробовать снова
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+# Адаптивный таймаут: запас над 99-м перцентилем задержки и допустимые границы
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+TIMEOUT_MULTIPLIER = 3
+MIN_TIMEOUT = 2
+MAX_TIMEOUT = 10
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Запрос не выполнялся: предохранитель разомкнут после серии ошибок"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд запросы сразу отклоняются
+    на reset_timeout секунд, затем пропускается один пробный запрос.
+    Успех пробного запроса замыкает предохранитель, ошибка снова размыкает
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли выполнить запрос сейчас"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"HH.ru недоступен, запросы приостановлены на {self.reset_timeout} с")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def retry_after(self):
+        """Через сколько секунд будет пробный запрос (0 - запросы разрешены)"""
+        if self.state == self.CLOSED:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class LatencyTracker:
+    """
+    Скользящее окно задержек запросов. Таймаут - 99-й перцентиль с запасом,
+    в пределах [min_timeout, max_timeout]; пока данных мало - max_timeout.
+    Запрос, не уложившийся в таймаут, учитывается замером на верхней границе
+    """
+
+    def __init__(self, window=LATENCY_WINDOW, multiplier=TIMEOUT_MULTIPLIER,
+                 min_timeout=MIN_TIMEOUT, max_timeout=MAX_TIMEOUT):
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._samples = deque(maxlen=window)
+        self._timeout = max_timeout
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            if len(self._samples) >= LATENCY_MIN_SAMPLES:
+                ordered = sorted(self._samples)
+                p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+                self._timeout = min(self.max_timeout, max(self.min_timeout, p99 * self.multiplier))
+
+    def observe_timeout(self):
+        """
+        Запрос не уложился в таймаут: таймаут сразу удваивается, а в окно попадает замер
+        на верхней границе. Иначе при замедлении HH.ru таймаут не смог бы вырасти
+        """
+        with self._lock:
+            self._samples.append(self.max_timeout)
+            self._timeout = min(self.max_timeout, self._timeout * 2)
+
+    def timeout(self):
+        return self._timeout
+
+    def percentiles(self):
+        """p50, p95 и p99 задержки (секунды) или None, если замеров нет"""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return {
+            'p50': ordered[len(ordered) // 2],
+            'p95': ordered[int(len(ordered) * 0.95)],
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        }
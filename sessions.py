@@ -0,0 +1,231 @@
+import abc
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from models import Session
+
+# Время жизни брошенной сессии и максимальное число сессий в памяти
+SESSION_TTL = 24 * 60 * 60
+SESSION_MAX_SIZE = 100000
+
+# Как часто (в операциях записи) удалять просроченные сессии из SQLite
+SQLITE_PURGE_EVERY = 1000
+
+
+def serialize_state(state):
+    """Компактное представление состояния для хранения"""
+    return state.to_bytes()
+
+
+def deserialize_state(data):
+    return Session.from_bytes(data)
+
+
+class SessionStore(abc.ABC):
+    """
+    Хранилище сессий пользователей по chat_id.
+    get() возвращает копию состояния: после изменения его нужно сохранить через save()
+    """
+
+    @abc.abstractmethod
+    def get(self, chat_id):
+        """Копия состояния чата или None, если сессии нет или она истекла"""
+
+    @abc.abstractmethod
+    def save(self, chat_id, state):
+        """Сохраняет состояние чата"""
+
+    @abc.abstractmethod
+    def delete(self, chat_id):
+        """Удаляет сессию чата"""
+
+    def get_step(self, chat_id):
+        """Текущий шаг диалога или None, если сессии нет"""
+        state = self.get(chat_id)
+        return state.step if state is not None else None
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    @abc.abstractmethod
+    def __len__(self):
+        """Число хранимых сессий"""
+
+    def export(self):
+        """Сессии для снимка состояния: (chat_id, время истечения, данные); долговечным хранилищам не нужен"""
+        return []
+
+    def restore_from(self, snapshot):
+        """Подключает снимок, из которого сессии восстанавливаются при первом обращении"""
+
+
+class MemorySessionStore(SessionStore):
+    """Сессии в памяти процесса с TTL и ограничением количества (старые вытесняются)"""
+
+    def __init__(self, ttl=SESSION_TTL, max_size=SESSION_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # Чаты, сессии которых уже взяты из снимка или изменены после запуска
+        self._detached = set()
+
+    def restore_from(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            self._detached = set()
+
+    def _restore(self, chat_id):
+        """Переносит сессию из снимка в память (вызывается под блокировкой)"""
+        if self._snapshot is None or chat_id in self._detached:
+            return None
+        self._detached.add(chat_id)
+        found = self._snapshot.session(chat_id)
+        if found is None:
+            return None
+        expires_at, data = found
+        entry = (time.monotonic() + min(expires_at - time.time(), self.ttl), data)
+        self._sessions[chat_id] = entry
+        return entry
+
+    def get(self, chat_id):
+        with self._lock:
+            entry = self._sessions.get(chat_id)
+            if entry is None:
+                entry = self._restore(chat_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._sessions[chat_id]
+                return None
+        return deserialize_state(data)
+
+    def get_step(self, chat_id):
+        entry = self._sessions.get(chat_id)
+        if entry is None and self._snapshot is not None:
+            with self._lock:
+                entry = self._sessions.get(chat_id) or self._restore(chat_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return Session.peek_step(entry[1])
+
+    def save(self, chat_id, state):
+        data = serialize_state(state)
+        with self._lock:
+            self._detached.add(chat_id)
+            self._sessions.pop(chat_id, None)
+            self._sessions[chat_id] = (time.monotonic() + self.ttl, data)
+            # Сессии упорядочены по времени записи, поэтому первые - самые старые
+            now = time.monotonic()
+            while self._sessions:
+                oldest_id, (expires_at, _) = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_size and expires_at >= now:
+                    break
+                del self._sessions[oldest_id]
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._detached.add(chat_id)
+            self._sessions.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def export(self):
+        now = time.monotonic()
+        wall_now = time.time()
+        with self._lock:
+            entries = list(self._sessions.items())
+            # Сессии из снимка, к которым еще не обращались, переносятся в следующий снимок
+            restored = self._snapshot.sessions() if self._snapshot is not None else []
+            detached = set(self._detached)
+        sessions = [
+            (chat_id, wall_now + expires_at - now, data)
+            for chat_id, (expires_at, data) in entries
+            if expires_at >= now
+        ]
+        sessions.extend(entry for entry in restored if entry[0] not in detached)
+        return sessions
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Сессии в файле SQLite: переживают перезапуск и доступны
+    нескольким процессам бота одновременно
+    """
+
+    def __init__(self, path, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, chat_id):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE chat_id = ? AND expires_at >= ?',
+            (chat_id, time.time())
+        ).fetchone()
+        return deserialize_state(row[0]) if row else None
+
+    def get_step(self, chat_id):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE chat_id = ? AND expires_at >= ?',
+            (chat_id, time.time())
+        ).fetchone()
+        return Session.peek_step(row[0]) if row else None
+
+    def save(self, chat_id, state):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (chat_id, data, expires_at) VALUES (?, ?, ?)',
+                (chat_id, serialize_state(state), time.time() + self.ttl)
+            )
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, chat_id):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+
+    def purge_expired(self):
+        """Удаляет просроченные сессии"""
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE expires_at >= ?', (time.time(),)
+        ).fetchone()[0]
+
+
+def create_session_store(backend, path=None, ttl=SESSION_TTL, max_size=SESSION_MAX_SIZE):
+    """Создает хранилище сессий по названию: memory или sqlite"""
+    if backend == 'memory':
+        return MemorySessionStore(ttl=ttl, max_size=max_size)
+    if backend == 'sqlite':
+        return SqliteSessionStore(path, ttl=ttl)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
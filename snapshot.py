@@ -0,0 +1,228 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+
+# Файл снимка состояния для быстрого перезапуска
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot.bin')
+
+# Как часто сохранять снимок, секунд
+SNAPSHOT_INTERVAL = 5 * 60
+
+# Сколько самых свежих записей кэша результатов попадает в снимок
+SNAPSHOT_CACHE_ENTRIES = 500
+
+# Заголовок: сигнатура, время создания, число разделов; затем таблица разделов
+_MAGIC = b'JFSNAP01'
+_HEADER = struct.Struct('<8sdI')
+_SECTION = struct.Struct('<16sQQ')
+
+# Раздел сессий: число записей, затем отсортированный по chat_id индекс и данные сессий.
+# Запись индекса: chat_id, время истечения (по часам системы), смещение и длина данных
+_COUNT = struct.Struct('<I')
+_SESSION = struct.Struct('<qdII')
+
+# Открытые снимки: перед заменой файла они переходят на копию в памяти
+_open_snapshots = weakref.WeakSet()
+
+
+def _as_tuple(value):
+    # Ключи кэша - вложенные кортежи, в JSON они становятся списками
+    if isinstance(value, list):
+        return tuple(_as_tuple(item) for item in value)
+    return value
+
+
+def _pack_sessions(sessions):
+    sessions = sorted(sessions)
+    index = [_COUNT.pack(len(sessions))]
+    blobs = []
+    offset = _COUNT.size + _SESSION.size * len(sessions)
+    for chat_id, expires_at, data in sessions:
+        index.append(_SESSION.pack(chat_id, expires_at, offset, len(data)))
+        blobs.append(data)
+        offset += len(data)
+    return b''.join(index + blobs)
+
+
+def _pack_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_snapshot(path, sessions=(), areas=None, cache=()):
+    """
+    Записывает снимок: sessions - (chat_id, время истечения, данные сессии),
+    areas - {'saved_at', 'rows', 'usage'} справочника регионов,
+    cache - (ключ, значение, время истечения) записей кэша результатов.
+    Файл заменяется атомарно: открытые снимки продолжают читать старую копию
+    """
+    sections = [(b'sessions', _pack_sessions(sessions)), (b'cache', _pack_json(list(cache)))]
+    if areas is not None:
+        sections.append((b'areas', _pack_json(areas)))
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, data in sections:
+        table.append(_SECTION.pack(name, offset, len(data)))
+        offset += len(data)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, time.time(), len(sections)))
+        f.writelines(table)
+        f.writelines(data for _, data in sections)
+    # В Windows файл, отображенный в память, заменить нельзя
+    for snapshot in list(_open_snapshots):
+        if os.path.abspath(snapshot.path) == os.path.abspath(path):
+            snapshot.detach()
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """
+    Снимок, отображенный в память: при открытии читается только таблица разделов,
+    сессии ищутся по одной двоичным поиском по индексу, разделы JSON разбираются
+    при первом обращении. Перед записью нового снимка на его место файл
+    закрывается, а данные копируются в память (detach)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.created_at, count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError("неизвестный формат снимка")
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(self._map, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b'\0')] = (offset, length)
+        self._session_count = self._section_count(b'sessions')
+        _open_snapshots.add(self)
+
+    @classmethod
+    def open(cls, path):
+        """Открывает снимок; None, если его нет или он поврежден"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Не удалось прочитать снимок состояния: {e}")
+            return None
+
+    def _section_count(self, name):
+        section = self._sections.get(name)
+        if section is None or section[1] < _COUNT.size:
+            return 0
+        return _COUNT.unpack_from(self._map, section[0])[0]
+
+    def _json(self, name):
+        section = self._sections.get(name)
+        if section is None:
+            return None
+        offset, length = section
+        with self._lock:
+            data = self._map[offset:offset + length]
+        return json.loads(data.decode('utf-8'))
+
+    def session(self, chat_id):
+        """(время истечения, данные) сессии из снимка или None, если ее нет или она истекла"""
+        if not self._session_count:
+            return None
+        base = self._sections[b'sessions'][0]
+        lo, hi = 0, self._session_count
+        with self._lock:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                entry_chat_id, expires_at, offset, length = _SESSION.unpack_from(
+                    self._map, base + _COUNT.size + mid * _SESSION.size
+                )
+                if entry_chat_id < chat_id:
+                    lo = mid + 1
+                elif entry_chat_id > chat_id:
+                    hi = mid
+                else:
+                    if expires_at < time.time():
+                        return None
+                    return expires_at, self._map[base + offset:base + offset + length]
+        return None
+
+    def sessions(self):
+        """Все неистекшие сессии снимка: список (chat_id, время истечения, данные)"""
+        if not self._session_count:
+            return []
+        base = self._sections[b'sessions'][0]
+        now = time.time()
+        result = []
+        with self._lock:
+            for chat_id, expires_at, offset, length in _SESSION.iter_unpack(
+                    self._map[base + _COUNT.size:base + _COUNT.size + self._session_count * _SESSION.size]):
+                if expires_at >= now:
+                    result.append((chat_id, expires_at, self._map[base + offset:base + offset + length]))
+        return result
+
+    def areas(self):
+        """Справочник регионов: {'saved_at', 'rows', 'usage'} или None"""
+        return self._json(b'areas')
+
+    def cache_entries(self):
+        """Записи кэша результатов: список (ключ, значение, время истечения)"""
+        # Значения кэша - пары (результат, ошибка)
+        return [
+            (_as_tuple(key), tuple(value) if isinstance(value, list) else value, expires_at)
+            for key, value, expires_at in self._json(b'cache') or []
+        ]
+
+    def detach(self):
+        """Копирует снимок в память и закрывает файл: его можно заменить или удалить"""
+        with self._lock:
+            if isinstance(self._map, mmap.mmap):
+                data = self._map[:]
+                self._map.close()
+                self._map = data
+
+    def close(self):
+        _open_snapshots.discard(self)
+        with self._lock:
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+
+
+class Snapshotter:
+    """Периодическое сохранение снимка в фоне: collect() возвращает аргументы write_snapshot"""
+
+    def __init__(self, collect, path=SNAPSHOT_FILE, interval=SNAPSHOT_INTERVAL):
+        self.collect = collect
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def save(self):
+        """Сохраняет снимок сейчас; возвращает время записи в секундах"""
+        started = time.perf_counter()
+        with self._lock:
+            write_snapshot(self.path, **self.collect())
+        return time.perf_counter() - started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Ошибка сохранения снимка состояния: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# Как часто опрашивать HH.ru по каждому уникальному запросу (секунды)
+POLL_INTERVAL = 10 * 60
+
+# Насколько раньше последней проверки запрашивать вакансии: публикация
+# на HH.ru появляется в выдаче с задержкой, а дубли отсекает фильтр Блума
+POLL_OVERLAP = 15 * 60
+
+# Размер фильтра просмотренных вакансий. Подписка хранит два фильтра и помнит только
+# вакансии, которые еще могут попасть в окно опроса, поэтому фильтр не переполняется
+BLOOM_BITS = 32768
+BLOOM_HASHES = 4
+
+MAX_SUBSCRIPTIONS_PER_CHAT = 10
+
+
+class BloomFilter:
+    """Компактное множество просмотренных ID вакансий (возможны редкие ложные срабатывания)"""
+
+    __slots__ = ('bits', 'size', 'hashes')
+
+    def __init__(self, data=None, size=BLOOM_BITS, hashes=BLOOM_HASHES):
+        # Размер сохраненного фильтра определяется по его данным (фильтры прежнего размера)
+        self.size = len(data) * 8 if data else size
+        self.hashes = hashes
+        self.bits = bytearray(data) if data else bytearray(size // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=4 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+
+class SeenSet:
+    """
+    Просмотренные вакансии подписки: текущий и предыдущий фильтры Блума.
+    Когда начало текущего фильтра выходит из окна опроса, все вакансии предыдущего
+    опубликованы раньше окна и больше не придут - он отбрасывается, текущий
+    становится предыдущим, а новые ID пишутся в пустой
+    """
+
+    __slots__ = ('current', 'previous', 'since')
+
+    def __init__(self, current=None, previous=None, since=None):
+        self.current = BloomFilter(current)
+        self.previous = BloomFilter(previous) if previous else None
+        # С какого времени текущий фильтр собирает ID
+        self.since = time.time() if since is None else since
+
+    def add(self, value):
+        self.current.add(value)
+
+    def __contains__(self, value):
+        return value in self.current or (self.previous is not None and value in self.previous)
+
+    def rotate(self, window_start, now):
+        """Забывает вакансии, которые уже не могут попасть в выдачу, начиная с window_start"""
+        if self.since < window_start:
+            self.previous = self.current
+            self.current = BloomFilter()
+            self.since = now
+
+
+class SubscriptionStore:
+    """Подписки пользователей на новые вакансии в SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS subscriptions ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'chat_id INTEGER NOT NULL, '
+            'profession TEXT NOT NULL, '
+            'filters TEXT NOT NULL, '
+            'query_key TEXT NOT NULL, '
+            'checked_at REAL NOT NULL, '
+            'seen BLOB NOT NULL, '
+            'seen_previous BLOB, '
+            'seen_since REAL)'
+        )
+        self._migrate(conn)
+        conn.execute('CREATE INDEX IF NOT EXISTS subscriptions_query_key ON subscriptions (query_key)')
+        conn.execute('CREATE INDEX IF NOT EXISTS subscriptions_chat_id ON subscriptions (chat_id)')
+        conn.commit()
+
+    @staticmethod
+    def _migrate(conn):
+        """Добавляет в подписки прежней версии второй фильтр просмотренных"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(subscriptions)')}
+        if 'seen_since' in columns:
+            return
+        conn.execute('ALTER TABLE subscriptions ADD COLUMN seen_previous BLOB')
+        conn.execute('ALTER TABLE subscriptions ADD COLUMN seen_since REAL')
+        conn.execute('UPDATE subscriptions SET seen_since = checked_at')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def add(self, chat_id, profession, filters, query_key, seen_ids=()):
+        """
+        Создает подписку. Уже показанные вакансии seen_ids сразу отмечаются просмотренными.
+        Возвращает ID подписки или None, если такая подписка уже есть или превышен лимит
+        """
+        conn = self._connection()
+        with conn:
+            rows = conn.execute('SELECT query_key FROM subscriptions WHERE chat_id = ?', (chat_id,)).fetchall()
+            if len(rows) >= MAX_SUBSCRIPTIONS_PER_CHAT or any(row[0] == query_key for row in rows):
+                return None
+            now = time.time()
+            seen = BloomFilter()
+            for vacancy_id in seen_ids:
+                seen.add(vacancy_id)
+            cursor = conn.execute(
+                'INSERT INTO subscriptions (chat_id, profession, filters, query_key, checked_at, seen, seen_since) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (chat_id, profession, json.dumps(filters, ensure_ascii=False), query_key, now, seen.to_bytes(), now)
+            )
+            return cursor.lastrowid
+
+    def remove(self, chat_id, subscription_id):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute('DELETE FROM subscriptions WHERE id = ? AND chat_id = ?', (subscription_id, chat_id))
+            return cursor.rowcount > 0
+
+    def list_for_chat(self, chat_id):
+        """Подписки чата: список (id, профессия, фильтры)"""
+        rows = self._connection().execute(
+            'SELECT id, profession, filters FROM subscriptions WHERE chat_id = ? ORDER BY id', (chat_id,)
+        ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def due_queries(self, checked_before):
+        """Уникальные запросы, подписки на которые давно не проверялись"""
+        return [row[0] for row in self._connection().execute(
+            'SELECT DISTINCT query_key FROM subscriptions WHERE checked_at < ?', (checked_before,)
+        )]
+
+    def for_query(self, query_key):
+        """Подписки на один запрос: список (id, chat_id, профессия, фильтры, время проверки, SeenSet)"""
+        rows = self._connection().execute(
+            'SELECT id, chat_id, profession, filters, checked_at, seen, seen_previous, seen_since '
+            'FROM subscriptions WHERE query_key = ?',
+            (query_key,)
+        ).fetchall()
+        return [
+            (row[0], row[1], row[2], json.loads(row[3]), row[4], SeenSet(row[5], row[6], row[7]))
+            for row in rows
+        ]
+
+    def mark_checked(self, updates, checked_at):
+        """Сохраняет время проверки и множество просмотренных для списка (id, SeenSet)"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'UPDATE subscriptions SET checked_at = ?, seen = ?, seen_previous = ?, seen_since = ? WHERE id = ?',
+                [
+                    (checked_at, seen.current.to_bytes(), seen.previous.to_bytes() if seen.previous else None,
+                     seen.since, subscription_id)
+                    for subscription_id, seen in updates
+                ]
+            )
+
+
+class SubscriptionScheduler:
+    """
+    Фоновый опрос HH.ru по подпискам. Одинаковые запросы разных пользователей
+    объединяются по каноничному ключу: один запрос к HH.ru на уникальный запрос,
+    только вакансии, опубликованные после последней проверки
+    """
+
+    def __init__(self, store, fetch_new, notify, interval=POLL_INTERVAL):
+        # fetch_new(profession, filters, date_from) -> (список вакансий, ошибка)
+        self.store = store
+        self.fetch_new = fetch_new
+        # notify(chat_id, profession, вакансии) - отправка пользователю
+        self.notify = notify
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='subscriptions', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(min(60, self.interval)):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Ошибка опроса подписок: {e}")
+
+    def poll_once(self):
+        """Проверяет все запросы, которые пора обновить"""
+        now = time.time()
+        for query_key in self.store.due_queries(now - self.interval):
+            if self._stop.is_set():
+                return
+            self.poll_query(query_key, now)
+
+    def poll_query(self, query_key, now):
+        subscriptions = self.store.for_query(query_key)
+        if not subscriptions:
+            return
+
+        _, _, profession, filters, _, _ = subscriptions[0]
+        oldest_check = min(subscription[4] for subscription in subscriptions)
+        window_start = oldest_check - POLL_OVERLAP
+        date_from = datetime.fromtimestamp(window_start, tz=timezone.utc)
+
+        vacancies, error = self.fetch_new(profession, filters, date_from.strftime('%Y-%m-%dT%H:%M:%S%z'))
+        if error:
+            print(f"Ошибка опроса подписки '{profession}': {error}")
+            return
+
+        updates = []
+        for subscription_id, chat_id, sub_profession, _, _, seen in subscriptions:
+            # Окно общее для всех подписок запроса, поэтому и забывание - по его началу
+            seen.rotate(window_start, now)
+            # Перепубликация уже присланной вакансии (тот же кластер дублей) - тоже не новая
+            fresh = []
+            for vacancy in vacancies or []:
+                cluster = vacancy.get('cluster', vacancy['id'])
+                if vacancy['id'] in seen or cluster in seen:
+                    continue
+                seen.add(vacancy['id'])
+                seen.add(cluster)
+                fresh.append(vacancy)
+            if fresh:
+                try:
+                    self.notify(chat_id, sub_profession, fresh)
+                except Exception as e:
+                    print(f"Ошибка отправки уведомления: {e}")
+            updates.append((subscription_id, seen))
+
+        self.store.mark_checked(updates, now)
@@ -0,0 +1,25 @@
+import threading
+import time
+
+from areas import AreaDirectory
+
+
+def test_concurrent_first_callers_download_once(tmp_path):
+    calls = []
+
+    def fetch_tree():
+        calls.append(1)
+        time.sleep(0.2)
+        return [{'id': '113', 'name': 'Россия', 'areas': [{'id': '1', 'name': 'Москва', 'areas': []}]}]
+
+    directory = AreaDirectory(fetch_tree, path=str(tmp_path / 'areas.json.gz'))
+    found = []
+    threads = [threading.Thread(target=lambda: found.append(directory.find_id('москва'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert found == ['1'] * 8
+    assert directory.descendants('113') == ['113', '1']
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from currency import CurrencyRates
+
+
+def _dictionaries_fetcher(calls, fail=False):
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        if fail:
+            raise OSError("HH.ru недоступен")
+        return {'currency': [{'code': 'USD', 'rate': 0.01}, {'code': 'RUR', 'rate': 1}]}
+    return fetch
+
+
+def _run_concurrently(target, count=8):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_first_callers_download_once(tmp_path):
+    calls = []
+    rates = CurrencyRates(_dictionaries_fetcher(calls), path=str(tmp_path / 'rates.json'))
+    pages = []
+    _run_concurrently(lambda: pages.append(rates.normalize_page([{'salary': {'from': 1000, 'currency': 'USD'}}])))
+
+    assert len(calls) == 1
+    assert all(page[0]['salary_base'] == {'from': 100000, 'to': None} for page in pages)
+
+
+def test_concurrent_first_callers_share_failure(tmp_path):
+    calls = []
+    rates = CurrencyRates(_dictionaries_fetcher(calls, fail=True), path=str(tmp_path / 'rates.json'))
+    _run_concurrently(rates.ensure_loaded)
+
+    assert len(calls) == 1
+    assert not rates.factors
@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from outbox import Outbox
+
+
+class _SlowBot:
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.delay)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_stop_drains_pending_sends():
+    bot = _SlowBot(0.01)
+    outbox = Outbox(bot)
+    futures = [outbox.send_message(chat_id, 'привет') for chat_id in range(20)]
+
+    assert outbox.stop() == 0
+    assert all(future.result(0) == 'привет' for future in futures)
+    assert not outbox._thread.is_alive()
+    assert not any(thread.name.startswith('outbox') for thread in threading.enumerate())
+
+
+def test_stop_cancels_what_did_not_fit():
+    bot = _SlowBot(0.2)
+    outbox = Outbox(bot)
+    # Лимит чата пропускает сразу только несколько сообщений, остальные ждут маркеров
+    futures = [outbox.send_message(1, str(i)) for i in range(10)]
+
+    cancelled = outbox.stop(timeout=0.1)
+    assert cancelled > 0
+    assert sum(future.cancelled() for future in futures) == cancelled
+    assert all(future.done() for future in futures)
+    assert not outbox._thread.is_alive()
+
+
+def test_submit_after_stop_fails():
+    outbox = Outbox(_SlowBot(0))
+    outbox.stop()
+    with pytest.raises(RuntimeError):
+        outbox.send_message(1, 'поздно').result(0)
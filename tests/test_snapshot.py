@@ -0,0 +1,29 @@
+import mmap
+import time
+
+from snapshot import Snapshot, Snapshotter, write_snapshot
+
+
+def test_restore_save_restore(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    expires_at = time.time() + 3600
+    write_snapshot(path, sessions=[(1, expires_at, b'first'), (2, expires_at, b'second')],
+                   areas={'saved_at': 1, 'rows': [['1', None, 'Москва']], 'usage': {'1': 3}})
+
+    restored = Snapshot.open(path)
+    assert restored.session(1) == (expires_at, b'first')
+
+    # Сохранение поверх открытого снимка: он переходит на копию в памяти и продолжает работать
+    saver = Snapshotter(lambda: {'sessions': [(3, expires_at, b'third')], 'areas': restored.areas()}, path=path)
+    saver.save()
+    assert not isinstance(restored._map, mmap.mmap)
+    assert restored.session(2) == (expires_at, b'second')
+
+    again = Snapshot.open(path)
+    assert again.session(3) == (expires_at, b'third')
+    assert again.session(1) is None
+    assert again.areas()['usage'] == {'1': 3}
+    saver.save()
+    assert again.session(3) == (expires_at, b'third')
+    restored.close()
+    again.close()
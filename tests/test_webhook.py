@@ -0,0 +1,55 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook import WebhookServer
+
+
+class _Bot:
+    def __init__(self):
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.updates.extend(updates)
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer(_Bot(), path='/webhook', host='127.0.0.1', port=0, workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+    thread.join()
+
+
+def _post(server, body):
+    connection = http.client.HTTPConnection('127.0.0.1', server.httpd.server_address[1], timeout=5)
+    connection.request('POST', '/webhook', body=body.encode('utf-8'))
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+def test_accepts_update(server):
+    assert _post(server, json.dumps({'update_id': 1})) == 200
+
+
+def test_rejects_invalid_json(server):
+    assert _post(server, '{"update_id": ') == 400
+
+
+def test_rejects_update_without_required_fields(server):
+    assert _post(server, json.dumps({'message': {'text': 'привет'}})) == 400
+    assert _post(server, json.dumps({'update_id': 1, 'message': {'text': 'привет'}})) == 400
+
+
+def test_rejects_non_object(server):
+    assert _post(server, json.dumps([1, 2])) == 400
+
+
+def test_rejects_null_update(server):
+    assert _post(server, 'null') == 400
+    assert server.updates.received == 0
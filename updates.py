@@ -0,0 +1,7 @@
+def update_chat_id(update):
+    """ID чата, к которому относится обновление (None для прочих типов)"""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return None
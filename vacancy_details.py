@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+# Сколько карточек вакансий держать в памяти
+DETAILS_CACHE_SIZE = 1000
+
+# Сколько секунд карточка отдается без перепроверки; после - условный запрос к HH.ru
+DETAILS_TTL = 10 * 60
+
+# Для скольких первых вакансий страницы результатов карточки загружаются заранее
+DETAILS_PREFETCH = 3
+DETAILS_PREFETCH_WORKERS = 2
+
+# Поля ответа /vacancies/{id}, которые нужны для показа (остальное не хранится)
+DETAIL_FIELDS = (
+    'id', 'name', 'employer', 'salary', 'area', 'address', 'experience', 'schedule', 'employment',
+    'key_skills', 'description', 'alternate_url', 'archived',
+)
+
+# Ответ, когда вакансии на HH.ru больше нет
+VACANCY_GONE = "Вакансия удалена или скрыта работодателем"
+
+
+class _Entry:
+    __slots__ = ('data', 'etag', 'last_modified', 'checked_at')
+
+    def __init__(self, data, etag, last_modified, checked_at):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = checked_at
+
+
+class VacancyDetails:
+    """
+    Полные карточки вакансий из /vacancies/{id}: загружаются только по запросу
+    или заранее для первых результатов, хранятся в LRU-кэше по ID.
+    Устаревшая карточка перепроверяется условным запросом (If-None-Match /
+    If-Modified-Since): при ответе 304 HH.ru не передает ее заново
+    """
+
+    def __init__(self, fetch, max_size=DETAILS_CACHE_SIZE, ttl=DETAILS_TTL,
+                 prefetch_workers=DETAILS_PREFETCH_WORKERS, normalize=None):
+        # fetch(vacancy_id, headers) -> requests.Response (304 - не ошибка)
+        self.fetch = fetch
+        self.max_size = max_size
+        self.ttl = ttl
+        # normalize(список вакансий) - дополнительная обработка загруженной карточки
+        self.normalize = normalize
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(prefetch_workers, thread_name_prefix='details')
+
+    def get(self, vacancy_id):
+        """Карточка вакансии: (данные, None) или (None, текст ошибки)"""
+        with self._lock:
+            entry = self._entries.get(vacancy_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                self._entries.move_to_end(vacancy_id)
+                self.hits += 1
+                return entry.data, None
+            # Одновременные запросы одной карточки (нажатие и предзагрузка) ждут одной загрузки
+            pending = self._pending.get(vacancy_id)
+            owner = pending is None
+            if owner:
+                pending = self._pending[vacancy_id] = Future()
+                self.misses += 1
+
+        if not owner:
+            return pending.result()
+
+        try:
+            result = self._load(vacancy_id, entry)
+        except Exception as e:
+            result = None, f"Неизвестная ошибка: {str(e)}"
+        with self._lock:
+            del self._pending[vacancy_id]
+        pending.set_result(result)
+        return result
+
+    def is_cached(self, vacancy_id):
+        """Будет ли карточка отдана без нового запроса к HH.ru: она свежая или уже загружается"""
+        with self._lock:
+            entry = self._entries.get(vacancy_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                return True
+            return vacancy_id in self._pending
+
+    def _load(self, vacancy_id, entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        try:
+            response = self.fetch(vacancy_id, headers)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                with self._lock:
+                    self._entries.pop(vacancy_id, None)
+                return None, VACANCY_GONE
+            return self._fallback(entry, f"Ошибка запроса к HH.ru: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            return self._fallback(entry, f"Ошибка запроса к HH.ru: {str(e)}")
+
+        now = time.monotonic()
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                entry.checked_at = now
+                self.revalidated += 1
+            return entry.data, None
+
+        try:
+            payload = response.json()
+        except ValueError as e:
+            return self._fallback(entry, f"Ошибка обработки ответа: {str(e)}")
+        data = {field: payload[field] for field in DETAIL_FIELDS if field in payload}
+        if self.normalize is not None:
+            self.normalize([data])
+
+        with self._lock:
+            self._entries[vacancy_id] = _Entry(
+                data, response.headers.get('ETag'), response.headers.get('Last-Modified'), now
+            )
+            self._entries.move_to_end(vacancy_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return data, None
+
+    @staticmethod
+    def _fallback(entry, error):
+        # Пока HH.ru недоступен, показываем сохраненную карточку, если она есть
+        if entry is not None:
+            return entry.data, None
+        return None, error
+
+    def prefetch(self, vacancy_ids):
+        """Загружает в фоне карточки, которых еще нет в кэше"""
+        with self._lock:
+            missing = [vacancy_id for vacancy_id in vacancy_ids
+                       if vacancy_id not in self._entries and vacancy_id not in self._pending]
+        for vacancy_id in missing:
+            self._executor.submit(self._prefetch, vacancy_id)
+
+    def _prefetch(self, vacancy_id):
+        _, error = self.get(vacancy_id)
+        if error and error != VACANCY_GONE:
+            print(f"Ошибка предзагрузки вакансии {vacancy_id}: {error}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+            }
@@ -0,0 +1,398 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from currency import BASE_CURRENCY
+
+# Сколько секунд полностью выкачанный запрос можно отдавать из локального индекса
+INDEX_FRESHNESS = 30 * 60
+
+# Сколько хранить вакансии, которые больше не встречались в ответах HH.ru
+INDEX_RETENTION = 7 * 24 * 60 * 60
+
+# Фоновая выкачка популярных запросов: как часто и сколько самых частых запросов
+HARVEST_INTERVAL = 15 * 60
+HARVEST_TOP_QUERIES = 20
+
+# Запросы, которые не повторялись дольше этого времени, не выкачиваются
+HARVEST_QUERY_TTL = 24 * 60 * 60
+
+# HH.ru отдает не больше 2000 вакансий по одному запросу
+MAX_HARVEST_RESULTS = 2000
+
+# Ответ поиска, в котором нет ни одной вакансии
+NOT_FOUND = "Вакансий не найдено"
+
+_TOKEN = re.compile(r'\w+')
+
+
+def fts_query(text):
+    """Запрос FTS5: все слова текста должны встретиться (как префиксы слов)"""
+    return ' '.join(f'"{token}"*' for token in _TOKEN.findall(text.lower()))
+
+
+def _as_list(value):
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+class VacancyIndex:
+    """
+    Локальный индекс вакансий в SQLite. Выкачанные запросы отдаются по сохраненной
+    выдаче HH.ru; полнотекстовый индекс FTS5 по названию, работодателю и региону и
+    B-tree индексы по зарплате, региону, опыту и графику нужны для приблизительного
+    поиска, пока HH.ru недоступен
+    """
+
+    def __init__(self, path, expand_area=None, freshness=INDEX_FRESHNESS):
+        self.path = path
+        # expand_area(area_id) -> ID региона и всех вложенных, как при поиске на HH.ru
+        self.expand_area = expand_area or (lambda area_id: [area_id])
+        self.freshness = freshness
+        self._local = threading.local()
+        # Запись идет в одном фоновом потоке, чтобы не задерживать ответы пользователям
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='vacancy-index')
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS vacancies ('
+            'id INTEGER PRIMARY KEY, '
+            'area TEXT, '
+            'experience TEXT, '
+            'schedule TEXT, '
+            'salary_from INTEGER, '
+            'salary_to INTEGER, '
+            'currency TEXT, '
+            'salary_from_base INTEGER, '
+            'salary_to_base INTEGER, '
+            'published_at TEXT NOT NULL, '
+            'indexed_at REAL NOT NULL, '
+            'data TEXT NOT NULL)'
+        )
+        self._migrate(conn)
+        for column in ('area', 'experience', 'schedule', 'salary_to_base', 'published_at', 'indexed_at'):
+            conn.execute(f'CREATE INDEX IF NOT EXISTS vacancies_{column} ON vacancies ({column})')
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS vacancy_text "
+            "USING fts5(name, employer, area_name, tokenize='unicode61')"
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS queries ('
+            'query_key TEXT PRIMARY KEY, '
+            'profession TEXT NOT NULL, '
+            'filters TEXT NOT NULL, '
+            'hits INTEGER NOT NULL, '
+            'requested_at REAL NOT NULL, '
+            'harvested_at REAL, '
+            'complete INTEGER NOT NULL DEFAULT 0)'
+        )
+        # Результаты выкачанного запроса в порядке HH.ru: текст ищется по описанию, навыкам
+        # и синонимам, поэтому состав выдачи хранится как есть, а не ищется заново
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS query_results ('
+            'query_key TEXT NOT NULL, '
+            'rank INTEGER NOT NULL, '
+            'vacancy_id INTEGER NOT NULL, '
+            'PRIMARY KEY (query_key, rank))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS query_results_vacancy ON query_results (vacancy_id)')
+        conn.commit()
+
+    @staticmethod
+    def _migrate(conn):
+        """Добавляет в индекс прежней версии зарплаты в базовой валюте (для рублевых - как есть)"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(vacancies)')}
+        if 'salary_to_base' in columns:
+            return
+        conn.execute('ALTER TABLE vacancies ADD COLUMN salary_from_base INTEGER')
+        conn.execute('ALTER TABLE vacancies ADD COLUMN salary_to_base INTEGER')
+        conn.execute(
+            'UPDATE vacancies SET salary_from_base = salary_from, salary_to_base = salary_to WHERE currency = ?',
+            (BASE_CURRENCY,)
+        )
+        for column in ('salary_from', 'salary_to'):
+            conn.execute(f'DROP INDEX IF EXISTS vacancies_{column}')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def ingest(self, vacancies, indexed_at=None):
+        """Добавляет или обновляет вакансии из ответа /vacancies"""
+        indexed_at = indexed_at or time.time()
+        rows = []
+        texts = []
+        for vacancy in vacancies:
+            try:
+                vacancy_id = int(vacancy['id'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            salary = vacancy.get('salary') or {}
+            # Вилка в базовой валюте (см. CurrencyRates.normalize_page)
+            salary_base = vacancy.get('salary_base') or {}
+            area = vacancy.get('area') or {}
+            rows.append((
+                vacancy_id,
+                area.get('id'),
+                (vacancy.get('experience') or {}).get('id'),
+                (vacancy.get('schedule') or {}).get('id'),
+                salary.get('from'),
+                salary.get('to'),
+                salary.get('currency'),
+                salary_base.get('from'),
+                salary_base.get('to'),
+                vacancy.get('published_at') or '',
+                indexed_at,
+                json.dumps(vacancy, ensure_ascii=False, separators=(',', ':')),
+            ))
+            texts.append((
+                vacancy_id,
+                vacancy.get('name', ''),
+                (vacancy.get('employer') or {}).get('name', ''),
+                area.get('name', ''),
+            ))
+        if not rows:
+            return 0
+
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO vacancies '
+                '(id, area, experience, schedule, salary_from, salary_to, currency, '
+                'salary_from_base, salary_to_base, published_at, indexed_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.executemany('DELETE FROM vacancy_text WHERE rowid = ?', [(text[0],) for text in texts])
+            conn.executemany('INSERT INTO vacancy_text (rowid, name, employer, area_name) VALUES (?, ?, ?, ?)', texts)
+        return len(rows)
+
+    def ingest_async(self, vacancies):
+        """Ставит вакансии в очередь на индексацию"""
+        self._writer.submit(self._ingest_safely, list(vacancies))
+
+    def _ingest_safely(self, vacancies):
+        try:
+            self.ingest(vacancies)
+        except sqlite3.Error as e:
+            print(f"Ошибка индексации вакансий: {e}")
+
+    def store_results(self, query_key, vacancy_ids):
+        """Запоминает выдачу HH.ru по запросу: ID вакансий в порядке ранжирования"""
+        rows = []
+        seen = set()
+        for vacancy_id in vacancy_ids:
+            # Между страницами HH.ru выдача может сдвинуться: повторы пропускаются
+            if vacancy_id not in seen:
+                seen.add(vacancy_id)
+                rows.append((query_key, len(rows), vacancy_id))
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM query_results WHERE query_key = ?', (query_key,))
+            conn.executemany('INSERT INTO query_results (query_key, rank, vacancy_id) VALUES (?, ?, ?)', rows)
+
+    def results_page(self, query_key, page=0, per_page=50):
+        """
+        Страница сохраненной выдачи выкачанного запроса в порядке HH.ru.
+        Результат - ({'items': [...], 'found': N, 'pages': M}, None) или (None, текст ошибки)
+        """
+        conn = self._connection()
+        found = conn.execute(
+            'SELECT COUNT(*) FROM query_results r JOIN vacancies v ON v.id = r.vacancy_id WHERE r.query_key = ?',
+            (query_key,)
+        ).fetchone()[0]
+        rows = conn.execute(
+            'SELECT v.data FROM query_results r JOIN vacancies v ON v.id = r.vacancy_id '
+            'WHERE r.query_key = ? ORDER BY r.rank LIMIT ? OFFSET ?',
+            (query_key, per_page, page * per_page)
+        ).fetchall()
+        if not rows:
+            return None, NOT_FOUND
+
+        return {
+            'items': [json.loads(row[0]) for row in rows],
+            'found': found,
+            'pages': -(-found // per_page)
+        }, None
+
+    def search(self, params, page=0, per_page=50, since=None):
+        """
+        Приблизительный поиск по параметрам запроса к /vacancies (text, only_with_salary, salary,
+        schedule, experience, area; у area и experience может быть список значений) - только
+        запасной вариант, пока HH.ru недоступен: текст ищется лишь по названию, работодателю
+        и региону. since - учитывать только вакансии, проиндексированные не раньше этого времени.
+        Результат - ({'items': [...], 'found': N, 'pages': M}, None) или (None, текст ошибки)
+        """
+        conditions = []
+        args = []
+
+        match = fts_query(params.get('text') or '')
+        if match:
+            conditions.append('id IN (SELECT rowid FROM vacancy_text WHERE vacancy_text MATCH ?)')
+            args.append(match)
+
+        if params.get('only_with_salary') == 'true':
+            conditions.append('(salary_from IS NOT NULL OR salary_to IS NOT NULL)')
+
+        if params.get('salary'):
+            # Вилка позволяет получать не меньше указанной суммы; суммы сравниваются в базовой валюте
+            conditions.append(
+                '(salary_to_base >= ? OR (salary_to_base IS NULL AND salary_from_base IS NOT NULL))'
+            )
+            args.append(int(params['salary']))
+
+        for column in ('schedule', 'experience'):
+            if params.get(column):
+                values = _as_list(params[column])
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                args.extend(values)
+
+        if params.get('area'):
+            area_ids = [area_id for area in _as_list(params['area']) for area_id in self.expand_area(area)]
+            conditions.append(f"area IN ({', '.join('?' * len(area_ids))})")
+            args.extend(area_ids)
+
+        if since is not None:
+            conditions.append('indexed_at >= ?')
+            args.append(since)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = self._connection()
+        found = conn.execute(f'SELECT COUNT(*) FROM vacancies{where}', args).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT data FROM vacancies{where} ORDER BY published_at DESC, id DESC LIMIT ? OFFSET ?',
+            args + [per_page, page * per_page]
+        ).fetchall()
+        if not rows:
+            return None, NOT_FOUND
+
+        return {
+            'items': [json.loads(row[0]) for row in rows],
+            'found': found,
+            'pages': -(-min(found, MAX_HARVEST_RESULTS) // per_page)
+        }, None
+
+    def record_query(self, query_key, profession, filters):
+        """Учитывает запрос пользователя: самые частые выкачиваются в индекс заранее"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO queries (query_key, profession, filters, hits, requested_at) VALUES (?, ?, ?, 1, ?) '
+                'ON CONFLICT (query_key) DO UPDATE SET hits = hits + 1, requested_at = excluded.requested_at',
+                (query_key, profession, json.dumps(filters, ensure_ascii=False), time.time())
+            )
+
+    def fresh_since(self, query_key):
+        """
+        Время выкачки запроса, если индекс содержит все его вакансии и они еще свежие, иначе None
+        """
+        row = self._connection().execute(
+            'SELECT harvested_at FROM queries WHERE query_key = ? AND complete = 1 AND harvested_at >= ?',
+            (query_key, time.time() - self.freshness)
+        ).fetchone()
+        return row[0] if row else None
+
+    def popular_queries(self, limit, requested_after):
+        """Самые частые недавние запросы: список (ключ, профессия, фильтры)"""
+        rows = self._connection().execute(
+            'SELECT query_key, profession, filters FROM queries WHERE requested_at >= ? '
+            'ORDER BY hits DESC LIMIT ?',
+            (requested_after, limit)
+        ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def mark_harvested(self, query_key, started_at, complete):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'UPDATE queries SET harvested_at = ?, complete = ? WHERE query_key = ?',
+                (started_at, int(complete), query_key)
+            )
+
+    def purge(self, older_than):
+        """Удаляет вакансии, которые давно не встречались в ответах HH.ru"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'DELETE FROM query_results WHERE vacancy_id IN (SELECT id FROM vacancies WHERE indexed_at < ?)',
+                (older_than,)
+            )
+            conn.execute(
+                'DELETE FROM vacancy_text WHERE rowid IN (SELECT id FROM vacancies WHERE indexed_at < ?)',
+                (older_than,)
+            )
+            conn.execute('DELETE FROM vacancies WHERE indexed_at < ?', (older_than,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM vacancies').fetchone()[0]
+
+
+class IndexHarvester:
+    """
+    Фоновая выкачка самых частых запросов в локальный индекс целиком:
+    пока выкачка свежая, такие запросы обслуживаются без обращения к HH.ru
+    """
+
+    def __init__(self, index, fetch_page, interval=HARVEST_INTERVAL, top=HARVEST_TOP_QUERIES):
+        # fetch_page(profession, filters, page) -> ({'items', 'found', 'pages'}, ошибка)
+        self.index = index
+        self.fetch_page = fetch_page
+        self.interval = interval
+        self.top = top
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='harvester', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.harvest_once()
+            except Exception as e:
+                print(f"Ошибка выкачки вакансий: {e}")
+
+    def harvest_once(self):
+        now = time.time()
+        for query_key, profession, filters in self.index.popular_queries(self.top, now - HARVEST_QUERY_TTL):
+            if self._stop.is_set():
+                return
+            self.harvest_query(query_key, profession, filters)
+        self.index.purge(now - INDEX_RETENTION)
+
+    def harvest_query(self, query_key, profession, filters):
+        """Выкачивает все страницы запроса; возвращает, удалось ли получить его целиком"""
+        started_at = time.time()
+        page = 0
+        pages = 1
+        found = 0
+        vacancy_ids = []
+        while page < pages:
+            data, error = self.fetch_page(profession, filters, page)
+            if error:
+                # Пустой ответ на первой странице - тоже полный ответ
+                complete = page == 0 and error == NOT_FOUND
+                if complete:
+                    self.index.store_results(query_key, [])
+                self.index.mark_harvested(query_key, started_at, complete)
+                return complete
+            self.index.ingest(data['items'], indexed_at=started_at)
+            vacancy_ids.extend(int(vacancy['id']) for vacancy in data['items'])
+            pages = data['pages']
+            found = data['found']
+            page += 1
+
+        complete = found <= MAX_HARVEST_RESULTS
+        self.index.store_results(query_key, vacancy_ids)
+        self.index.mark_harvested(query_key, started_at, complete)
+        return complete
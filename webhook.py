@@ -0,0 +1,181 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from updates import update_chat_id
+
+# Адрес и порт, на которых принимаются обновления от Telegram
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8443
+
+# Число обработчиков и размер очереди каждого из них
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 100
+
+# Через сколько секунд Telegram стоит повторить отправку при переполнении
+RETRY_AFTER = 1
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь обновлений с пулом обработчиков.
+    Каждый чат закреплен за одним обработчиком, поэтому его обновления
+    обрабатываются по порядку, а разные чаты - параллельно
+    """
+
+    def __init__(self, process, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.process = process
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(q,), name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, update):
+        """
+        Ставит обновление в очередь его чата.
+        Возвращает False, если очередь переполнена и обновление отброшено
+        """
+        chat_id = update_chat_id(update)
+        q = self.queues[hash(chat_id) % len(self.queues)]
+        with self._lock:
+            self.received += 1
+        try:
+            q.put_nowait(update)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.shed += 1
+            return False
+
+    def _work(self, q):
+        while True:
+            update = q.get()
+            if update is None:
+                return
+            try:
+                self.process([update])
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                print(f"Ошибка обработки обновления: {e}")
+                with self._lock:
+                    self.failed += 1
+
+    def stats(self):
+        """Счетчики принятых, обработанных и отброшенных обновлений и глубина очередей"""
+        depths = [q.qsize() for q in self.queues]
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'shed': self.shed,
+            'queue_depth': sum(depths),
+            'max_queue_depth': max(depths),
+        }
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приема обновлений Telegram через webhook
+    вместо long polling
+    """
+
+    def __init__(self, bot, path, secret_token=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.updates = UpdateQueue(bot.process_new_updates, workers=workers, queue_size=queue_size)
+        self.started_at = None
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body=b'', content_type='text/plain', headers=None):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/healthz':
+                    stats = dict(server.updates.stats(), uptime=time.time() - server.started_at)
+                    self._reply(200, json.dumps(stats).encode(), 'application/json')
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if server.secret_token and \
+                        self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret_token:
+                    self._reply(403)
+                    return
+
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    update = types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except (ValueError, KeyError, TypeError):
+                    # Не JSON, не объект или нет обязательных полей обновления
+                    self._reply(400)
+                    return
+                if update is None:
+                    self._reply(400)
+                    return
+
+                if server.updates.submit(update):
+                    self._reply(200)
+                else:
+                    # Очередь переполнена: Telegram повторит отправку позже
+                    self._reply(503, headers={'Retry-After': str(RETRY_AFTER)})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self, public_url=None):
+        """
+        Запускает прием обновлений до прерывания (Ctrl+C).
+        Если указан public_url, регистрирует webhook в Telegram
+        """
+        # Обработчики запускаются пулом очереди, а не внутренним пулом TeleBot
+        self.bot.threaded = False
+        if public_url:
+            self.bot.remove_webhook()
+            self.bot.set_webhook(url=public_url.rstrip('/') + self.path, secret_token=self.secret_token)
+
+        self.started_at = time.time()
+        self.updates.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.updates.stop()